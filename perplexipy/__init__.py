@@ -8,25 +8,65 @@
 
 """
 
-from collections import OrderedDict
+from __future__ import annotations
 
-import importlib.metadata
+from collections import OrderedDict
 
 
-__VERSION__ = importlib.metadata.version('PerplexiPy')
+# Names re-exported from the submodules that a client only needs for
+# deadlines, hedging, metrics, rate limiting, streaming, raw results, request
+# coalescing, or connection pooling; they're imported on first access, like
+# __VERSION__, to keep them out of the import time of command line tools like
+# codex.  The client imports them where it uses them.
+_LAZY_EXPORTS = {
+    'AsyncResponses': 'perplexipy.responses',
+    'AsyncSingleFlight': 'perplexipy.singleflight',
+    'CallCancelled': 'perplexipy.deadline',
+    'CallRecord': 'perplexipy.metrics',
+    'DeadlineExceeded': 'perplexipy.deadline',
+    'HedgePolicy': 'perplexipy.hedging',
+    'ObservedResponses': 'perplexipy.metrics',
+    'Observer': 'perplexipy.metrics',
+    'QueryResult': 'perplexipy.result',
+    'RateLimiter': 'perplexipy.ratelimit',
+    'Responses': 'perplexipy.responses',
+    'RetryPolicy': 'perplexipy.ratelimit',
+    'SingleFlight': 'perplexipy.singleflight',
+    'connectionPools': 'perplexipy.transport',
+    'deadlineFor': 'perplexipy.deadline',
+    'usageOf': 'perplexipy.result',
+}
+
+
+def __getattr__(name: str):
+    # __VERSION__ is resolved on first access; importlib.metadata is a
+    # significant share of the import time of command line tools like codex.
+    if name == '__VERSION__':
+        import importlib.metadata
+
+        globals()['__VERSION__'] = importlib.metadata.version('PerplexiPy')
+        return globals()['__VERSION__']
+    if name in _LAZY_EXPORTS:
+        import importlib
+
+        globals()[name] = getattr(importlib.import_module(_LAZY_EXPORTS[name]), name)
+        return globals()[name]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 from collections import namedtuple
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from perplexipy.errors import PerplexityClientError
-from perplexipy.responses import Responses
+from perplexipy.registry import ModelHealth
+from perplexipy.registry import ModelRegistry
+from perplexipy.tokens import estimateMessagesTokens
 
 load_dotenv()
 
 import os
+import time
 
 
 # +++ constants +++
@@ -42,9 +82,16 @@ PERPLEXITY_API_PREFIX = 'pplx-'
 PERPLEXITY_API_URL = 'https://api.perplexity.ai'
 PERPLEXITY_DEFAULT_MODEL = 'sonar'
 PERPLEXITY_DEFAULT_ROLE = 'user'
+PERPLEXITY_MAX_CONCURRENCY = 8
+"""
+Default number of queries `queryMany()` keeps in flight at the same time.
+"""
+PERPLEXITY_PROBE_QUERY = 'Concise answer: what color is the sky?'
 PERPLEXITY_TIMEOUT = 30.0 # seconds
 PERPLEXITY_VALID_ROLES = { 'assistant', 'system', 'user', } # future proofing.
 
+_DEADLINE_MAX_RETRIES = 2 # as the openai SDK default
+
 
 ModelInfo = namedtuple('ModelInfo', [
     'parameterCount',
@@ -72,12 +119,190 @@ Defaults to Perplexity.
 """
 
 
-class PerplexityClient:
+QueryOutcome = namedtuple('QueryOutcome', [
+    'index',
+    'query',
+    'result',
+    'error',
+])
+"""
+Immutable result of one query issued through `queryMany()`.  Each outcome
+carries either a result or the exception raised while producing it, so that a
+failed query doesn't abort the rest of the batch.
+
+Attributes
+----------
+    index
+Position of the query in the input sequence.
+
+    query
+The query string as submitted.
+
+    result
+The response string, or `None` if the query failed.
+
+    error
+The exception raised by the query, e.g. `openai.BadRequestError`, or `None` if
+the query succeeded.
+"""
+
+
+def _validateKey(key: str):
+    """
+    @private
+    Validate an API `key` before instantiating a client.
+
+    Raises
+    ------
+        PerplexityClientError
+    If the API key is empty, or doesn't match one of the valid API prefixes
+    per the documentation.
+    """
+    if not key:
+        raise PerplexityClientError('Provide a valid key argument during instantiation')
+    if not PERPLEXITY_API_PREFIX in key:
+        raise PerplexityClientError('The key %s is missing the pplx- prefix - invalid API key' % key)
+    if not all(ord(' ') <= ord(c) <= ord('~') for c in key):
+        raise PerplexityClientError('The key %s contains invalid characters' % key)
+
+
+def _isModelError(error: Exception) -> bool:
+    """
+    @private
+    `True` if the service rejected the request because of the model, as
+    opposed to the query or a transient condition.
+    """
+    return getattr(error, 'status_code', None) in (400, 404) and 'model' in str(error).lower()
+
+
+_defaultRegistry = ModelRegistry()
+
+
+class _PerplexityClientBase:
+    """
+    @private
+    State and accessors shared by the synchronous and asynchronous clients.
+    Subclasses create the underlying OpenAI client in `self._client`.
+    """
+    def __init__(self, key: str, endpoint:str = PERPLEXITY_API_URL, unitTest = False, registry: ModelRegistry = None, httpClient = None):
+        _validateKey(key)
+
+        self._endpoint = endpoint
+        self._key = key
+        self._role = PERPLEXITY_DEFAULT_ROLE
+        self._model = PERPLEXITY_DEFAULT_MODEL
+        self._registry = registry if registry is not None else _defaultRegistry
+        self._httpClient = httpClient
+        self._unitTest = unitTest
+
+
+    def _messagesFor(self, query: str) -> list:
+        if not query:
+            raise PerplexityClientError('query cannot be None or empty')
+
+        return [ { 'role': self._role, 'content': query, }, ]
+
+
+    def _recordModel(self, model: str, error: Exception = None):
+        if error is None:
+            health = self._registry.get(self._endpoint, model)
+            if health is None or not health.available:
+                self._registry.record(self._endpoint, model, True)
+        elif _isModelError(error):
+            self._registry.record(self._endpoint, model, False, str(error))
+
+
+    @property
+    def registry(self) -> ModelRegistry:
+        """
+        The `perplexipy.registry.ModelRegistry` where the client looks up and
+        records model health.  Clients share a process-wide, in-memory registry
+        unless one is set during instantiation.
+        """
+        return self._registry
+
+
+    @property
+    def models(self, unitTest = False):
+        """
+        Provide a dictionary of the models supported by Perplexity listed in:
+
+        https://docs.perplexity.ai/docs/model-cards
+
+        Returns
+        -------
+        A dictionary of supported models as the key, with a `perplexypy.ModelInfo`
+        named tuple with the model capabilities description.  The model
+        information attributes are:
+
+        - `parameterCount`
+        - `contextLength`
+        - `modelType`
+        - `availability`
+        """
+        supportedModels = OrderedDict({
+            'sonar-reasoning-pro': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
+            'sonar-reasoning': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
+            'sonar-pro': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
+            'sonar': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
+            'r1-1776': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
+        })
+
+        return supportedModels
+
+
+    @property
+    def model(self) -> str:
+        """
+        Return the model the client uses for requesting responses from the
+        service provider.  Its default value is:  `PERPLEXITY_DEFAULT_MODEL`.
+        """
+        return self._model
+
+    @model.setter
+    def model(self, value: str):
+        """
+        Set the model to use for generating responses.
+
+        Arguments
+        ---------
+            value
+        A string matching one of the supported models.
+
+        Returns
+        -------
+        `None` - setter method decorated as a property.
+
+        The model isn't probed with a query.  Its availability is looked up in
+        the client's `registry`, and the first query made with it validates it
+        and records the result.  Use `checkModel()` to probe it explicitly.
+
+        Raises
+        ------
+        `perplexipy.PerplexityClientError` if the `value` isn't included in the list of
+        supported models, or if the registry recorded it as no longer available.
+        """
+        if not value:
+            raise PerplexityClientError('value cannot be None')
+
+        models = self.models
+        if not self._unitTest:
+            if value not in models:
+                raise PerplexityClientError('value = %s error; supported models: %s' % (value, ', '.join(models)))
+
+        health = self._registry.get(self._endpoint, value)
+        if health is not None and not health.available:
+            raise PerplexityClientError('model %s no longer available in underlying API: %s' % (value, health.error))
+
+        self._model = value
+
+
+class PerplexityClient(_PerplexityClientBase):
     """
     PerplexityClient objects encapsulate all the API functionality.  They can be
     instantiated across multiple contexts, each keeping its own state.
     """
-    def __init__(self, key: str, endpoint:str = PERPLEXITY_API_URL, unitTest = False):
+    def __init__(self, key: str, endpoint:str = PERPLEXITY_API_URL, unitTest = False, cache = None, registry: ModelRegistry = None, httpClient = None, observer: Observer = None, rateLimiter: RateLimiter = None, retryPolicy: RetryPolicy = None, singleFlight: SingleFlight = None, hedgePolicy: HedgePolicy = None, similarityCache = None):
         """
         Create a new instance of `perplexipy.PerplexityClient` using the API
         `key` to connect to the corresponding `endpoint`.
@@ -94,6 +319,53 @@ class PerplexityClient:
         A Boolean to indicate if internal object states need to be modified for
         unit testing.  Has no effect in regular code.
 
+            cache
+        An optional response cache, e.g. a `perplexipy.cache.MemoryCache`,
+        `perplexipy.cache.DiskCache`, or `perplexipy.cache.TieredCache`.  If
+        present, `query()` and `queryBatch()` return cached responses for
+        requests identical in endpoint, model, role, messages, and parameters.
+
+            registry
+        An optional `perplexipy.registry.ModelRegistry`, e.g. one persisted to
+        disk.  Defaults to a process-wide registry kept in memory.
+
+            httpClient
+        An optional `openai.DefaultHttpxClient` or `httpx.Client` for
+        connecting to the endpoint.  Defaults to the connection pool for the
+        endpoint in `perplexipy.transport.connectionPools`, shared by all the
+        clients in the process.
+
+            observer
+        An optional `perplexipy.metrics.Observer`, e.g. a
+        `perplexipy.metrics.MetricsAggregator`, that receives the latency,
+        token counts, and error of every call to the service.
+
+            rateLimiter
+        An optional `perplexipy.ratelimit.RateLimiter`, shared with other
+        clients using the same key, that throttles requests to stay within the
+        requests and tokens per minute budgets.
+
+            retryPolicy
+        An optional `perplexipy.ratelimit.RetryPolicy` for retrying rate limit
+        and transient errors with jittered exponential backoff, honoring the
+        service's `Retry-After`.  It replaces the openai SDK retries.
+
+            singleFlight
+        An optional `perplexipy.singleflight.SingleFlight`, shared with other
+        clients using the same endpoint, that coalesces concurrent identical
+        requests, streaming or not, into a single request to the service.
+
+            hedgePolicy
+        An optional `perplexipy.hedging.HedgePolicy` that sends a duplicate of
+        a non-streaming request once it's slower than a percentile of the
+        recent latencies, and returns the first response.
+
+            similarityCache
+        An optional `perplexipy.similarity.SimilarityCache`, consulted after
+        the `cache`, that answers `query()` and `queryBatch()` with the
+        response to a near-duplicate of the query, e.g. one that differs in
+        case, punctuation, or word order.
+
         Returns
         -------
         An instance of `perplexipy.PerplexityClient` if successful.
@@ -102,6 +374,8 @@ class PerplexityClient:
 
         `model` - the current model to use in queries, user configurable.
 
+        `cache` - the response cache, or `None` if caching is disabled.
+
         The role is fixed to `"user"` for Perplexity calls, per the API
         recommendations.
 
@@ -111,26 +385,255 @@ class PerplexityClient:
         If the API key is empty, or doesn't match one of the valid API prefixes
         per the documentation.
         """
-        if not key:
-            raise PerplexityClientError('Provide a valid key argument during instantiation')
-        if not PERPLEXITY_API_PREFIX in key:
-            raise PerplexityClientError('The key %s is missing the pplx- prefix - invalid API key' % key)
-        if not all(ord(' ') <= ord(c) <= ord('~') for c in key):
-            raise PerplexityClientError('The key %s contains invalid characters' % key)
+        super().__init__(key, endpoint, unitTest, registry, httpClient)
+        self._cache = cache
+        self._observer = observer
+        self._rateLimiter = rateLimiter
+        self._retryPolicy = retryPolicy
+        self._singleFlight = singleFlight
+        self._hedgePolicy = hedgePolicy
+        self._similarityCache = similarityCache
+        self._client = self._makeClient()
+        self._deadlineClient = None
+        self._deadlineRetryPolicy = None
 
-        self._endpoint = endpoint
-        self._key = key
-        self._role = PERPLEXITY_DEFAULT_ROLE
-        self._model = PERPLEXITY_DEFAULT_MODEL
-        self._client = OpenAI(
+
+    def _makeClient(self):
+        # openai is imported on first use; it takes longer to import than the
+        # rest of PerplexiPy combined.
+        from openai import OpenAI
+
+        from perplexipy.transport import connectionPools
+
+        options = { 'max_retries': 0, } if self._retryPolicy else { }
+
+        return OpenAI(
             api_key = self._key,
             base_url = self._endpoint,
             timeout = PERPLEXITY_TIMEOUT,
+            http_client = self._httpClient or connectionPools.httpClient(self._endpoint),
+            **options,
         )
-        self._unitTest = unitTest
 
 
-    def query(self, query: str) -> str:
+    def _withDeadline(self) -> tuple:
+        # (client, retryPolicy) for calls with a deadline.  The SDK's own
+        # retries would sleep past it, so a client without a retry policy uses
+        # one equivalent to the SDK default instead.
+        if self._retryPolicy:
+            return self._client, self._retryPolicy
+        if self._deadlineClient is None:
+            from perplexipy.ratelimit import RetryPolicy
+
+            self._deadlineClient = self._client.with_options(max_retries = 0)
+            self._deadlineRetryPolicy = RetryPolicy(maxRetries = _DEADLINE_MAX_RETRIES)
+
+        return self._deadlineClient, self._deadlineRetryPolicy
+
+
+    def _create(self, model: str, messages: list, stream: bool = False, deadline = None, raw: bool = False):
+        # All requests to the service go through here, subject to the rate
+        # limiter, retry policy, and deadline.  Returns the response and, for
+        # streams, the rate limiter permit, held until the stream ends; see
+        # _streamDone().  With raw, the response is the undecoded body bytes.
+        rateLimiter = self._rateLimiter
+        if deadline is None:
+            client, retryPolicy = self._client, self._retryPolicy
+        else:
+            client, retryPolicy = self._withDeadline()
+        options = { }
+        attempt = 0
+        while True:
+            if deadline is not None:
+                timeout = deadline.requestTimeout(stream)
+                if timeout is not None:
+                    options['timeout'] = timeout
+            permit = None
+            if rateLimiter:
+                permit = rateLimiter.acquire(estimateMessagesTokens(messages), timeout = deadline.remaining() if deadline else None)
+                if permit is None:
+                    from perplexipy.deadline import DeadlineExceeded
+
+                    raise DeadlineExceeded('deadline exceeded waiting for the rate limiter')
+            completions = client.chat.completions.with_raw_response if raw else client.chat.completions
+            try:
+                response = completions.create(
+                    model = model,
+                    messages = messages,
+                    stream = stream,
+                    # TODO: check the OpenAI documentation to see how this is used.
+                    # See:  https://docs.mistral.ai/platform/guardrailing/
+                    # No guardrailing.
+                    # safe_mode = False,
+                    **options,
+                )
+                if raw:
+                    response = response.content
+            except Exception as e:
+                if permit:
+                    rateLimiter.release(permit, error = e)
+                if retryPolicy and retryPolicy.shouldRetry(e, attempt):
+                    if deadline is None:
+                        time.sleep(retryPolicy.delay(e, attempt))
+                    else:
+                        deadline.sleep(retryPolicy.delay(e, attempt))
+                    attempt += 1
+                    continue
+                if deadline is not None:
+                    error = deadline.translate(e)
+                    if error is not e:
+                        raise error from e
+                raise
+            if deadline is not None and deadline.cancelToken is not None and deadline.cancelToken.cancelled:
+                # Cancelled while in flight:  discard the response.
+                from perplexipy.deadline import CallCancelled
+                from perplexipy.result import usageOf
+
+                if permit:
+                    rateLimiter.release(permit, usage = usageOf(response))
+                if stream:
+                    response.close()
+                raise CallCancelled('call cancelled')
+            if permit and not stream:
+                from perplexipy.result import usageOf
+
+                rateLimiter.release(permit, usage = usageOf(response))
+                permit = None
+
+            return response, permit
+
+
+    def _discardHedge(self, result: tuple):
+        # The losing call of a hedged request:  release what it holds.
+        response, permit = result
+        if permit:
+            from perplexipy.result import usageOf
+
+            self._rateLimiter.release(permit, usage = usageOf(response))
+        close = getattr(response, 'close', None)
+        if close:
+            close()
+
+
+    def _hasHedgeCapacity(self, messages: list) -> bool:
+        # Hedges are optional load; they're only sent with room to spare.
+        from perplexipy.transport import hasFreeConnection
+
+        if self._rateLimiter and not self._rateLimiter.hasCapacity(estimateMessagesTokens(messages)):
+            return False
+
+        return hasFreeConnection(getattr(self._client, '_client', None))
+
+
+    def _streamDone(self, permit):
+        if permit is None:
+            return None
+
+        def onDone(usage, error):
+            self._rateLimiter.release(permit, usage = usage, error = error)
+
+        return onDone
+
+
+    def _observe(self, method: str, model: str, started: float, queuedAt: float = None, usage = None, error: Exception = None):
+        from perplexipy.metrics import CallRecord
+
+        self._observer.record(CallRecord(
+            method,
+            model,
+            started-queuedAt if queuedAt else 0.0,
+            time.perf_counter()-started,
+            None,
+            (),
+            getattr(usage, 'prompt_tokens', None),
+            getattr(usage, 'completion_tokens', None),
+            type(error).__name__ if error else None,
+        ))
+
+
+    def _complete(self, messages: list, cache: bool = True, model: str = None, method: str = 'query', queuedAt: float = None, similarity: float = None, deadline = None, raw: bool = False) -> tuple:
+        # Returns the tuple of response texts or, with raw, the response body;
+        # raw bodies are cached as str and aren't shared with the similarity
+        # cache.
+        if deadline is not None:
+            deadline.check()
+        model = model or self.model
+        similar = cache and not raw and self._similarityCache is not None
+        cache = cache and self._cache is not None
+        key = None
+        if cache or self._singleFlight:
+            from perplexipy.cache import cacheKey
+
+            key = cacheKey(self._endpoint, model, self._role, messages, { 'raw': True, } if raw else None)
+        if cache:
+            result = self._cache.get(key)
+            if result is not None:
+                return result if raw else tuple(result)
+        if similar:
+            from perplexipy.cache import cacheKey
+
+            scope = cacheKey(self._endpoint, model, self._role, [ ])
+            text = '\n'.join(message['content'] for message in messages)
+            result = self._similarityCache.get(scope, text, similarity)
+            if result is not None:
+                return tuple(result)
+
+        if self._singleFlight:
+            result = self._singleFlight.do(key, lambda: self._fetch(messages, model, method, queuedAt, key if cache else None, deadline, raw), deadline)
+        else:
+            result = self._fetch(messages, model, method, queuedAt, key if cache else None, deadline, raw)
+        if similar:
+            self._similarityCache.set(scope, text, list(result))
+
+        return result
+
+
+    def _fetch(self, messages: list, model: str, method: str, queuedAt: float = None, key: str = None, deadline = None, raw: bool = False) -> tuple:
+        observer = self._observer
+        if observer:
+            started = time.perf_counter()
+        try:
+            if self._hedgePolicy:
+                response, _ = self._hedgePolicy.run(lambda: self._create(model, messages, deadline = deadline, raw = raw), self._discardHedge, lambda: self._hasHedgeCapacity(messages))
+            else:
+                response, _ = self._create(model, messages, deadline = deadline, raw = raw)
+        except Exception as e:
+            self._recordModel(model, e)
+            if observer:
+                self._observe(method, model, started, queuedAt, error = e)
+            raise
+        self._recordModel(model)
+        if observer:
+            from perplexipy.result import usageOf
+
+            self._observe(method, model, started, queuedAt, usageOf(response))
+
+        if raw:
+            result = response
+            if key:
+                self._cache.set(key, result.decode('utf-8'))
+        else:
+            result = tuple(choice.message.content for choice in response.choices)
+            if key:
+                self._cache.set(key, list(result))
+
+        return result
+
+
+    def _openStream(self, model: str, messages: list, started: float = None, method: str = 'queryStreamable', deadline = None) -> tuple:
+        try:
+            response, permit = self._create(model, messages, stream = True, deadline = deadline)
+        except Exception as e:
+            self._recordModel(model, e)
+            if started is not None:
+                self._observe(method, model, started, error = e)
+            raise
+        self._recordModel(model)
+
+        return response, self._streamDone(permit)
+
+
+    def query(self, query: str, cache: bool = True, similarity: float = None, timeout: float = None, deadline = None, cancelToken = None) -> str:
         """
         Send a single message query to the service, receive a single response.
 
@@ -139,6 +642,26 @@ class PerplexityClient:
             query
         A string with the query in one of the model's supported languages.
 
+            cache
+        Set to `False` to bypass the client's response cache for this call.
+
+            similarity
+        Minimum similarity, 0.0-1.0, for a near-duplicate hit in the client's
+        `similarityCache`; defaults to the cache's threshold.
+
+            timeout
+        Optional maximum seconds for the call, including retries and waits
+        for the rate limiter; `perplexipy.deadline.DeadlineExceeded` is raised
+        when it runs out.
+
+            deadline
+        Optional absolute `time.monotonic()` value by which the call must
+        complete, or a `perplexipy.deadline.Deadline` shared with other calls.
+
+            cancelToken
+        Optional `perplexipy.deadline.CancellationToken`; cancelling it makes
+        the call raise `perplexipy.deadline.CallCancelled`.
+
         Returns
         -------
         A string with a response from the Perplexity service.
@@ -155,26 +678,16 @@ class PerplexityClient:
             PerplexityClientError
         If the query is `None` or empty.
         """
-        if not query:
-            raise PerplexityClientError('query cannot be None or empty')
-
-        messages = [ { 'role': self._role, 'content': query, }, ]
+        from perplexipy.deadline import deadlineFor
 
-        response = self._client.chat.completions.create(
-            model = self.model,
-            messages = messages,
-            # TODO: check the OpenAI documentation to see how this is used.
-            # See:  https://docs.mistral.ai/platform/guardrailing/
-            # No guardrailing.
-            # safe_mode = False,
-        )
+        messages = self._messagesFor(query)
 
-        result = response.choices[0].message.content
+        result = self._complete(messages, cache, method = 'query', similarity = similarity, deadline = deadlineFor(timeout, deadline, cancelToken))[0]
 
         return result
 
 
-    def queryBatch(self, query: str) -> tuple:
+    def queryBatch(self, query: str, cache: bool = True, similarity: float = None, timeout: float = None, deadline = None, cancelToken = None) -> tuple:
         """
         Send a single message query to the service, receive a single response.
 
@@ -183,6 +696,26 @@ class PerplexityClient:
             query
         A string with the query in one of the model's supported languages.
 
+            cache
+        Set to `False` to bypass the client's response cache for this call.
+
+            similarity
+        Minimum similarity, 0.0-1.0, for a near-duplicate hit in the client's
+        `similarityCache`; defaults to the cache's threshold.
+
+            timeout
+        Optional maximum seconds for the call, including retries and waits
+        for the rate limiter; `perplexipy.deadline.DeadlineExceeded` is raised
+        when it runs out.
+
+            deadline
+        Optional absolute `time.monotonic()` value by which the call must
+        complete, or a `perplexipy.deadline.Deadline` shared with other calls.
+
+            cancelToken
+        Optional `perplexipy.deadline.CancellationToken`; cancelling it makes
+        the call raise `perplexipy.deadline.CallCancelled`.
+
         Returns
         -------
         A tuple with a batch of 1 or more response strings.
@@ -199,22 +732,59 @@ class PerplexityClient:
             PerplexityClientError
         If the query is `None` or empty.
         """
-        if not query:
-            raise PerplexityClientError('query cannot be None or empty')
+        from perplexipy.deadline import deadlineFor
 
-        messages = [ { 'role': self._role, 'content': query, }, ]
+        messages = self._messagesFor(query)
 
-        response = self._client.chat.completions.create(
-            model = self.model,
-            messages = messages,
-        )
-
-        result = tuple(choice.message.content for choice in response.choices)
+        result = self._complete(messages, cache, method = 'queryBatch', similarity = similarity, deadline = deadlineFor(timeout, deadline, cancelToken))
 
         return result
 
 
-    def queryStreamable(self, query: str) -> Responses:
+    def queryResult(self, query: str, cache: bool = True, timeout: float = None, deadline = None, cancelToken = None) -> QueryResult:
+        """
+        Send a single message query to the service and return the response
+        text together with its citations, search results, and token usage.
+        The response body isn't parsed into the SDK's pydantic models; the
+        `perplexipy.result.QueryResult` decodes it on first access, which
+        makes it cheaper than `query()` for high-volume workers.
+
+        Arguments
+        ---------
+            query
+        A string with the query in one of the model's supported languages.
+
+            cache
+        Set to `False` to bypass the client's response cache for this call.
+        Cached results keep their citations and usage; the similarity cache
+        isn't used.
+
+            timeout, deadline, cancelToken
+        As for `query()`.
+
+        Returns
+        -------
+        A `perplexipy.result.QueryResult`.
+
+        Raises
+        ------
+            Exception
+        An `openai.BadRequestError` or similar if the query is malformed or has
+        something other than text data.  The error raised passes through
+        whatever the API raised.
+
+            PerplexityClientError
+        If the query is `None` or empty.
+        """
+        from perplexipy.deadline import deadlineFor
+        from perplexipy.result import QueryResult
+
+        messages = self._messagesFor(query)
+
+        return QueryResult(self._complete(messages, cache, method = 'queryResult', deadline = deadlineFor(timeout, deadline, cancelToken), raw = True))
+
+
+    def queryStreamable(self, query: str, timeout: float = None, deadline = None, cancelToken = None, stallTimeout: float = None) -> Responses:
         """
         Send a query and return a long, streamable response.
 
@@ -223,6 +793,22 @@ class PerplexityClient:
             query
         A string with the query in one of the model's supported languages.
 
+            timeout
+        Optional maximum seconds until the stream is complete; iterating it
+        past then raises `perplexipy.deadline.DeadlineExceeded`.
+
+            deadline
+        Optional absolute `time.monotonic()` value by which the stream must be
+        complete, or a `perplexipy.deadline.Deadline` shared with other calls.
+
+            cancelToken
+        Optional `perplexipy.deadline.CancellationToken`; cancelling it closes
+        the stream and releases its connection right away.
+
+            stallTimeout
+        Optional maximum seconds between two chunks; a stalled stream raises
+        `perplexipy.deadline.StreamStalled`.
+
         Returns
         -------
         Returns a `perplexipy.Responses` object for streaming the textual
@@ -241,89 +827,553 @@ class PerplexityClient:
             PerplexityClientError
         If the query is `None` or empty.
         """
-        if not query:
-            raise PerplexityClientError('query cannot be None or empty')
+        from perplexipy.deadline import deadlineFor
 
-        messages = [ { 'role': self._role, 'content': query, }, ]
+        return self._stream(self._messagesFor(query), deadline = deadlineFor(timeout, deadline, cancelToken, stallTimeout))
 
-        response = self._client.chat.completions.create(
-            model = self.model,
-            messages = messages,
-            stream = True,
-        )
 
-        return Responses(response)
+    def _stream(self, messages: list, model: str = None, method: str = 'queryStreamable', deadline = None) -> Responses:
+        model = model or self.model
+        observer = self._observer
+        started = time.perf_counter() if observer else None
+        if self._singleFlight:
+            from perplexipy.cache import cacheKey
 
+            # Subscribers share the upstream stream; its rate limiter permit is
+            # settled when the stream ends, not per subscriber.
+            key = cacheKey(self._endpoint, model, self._role, messages, { 'stream': True, })
+            response = self._singleFlight.stream(key, lambda: self._openStream(model, messages, started, method, deadline))
+            onDone = None
+        else:
+            response, onDone = self._openStream(model, messages, started, method, deadline)
 
-    @property
-    def models(self, unitTest = False):
+        if observer:
+            from perplexipy.metrics import ObservedResponses
+
+            return ObservedResponses(response, observer, method, model, started, onDone = onDone, deadline = deadline)
+        from perplexipy.responses import Responses
+
+        return Responses(response, onDone, deadline)
+
+
+    def checkModel(self, model: str = None) -> ModelHealth:
         """
-        Provide a dictionary of the models supported by Perplexity listed in:
+        Probe a model with a short query and record the result in the client's
+        `registry`.
 
-        https://docs.perplexity.ai/docs/model-cards
+        Arguments
+        ---------
+            model
+        The model name; defaults to the client's current `model`.
 
         Returns
         -------
-        A dictionary of supported models as the key, with a `perplexypy.ModelInfo`
-        named tuple with the model capabilities description.  The model
-        information attributes are:
+        A `perplexipy.registry.ModelHealth` record; its `available` attribute
+        is `False` if the service rejected the model.
 
-        - `parameterCount`
-        - `contextLength`
-        - `modelType`
-        - `availability`
+        Raises
+        ------
+            Exception
+        Whatever the API raised if the probe failed for reasons unrelated to
+        the model, e.g. `openai.APIConnectionError`.
         """
-        supportedModels = OrderedDict({
-            'sonar-reasoning-pro': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
-            'sonar-reasoning': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
-            'sonar-pro': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
-            'sonar': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
-            'r1-1776': ModelInfo('8B', 127072, 'Sonar', 'Perplexity',),
-        })
+        model = model or self.model
+        try:
+            self._complete(self._messagesFor(PERPLEXITY_PROBE_QUERY), cache = False, model = model, method = 'checkModel')
+        except Exception as e:
+            if not _isModelError(e):
+                raise
 
-        return supportedModels
+        return self._registry.get(self._endpoint, model)
 
 
     @property
-    def model(self) -> str:
+    def observer(self) -> Observer:
         """
-        Return the model the client uses for requesting responses from the
-        service provider.  Its default value is:  `PERPLEXITY_DEFAULT_MODEL`.
+        The `perplexipy.metrics.Observer` that receives a record of every call
+        to the service, or `None` if instrumentation is disabled.
         """
-        return self._model
+        return self._observer
 
-    @model.setter
-    def model(self, value: str):
+    @observer.setter
+    def observer(self, value: Observer):
+        self._observer = value
+
+
+    @property
+    def cache(self):
         """
-        Set the model to use for generating responses.
+        The response cache set during instantiation, or `None`.  Its `stats`
+        attribute reports the hit and miss counters.
+        """
+        return self._cache
+
+
+    def queryMany(self, queries, maxConcurrency: int = PERPLEXITY_MAX_CONCURRENCY, ordered: bool = True, timeout: float = None, deadline = None, cancelToken = None):
+        """
+        Send many single message queries to the service concurrently, using a
+        managed pool of up to `maxConcurrency` worker threads.
 
         Arguments
         ---------
-            value
-        A string matching one of the supported models.
+            queries
+        An iterable of query strings.  It's consumed lazily, so it may be a
+        generator over a large input.
+
+            maxConcurrency
+        The maximum number of queries in flight at any given time.
+
+            ordered
+        If `True`, outcomes are yielded in the same order as `queries`.  If
+        `False`, outcomes are yielded as soon as each query completes.
+
+            timeout, deadline, cancelToken
+        Optional limits for the whole batch, as for `query()`.  Queries that
+        hit them yield outcomes with a `perplexipy.deadline.DeadlineExceeded`
+        or `CallCancelled` error.
 
         Returns
         -------
-        `None` - setter method decorated as a property.
+        A generator of `perplexipy.QueryOutcome` objects, one per query.  A
+        query that raises an exception yields an outcome with the `error` set
+        instead of aborting the batch.
 
         Raises
         ------
-        `perplexipy.PerplexityClientError` if the `value` isn't included in the list of
-        supported models.
+            PerplexityClientError
+        If `maxConcurrency` is less than 1.
         """
-        if not value:
-            raise PerplexityClientError('value cannot be None')
+        if maxConcurrency < 1:
+            raise PerplexityClientError('maxConcurrency must be 1 or greater')
+        from perplexipy.deadline import deadlineFor
 
-        models = self.models
-        if not self._unitTest:
-            if value not in models:
-                raise PerplexityClientError('value = %s error; supported models: %s' % (value, ', '.join(models)))
+        return self._queryMany(enumerate(queries), maxConcurrency, ordered, deadlineFor(timeout, deadline, cancelToken))
 
-        self._model = value
 
-        # Validate that the model still works, revert otherwise
+    def _queryQueued(self, query: str, queuedAt: float, deadline = None) -> str:
+        return self._complete(self._messagesFor(query), method = 'queryMany', queuedAt = queuedAt, deadline = deadline)[0]
+
+
+    def _queryMany(self, queries, maxConcurrency: int, ordered: bool, deadline = None):
+        from concurrent.futures import FIRST_COMPLETED
+        from concurrent.futures import ThreadPoolExecutor
+        from concurrent.futures import wait
+
+        # Completed outcomes waiting on an earlier, slower query are buffered
+        # up to this limit; beyond it no new queries are submitted.
+        maxBuffered = 4*maxConcurrency
+        executor = ThreadPoolExecutor(max_workers = maxConcurrency, thread_name_prefix = 'perplexipy')
+        pending = dict()
+        finished = dict()
+        nextIndex = 0
+
+        def submit():
+            while len(pending) < maxConcurrency and len(finished) < maxBuffered:
+                item = next(queries, None)
+                if item is None:
+                    break
+                pending[executor.submit(self._queryQueued, item[1], time.perf_counter(), deadline)] = item
+
+        try:
+            submit()
+            while pending:
+                done, _ = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    index, query = pending.pop(future)
+                    error = future.exception()
+                    outcome = QueryOutcome(index, query, None if error else future.result(), error)
+                    if ordered:
+                        finished[index] = outcome
+                    else:
+                        yield outcome
+                while nextIndex in finished:
+                    yield finished.pop(nextIndex)
+                    nextIndex += 1
+                submit()
+        finally:
+            executor.shutdown(wait = False, cancel_futures = True)
+
+
+class AsyncPerplexityClient(_PerplexityClientBase):
+    """
+    AsyncPerplexityClient objects provide the `perplexipy.PerplexityClient` API
+    as coroutines for use in `asyncio` applications.  They are built on top of
+    `openai.AsyncOpenAI`, so a single event loop can have many queries in
+    flight without blocking or dedicating a thread to each one.
+
+    Example:
+
+    ```python
+    client = AsyncPerplexityClient(key = PERPLEXITY_API_KEY)
+    result = await client.query('Brief answer:  greet the world in Swedish.')
+
+    async for chunk in await client.queryStreamable('List all US presidents'):
+        print(chunk, end = '')
+    ```
+    """
+    def __init__(self, key: str, endpoint:str = PERPLEXITY_API_URL, unitTest = False, registry: ModelRegistry = None, httpClient = None, singleFlight: AsyncSingleFlight = None):
+        """
+        Create a new instance of `perplexipy.AsyncPerplexityClient` using the
+        API `key` to connect to the corresponding `endpoint`.
+
+        Arguments
+        ---------
+            key
+        A valid API key string.
+
+            endpoint
+        A string representing a URL to the Perplexity API.
+
+            unitTest
+        A Boolean to indicate if internal object states need to be modified for
+        unit testing.  Has no effect in regular code.
+
+            registry
+        An optional `perplexipy.registry.ModelRegistry`.  Defaults to the same
+        process-wide registry used by `perplexipy.PerplexityClient`.
+
+            httpClient
+        An optional `openai.DefaultAsyncHttpxClient` or `httpx.AsyncClient`,
+        to share a connection pool among clients running in the same event
+        loop.  Defaults to a new pool for this client.
+
+            singleFlight
+        An optional `perplexipy.singleflight.AsyncSingleFlight` that coalesces
+        concurrent identical requests from tasks in the same event loop.
+
+        Returns
+        -------
+        An instance of `perplexipy.AsyncPerplexityClient` if successful.
+
+        Raises
+        ------
+            PerplexityClientError
+        If the API key is empty, or doesn't match one of the valid API prefixes
+        per the documentation.
+        """
+        super().__init__(key, endpoint, unitTest, registry, httpClient)
+        self._singleFlight = singleFlight
+        self._client = self._makeClient()
+
+
+    def _makeClient(self):
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(
+            api_key = self._key,
+            base_url = self._endpoint,
+            timeout = PERPLEXITY_TIMEOUT,
+            http_client = self._httpClient,
+        )
+
+
+    async def _complete(self, messages: list, model: str = None, raw: bool = False, deadline = None) -> tuple:
+        model = model or self.model
+        if self._singleFlight:
+            from perplexipy.cache import cacheKey
+
+            key = cacheKey(self._endpoint, model, self._role, messages, { 'raw': True, } if raw else None)
+            call = self._singleFlight.do(key, lambda: self._fetch(messages, model, raw, deadline))
+        else:
+            call = self._fetch(messages, model, raw, deadline)
+        if deadline is None:
+            return await call
+
+        # Waiting for a coalesced call is bounded by this caller's limits too.
+        return await deadline.waitFor(call)
+
+
+    async def _fetch(self, messages: list, model: str, raw: bool = False, deadline = None) -> tuple:
+        completions = self._client.chat.completions.with_raw_response if raw else self._client.chat.completions
+        options = { }
+        if deadline is not None:
+            timeout = deadline.requestTimeout()
+            if timeout is not None:
+                options['timeout'] = timeout
+        try:
+            response = await completions.create(
+                model = model,
+                messages = messages,
+                **options,
+            )
+        except Exception as e:
+            self._recordModel(model, e)
+            raise
+        self._recordModel(model)
+
+        if raw:
+            return response.content
+        result = tuple(choice.message.content for choice in response.choices)
+
+        return result
+
+
+    async def query(self, query: str, timeout: float = None, deadline = None, cancelToken = None) -> str:
+        """
+        Send a single message query to the service, receive a single response.
+        Coroutine version of `perplexipy.PerplexityClient.query`.
+
+        Arguments
+        ---------
+            query
+        A string with the query in one of the model's supported languages.
+
+            timeout, deadline, cancelToken
+        As for `perplexipy.PerplexityClient.query`; the request task is
+        cancelled when they're hit, from any thread for `cancelToken`.
+
+        Returns
+        -------
+        A string with a response from the Perplexity service.
+
+        Raises
+        ------
+            Exception
+        An `openai.BadRequestError` or similar if the query is malformed or has
+        something other than text data.  The error raised passes through
+        whatever the API raised.
+
+            PerplexityClientError
+        If the query is `None` or empty.
+        """
+        from perplexipy.deadline import deadlineFor
+
+        messages = self._messagesFor(query)
+
+        result = (await self._complete(messages, deadline = deadlineFor(timeout, deadline, cancelToken)))[0]
+
+        return result
+
+
+    async def queryBatch(self, query: str, timeout: float = None, deadline = None, cancelToken = None) -> tuple:
+        """
+        Send a single message query to the service, receive a batch of one or
+        more responses.  Coroutine version of `perplexipy.PerplexityClient.queryBatch`.
+
+        Arguments
+        ---------
+            query
+        A string with the query in one of the model's supported languages.
+
+            timeout, deadline, cancelToken
+        As for `query()`.
+
+        Returns
+        -------
+        A tuple with a batch of 1 or more response strings.
+
+        Raises
+        ------
+            Exception
+        An `openai.BadRequestError` or similar if the query is malformed or has
+        something other than text data.  The error raised passes through
+        whatever the API raised.
+
+            PerplexityClientError
+        If the query is `None` or empty.
+        """
+        from perplexipy.deadline import deadlineFor
+
+        messages = self._messagesFor(query)
+
+        result = await self._complete(messages, deadline = deadlineFor(timeout, deadline, cancelToken))
+
+        return result
+
+
+    async def queryResult(self, query: str, timeout: float = None, deadline = None, cancelToken = None) -> QueryResult:
+        """
+        Send a single message query to the service and return the response
+        text with its citations, search results, and token usage.  Coroutine
+        version of `perplexipy.PerplexityClient.queryResult`.
+
+        Arguments
+        ---------
+            query
+        A string with the query in one of the model's supported languages.
+
+            timeout, deadline, cancelToken
+        As for `query()`.
+
+        Returns
+        -------
+        A `perplexipy.result.QueryResult`.
+
+        Raises
+        ------
+            Exception
+        An `openai.BadRequestError` or similar if the query is malformed or has
+        something other than text data.  The error raised passes through
+        whatever the API raised.
+
+            PerplexityClientError
+        If the query is `None` or empty.
+        """
+        from perplexipy.deadline import deadlineFor
+        from perplexipy.result import QueryResult
+
+        messages = self._messagesFor(query)
+
+        return QueryResult(await self._complete(messages, raw = True, deadline = deadlineFor(timeout, deadline, cancelToken)))
+
+
+    async def queryStreamable(self, query: str, timeout: float = None, deadline = None, cancelToken = None, stallTimeout: float = None) -> AsyncResponses:
+        """
+        Send a query and return a long, streamable response.  Coroutine version
+        of `perplexipy.PerplexityClient.queryStreamable`.
+
+        Arguments
+        ---------
+            query
+        A string with the query in one of the model's supported languages.
+
+            timeout, deadline, cancelToken, stallTimeout
+        As for `perplexipy.PerplexityClient.queryStreamable`; cancelling the
+        token closes the stream from any thread.
+
+        Returns
+        -------
+        Returns a `perplexipy.responses.AsyncResponses` object for iterating
+        over the textual responses with `async for`.
+
+        Raises
+        ------
+            Exception
+        An `openai.BadRequestError` or similar if the query is malformed or has
+        something other than text data.  The error raised passes through
+        whatever the API raised.
+
+            PerplexityClientError
+        If the query is `None` or empty.
+        """
+        from perplexipy.deadline import deadlineFor
+        from perplexipy.responses import AsyncResponses
+
+        messages = self._messagesFor(query)
+        model = self.model
+        deadline = deadlineFor(timeout, deadline, cancelToken, stallTimeout)
+        if self._singleFlight:
+            from perplexipy.cache import cacheKey
+
+            key = cacheKey(self._endpoint, model, self._role, messages, { 'stream': True, })
+            return AsyncResponses(await self._singleFlight.stream(key, lambda: self._openStream(model, messages, deadline)), deadline = deadline)
+
+        return AsyncResponses((await self._openStream(model, messages, deadline))[0], deadline = deadline)
+
+
+    async def _openStream(self, model: str, messages: list, deadline = None) -> tuple:
+        options = { }
+        if deadline is not None:
+            # Also the stall timeout between chunks; see Deadline.requestTimeout().
+            timeout = deadline.requestTimeout(stream = True)
+            if timeout is not None:
+                options['timeout'] = timeout
+        try:
+            create = self._client.chat.completions.create(
+                model = model,
+                messages = messages,
+                stream = True,
+                **options,
+            )
+            response = await (create if deadline is None else deadline.waitFor(create))
+        except Exception as e:
+            self._recordModel(model, e)
+            raise
+        self._recordModel(model)
+
+        return response, None
+
+
+    async def checkModel(self, model: str = None) -> ModelHealth:
+        """
+        Probe a model with a short query and record the result in the client's
+        `registry`.  Coroutine version of `perplexipy.PerplexityClient.checkModel`.
+        """
+        model = model or self.model
+        try:
+            await self._complete(self._messagesFor(PERPLEXITY_PROBE_QUERY), model = model)
+        except Exception as e:
+            if not _isModelError(e):
+                raise
+
+        return self._registry.get(self._endpoint, model)
+
+
+    async def queryMany(self, queries, maxConcurrency: int = PERPLEXITY_MAX_CONCURRENCY, ordered: bool = True, timeout: float = None, deadline = None, cancelToken = None):
+        """
+        Send many single message queries to the service concurrently, with up
+        to `maxConcurrency` of them in flight in the event loop.  Async
+        generator version of `perplexipy.PerplexityClient.queryMany`:
+
+        ```python
+        async for outcome in client.queryMany(queries, maxConcurrency = 64):
+            print(outcome.index, outcome.error or outcome.result)
+        ```
+
+        Arguments
+        ---------
+            queries
+        An iterable of query strings, consumed lazily.
+
+            maxConcurrency
+        The maximum number of queries in flight at any given time.
+
+            ordered
+        If `True`, outcomes are yielded in the same order as `queries`.  If
+        `False`, outcomes are yielded as soon as each query completes.
+
+            timeout, deadline, cancelToken
+        Optional limits for the whole batch, as for `query()`.  Queries that
+        hit them yield outcomes with a `perplexipy.deadline.DeadlineExceeded`
+        or `CallCancelled` error.
+
+        Returns
+        -------
+        An async generator of `perplexipy.QueryOutcome` objects, one per query.
+
+        Raises
+        ------
+            PerplexityClientError
+        If `maxConcurrency` is less than 1.
+        """
+        import asyncio
+
+        from perplexipy.deadline import deadlineFor
+
+        if maxConcurrency < 1:
+            raise PerplexityClientError('maxConcurrency must be 1 or greater')
+
+        deadline = deadlineFor(timeout, deadline, cancelToken)
+        queries = enumerate(queries)
+        maxBuffered = 4*maxConcurrency
+        pending = dict()
+        finished = dict()
+        nextIndex = 0
+
+        def submit():
+            while len(pending) < maxConcurrency and len(finished) < maxBuffered:
+                item = next(queries, None)
+                if item is None:
+                    break
+                pending[asyncio.ensure_future(self.query(item[1], deadline = deadline))] = item
+
         try:
-            self.query('Concise answer: what color is the sky?')
-        except:
-            raise PerplexityClientError('model %s no longer available in underlying API')
+            submit()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, query = pending.pop(task)
+                    error = task.exception()
+                    outcome = QueryOutcome(index, query, None if error else task.result(), error)
+                    if ordered:
+                        finished[index] = outcome
+                    else:
+                        yield outcome
+                while nextIndex in finished:
+                    yield finished.pop(nextIndex)
+                    nextIndex += 1
+                submit()
+        finally:
+            for task in pending:
+                task.cancel()
 
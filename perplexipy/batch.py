@@ -0,0 +1,216 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+import json
+import os
+import tempfile
+
+
+# +++ constants +++
+
+BATCH_CHECKPOINT_SUFFIX = '.checkpoint'
+BATCH_PROMPT_FIELDS = ( 'prompt', 'query', )
+"""
+JSON object fields, in order of preference, that hold the prompt of a batch
+record.
+"""
+
+
+BatchStats = namedtuple('BatchStats', [
+    'completed',
+    'failed',
+    'skipped',
+])
+"""
+Immutable counters of a batch run.
+
+Attributes
+----------
+    completed
+Records answered and written to the output.
+
+    failed
+Records that raised an error; written to the output with an `error` field, and
+not checkpointed, so that a resumed run retries them; `resumeOutput()` drops
+them from the output first.
+
+    skipped
+Records found in the checkpoint, i.e. completed by a previous run.
+"""
+
+
+# +++ functions +++
+
+def _parseRecord(line: str, lineNumber: int) -> tuple:
+    """
+    Return `(id, record, prompt)` for a JSONL line with a JSON string or an
+    object with a `prompt` or `query` field, and an optional `id`.  Records
+    without an `id` are identified by their line number.
+    """
+    record = json.loads(line)
+    if isinstance(record, str):
+        record = { 'prompt': record, }
+    if not isinstance(record, dict):
+        raise ValueError('line %d: expected a JSON object or string' % lineNumber)
+    record.setdefault('id', lineNumber)
+    prompt = next((record[field] for field in BATCH_PROMPT_FIELDS if record.get(field)), None)
+    if not prompt:
+        raise ValueError('line %d: no %s field' % (lineNumber, ' or '.join(BATCH_PROMPT_FIELDS)))
+
+    return str(record['id']), record, prompt
+
+
+def loadCheckpoint(fileName: str) -> set:
+    """
+    Load the set of record IDs completed by previous runs from the checkpoint
+    `fileName`; empty if the file doesn't exist.
+    """
+    if not fileName or not os.path.exists(fileName):
+        return set()
+    with open(fileName, 'r') as inputFile:
+        return { line.rstrip('\n') for line in inputFile if line.strip() }
+
+
+def _rewrite(fileName: str, lines):
+    # Replace the file atomically, so that a crash leaves either version.
+    descriptor, temporaryName = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(fileName)), prefix = os.path.basename(fileName))
+    try:
+        with os.fdopen(descriptor, 'w') as outputFile:
+            outputFile.writelines(lines)
+        os.replace(temporaryName, fileName)
+    except BaseException:
+        os.unlink(temporaryName)
+        raise
+
+
+def resumeOutput(outputFileName: str, checkpointFileName: str) -> set:
+    """
+    Prepare the output file of an interrupted run for appending the results of
+    a resumed one.  The output is rewritten with a single successful result
+    per record ID:  failed results, which the resumed run retries, duplicates,
+    and a last line cut short by a crash are dropped.  The checkpoint is
+    rewritten to list exactly the records kept, so that only those are
+    skipped.
+
+    Arguments
+    ---------
+        outputFileName
+    Path of the JSONL output of the interrupted run; it may not exist.
+
+        checkpointFileName
+    Path of its checkpoint, as for `runBatch()`.
+
+    Returns
+    -------
+    The set of record IDs kept, as strings.
+    """
+    completedIDs = set()
+
+    def completed():
+        with open(outputFileName, 'r') as inputFile:
+            for line in inputFile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict) or record.get('error') is not None or 'response' not in record:
+                    continue
+                recordID = str(record.get('id'))
+                if recordID not in completedIDs:
+                    completedIDs.add(recordID)
+                    yield line if line.endswith('\n') else line+'\n'
+
+    if os.path.exists(outputFileName):
+        _rewrite(outputFileName, completed())
+    _rewrite(checkpointFileName, ( recordID+'\n' for recordID in sorted(completedIDs) ))
+
+    return completedIDs
+
+
+def runBatch(client, inputFile, outputFile, maxConcurrency: int = 8, checkpointFileName: str = None, ordered: bool = False, progress = None) -> BatchStats:
+    """
+    Answer the prompts of a JSONL stream concurrently and write the results as
+    JSONL.  The input is read lazily and results are written as they arrive,
+    so memory stays flat regardless of the input size.
+
+    Arguments
+    ---------
+        client
+    A `perplexipy.PerplexityClient`.
+
+        inputFile
+    A text stream with one JSON record per line:  a string, or an object with a
+    `prompt` or `query` field and an optional `id`.  Blank lines are skipped.
+
+        outputFile
+    A text stream for the results:  each input record with `response` and
+    `error` fields added, and its line number as the `id` if it had none.
+
+        maxConcurrency
+    The maximum number of queries in flight.
+
+        checkpointFileName
+    Optional path of a file where the ID of each completed record is appended
+    once its result is written.  Records listed in it are skipped, so that an
+    interrupted run resumes where it stopped; call `resumeOutput()` before
+    appending to the previous output.
+
+        ordered
+    If `True`, results are written in input order.
+
+        progress
+    An optional callable `progress(stats)` called with a `BatchStats` after
+    each result.
+
+    Returns
+    -------
+    A `perplexipy.batch.BatchStats` with the run counters.
+
+    Raises
+    ------
+        ValueError
+    If an input line isn't a valid record.
+    """
+    completedIDs = loadCheckpoint(checkpointFileName)
+    pending = dict()
+    counters = { 'completed': 0, 'failed': 0, 'skipped': 0, }
+
+    def prompts():
+        index = 0
+        for lineNumber, line in enumerate(inputFile, 1):
+            if not line.strip():
+                continue
+            recordID, record, prompt = _parseRecord(line, lineNumber)
+            if recordID in completedIDs:
+                counters['skipped'] += 1
+                continue
+            pending[index] = (recordID, record)
+            index += 1
+            yield prompt
+
+    checkpointFile = open(checkpointFileName, 'a') if checkpointFileName else None
+    try:
+        for outcome in client.queryMany(prompts(), maxConcurrency = maxConcurrency, ordered = ordered):
+            recordID, record = pending.pop(outcome.index)
+            record['response'] = outcome.result
+            record['error'] = None if outcome.error is None else '%s: %s' % (type(outcome.error).__name__, outcome.error)
+            outputFile.write(json.dumps(record)+'\n')
+            outputFile.flush()
+            if outcome.error is None:
+                counters['completed'] += 1
+                if checkpointFile:
+                    # Written after the result:  a crash in between repeats the
+                    # record on resume rather than losing it.
+                    checkpointFile.write(recordID+'\n')
+                    checkpointFile.flush()
+            else:
+                counters['failed'] += 1
+            if progress:
+                progress(BatchStats(**counters))
+    finally:
+        if checkpointFile:
+            checkpointFile.close()
+
+    return BatchStats(**counters)
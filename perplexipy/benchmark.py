@@ -0,0 +1,233 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+from perplexipy.mockserver import MockServer
+
+import json
+import platform
+import time
+
+import click
+
+
+# +++ constants +++
+
+BENCHMARK_DEFAULT_CONCURRENCY = 8
+BENCHMARK_DEFAULT_REQUESTS = 200
+BENCHMARK_QUERY = 'Benchmark query: describe the PerplexiPy client overhead in twelve short words please.'
+BENCHMARK_KEY = 'pplx-benchmark'
+
+
+BenchmarkResult = namedtuple('BenchmarkResult', [
+    'name',
+    'requests',
+    'errors',
+    'seconds',
+    'throughput',
+    'p50',
+    'p99',
+])
+"""
+Immutable measurements of one benchmark.  Times are in seconds.
+
+Attributes
+----------
+    name
+The benchmark name, e.g. `'query'` or `'queryStreamable'`.
+
+    requests
+Number of calls issued.
+
+    errors
+Number of calls that raised an exception.
+
+    seconds
+Wall clock time for all the calls.
+
+    throughput
+Calls per second.
+
+    p50, p99
+Median and 99th percentile latency of a single call.
+"""
+
+
+# +++ functions +++
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+
+    return values[min(len(values)-1, int(q*len(values)))]
+
+
+def measure(name: str, call, requests: int = BENCHMARK_DEFAULT_REQUESTS, concurrency: int = 1) -> BenchmarkResult:
+    """
+    Run `call()` `requests` times from `concurrency` threads and measure it.
+
+    Returns
+    -------
+    A `perplexipy.benchmark.BenchmarkResult`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def timed(_):
+        started = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            return None
+        return time.perf_counter()-started
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers = concurrency) as executor:
+            latencies = list(executor.map(timed, range(requests)))
+    else:
+        latencies = [ timed(n) for n in range(requests) ]
+    seconds = time.perf_counter()-started
+    succeeded = [ latency for latency in latencies if latency is not None ]
+
+    return BenchmarkResult(name, requests, requests-len(succeeded), seconds, requests/seconds if seconds else 0.0, _percentile(succeeded, 0.5), _percentile(succeeded, 0.99))
+
+
+def _codexCall(client):
+    import contextlib
+    import io
+
+    import perplexipy.codex
+
+    output = io.StringIO()
+
+    def call():
+        # codex uses a module-level client; point it at the mock server only
+        # for the duration of the call.
+        previous = perplexipy.codex._client
+        perplexipy.codex._client = client
+        try:
+            with contextlib.redirect_stdout(output):
+                perplexipy.codex.codex.main([ BENCHMARK_QUERY, ], standalone_mode = False)
+        finally:
+            perplexipy.codex._client = previous
+        output.seek(0)
+        output.truncate()
+
+    return call
+
+
+def runBenchmarks(requests: int = BENCHMARK_DEFAULT_REQUESTS, concurrency: int = BENCHMARK_DEFAULT_CONCURRENCY, latency: float = 0.0, tokenRate: float = None, errorRate: float = 0.0, names = None) -> dict:
+    """
+    Run the benchmark suite against a local `perplexipy.mockserver.MockServer`,
+    so that the results measure the client's overhead, not the service.
+
+    Arguments
+    ---------
+        requests
+    Calls per benchmark.
+
+        concurrency
+    Threads issuing calls concurrently; the `codex` benchmark always runs
+    sequentially, like the command line tool.
+
+        latency, tokenRate, errorRate
+    The `MockServer` settings.
+
+        names
+    An optional iterable with the names of the benchmarks to run; defaults to
+    all of them.
+
+    Returns
+    -------
+    A JSON-serializable dictionary with the run environment, settings, and one
+    `BenchmarkResult` per benchmark, as a dictionary.
+    """
+    from perplexipy import PerplexityClient
+    from perplexipy import __VERSION__
+
+    with MockServer(latency = latency, tokenRate = tokenRate, errorRate = errorRate, seed = 0) as server:
+        client = PerplexityClient(key = BENCHMARK_KEY, endpoint = server.url)
+        benchmarks = (
+            ('query', lambda: client.query(BENCHMARK_QUERY, cache = False), concurrency),
+            ('queryBatch', lambda: client.queryBatch(BENCHMARK_QUERY, cache = False), concurrency),
+            ('queryStreamable', lambda: client.queryStreamable(BENCHMARK_QUERY).collect(), concurrency),
+            ('codex', _codexCall(client), 1),
+        )
+        results = dict()
+        for name, call, threads in benchmarks:
+            if names and name not in names:
+                continue
+            call() # warm up the connection pool
+            results[name] = measure(name, call, requests, threads)._asdict()
+
+    return {
+        'version': __VERSION__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {
+            'requests': requests,
+            'concurrency': concurrency,
+            'latency': latency,
+            'tokenRate': tokenRate,
+            'errorRate': errorRate,
+        },
+        'results': results,
+    }
+
+
+def compareResults(current: dict, baseline: dict) -> dict:
+    """
+    Compare two `runBenchmarks()` results, e.g. from two PerplexiPy versions.
+
+    Returns
+    -------
+    A dictionary of benchmark name to a dictionary with the ratios
+    current/baseline of `throughput`, `p50`, and `p99`, for the benchmarks
+    present in both.
+    """
+    comparison = dict()
+    for name, result in current['results'].items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            continue
+        comparison[name] = { metric: result[metric]/previous[metric] if result[metric] and previous[metric] else None for metric in ( 'throughput', 'p50', 'p99', ) }
+
+    return comparison
+
+
+# +++ command line +++
+
+@click.command('benchmark')
+@click.option('--requests', '-n', default = BENCHMARK_DEFAULT_REQUESTS, show_default = True, help = 'Calls per benchmark.')
+@click.option('--concurrency', '-c', default = BENCHMARK_DEFAULT_CONCURRENCY, show_default = True, help = 'Concurrent threads.')
+@click.option('--latency', default = 0.0, show_default = True, help = 'Mock server latency in seconds.')
+@click.option('--token-rate', 'tokenRate', default = None, type = float, help = 'Mock server tokens per second.')
+@click.option('--error-rate', 'errorRate', default = 0.0, show_default = True, help = 'Fraction of requests failing with 429.')
+@click.option('--output', '-o', 'outputFileName', default = None, type = click.Path(dir_okay = False), help = 'Save the results to this JSON file.')
+@click.option('--compare', 'baselineFileName', default = None, type = click.Path(exists = True, dir_okay = False), help = 'Compare against a previous results file.')
+@click.argument('names', nargs = -1)
+def benchmark(requests: int, concurrency: int, latency: float, tokenRate: float, errorRate: float, outputFileName: str, baselineFileName: str, names: tuple):
+    """
+    Benchmark the PerplexiPy client against a local mock server.  NAMES
+    selects benchmarks: query, queryBatch, queryStreamable, codex.
+    """
+    report = runBenchmarks(requests, concurrency, latency, tokenRate, errorRate, names)
+    click.echo('%-16s %8s %7s %10s %10s %10s' % ('benchmark', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms'))
+    for name, result in report['results'].items():
+        click.echo('%-16s %8d %7d %10.1f %10.3f %10.3f' % (name, result['requests'], result['errors'], result['throughput'], (result['p50'] or 0.0)*1000.0, (result['p99'] or 0.0)*1000.0))
+    if outputFileName:
+        with open(outputFileName, 'w') as outputFile:
+            json.dump(report, outputFile, indent = 2)
+    if baselineFileName:
+        with open(baselineFileName, 'r') as inputFile:
+            baseline = json.load(inputFile)
+        click.echo('\nCompared to %s (version %s):' % (baselineFileName, baseline.get('version')))
+        for name, ratios in compareResults(report, baseline).items():
+            click.echo('%-16s %s' % (name, '  '.join('%s x%.2f' % (metric, ratio) for metric, ratio in ratios.items() if ratio is not None)))
+
+
+if '__main__' == __name__:
+    benchmark()
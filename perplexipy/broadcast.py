@@ -0,0 +1,316 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.errors import PerplexityClientError
+from perplexipy.responses import Responses
+
+import threading
+import time
+
+
+# +++ constants +++
+
+BROADCAST_BLOCK = 'block'
+"""
+Slow consumer policy:  the upstream isn't read further until the slowest
+subscriber frees a buffer slot, or until the `timeout` expires and it's dropped.
+"""
+BROADCAST_DEFAULT_BUFFER = 1024
+"""
+Default ring buffer size, in chunks.
+"""
+BROADCAST_DROP = 'drop'
+"""
+Slow consumer policy:  the upstream is read as fast as the fastest subscriber
+reads it; subscribers that fall a full buffer behind are dropped.
+"""
+
+
+# +++ classes +++
+
+class BroadcastOverrun(PerplexityClientError):
+    """
+    Raised to a subscriber dropped for falling behind the broadcast.
+    """
+    def __init__(self, errorMessage):
+        super().__init__(errorMessage)
+
+
+class Subscription:
+    """
+    Iterator over the text chunks of a `perplexipy.broadcast.Broadcaster`, from
+    the oldest chunk in its buffer when it subscribed.  Close it when done so
+    that it doesn't hold back the other subscribers.
+    """
+    def __init__(self, broadcaster, position: int):
+        self._broadcaster = broadcaster
+        self._position = position
+        self._skipped = position
+        self._dropped = False
+        self._closed = False
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self) -> str:
+        return self._broadcaster._next(self)
+
+
+    def text(self) -> str:
+        """
+        Read the rest of the broadcast.
+
+        Returns
+        -------
+        The remaining chunks joined into a string.
+        """
+        return ''.join(self)
+
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._broadcaster._unsubscribe(self)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *_):
+        self.close()
+
+
+    @property
+    def skipped(self) -> int:
+        """
+        Chunks at the start of the broadcast that were no longer buffered when
+        this subscription started; 0 for a complete replay.
+        """
+        return self._skipped
+
+
+    @property
+    def dropped(self) -> bool:
+        """
+        `True` if the subscription was dropped for falling behind.
+        """
+        return self._dropped
+
+
+class Broadcaster:
+    """
+    Tee for a single streamed response to many consumers, e.g. the websocket
+    clients waiting for the same answer.  The upstream stream is read once,
+    on demand by the subscribers, into a ring buffer of `bufferSize` chunks,
+    so memory stays bounded no matter how long the stream or how many
+    subscribers.  Subscribers may join at any time and replay the stream from
+    the oldest buffered chunk.  Thread-safe.
+
+    ```python
+    broadcaster = Broadcaster(client.queryStreamable(query), policy = BROADCAST_DROP)
+    for websocket in clients:
+        threading.Thread(target = relay, args = (broadcaster.subscribe(), websocket)).start()
+    ```
+    """
+    def __init__(self, responses, bufferSize: int = BROADCAST_DEFAULT_BUFFER, policy: str = BROADCAST_BLOCK, timeout: float = None):
+        """
+        Arguments
+        ---------
+            responses
+        A `perplexipy.responses.Responses` object, or any iterator of text
+        chunks.
+
+            bufferSize
+        Number of chunks buffered for replay and for subscribers behind the
+        fastest one.
+
+            policy
+        What happens to a subscriber a full buffer behind:
+        `BROADCAST_BLOCK`, backpressure, or `BROADCAST_DROP`.
+
+            timeout
+        With `BROADCAST_BLOCK`, seconds to wait for a slow subscriber before
+        dropping it, or `None` to wait as long as needed.
+
+        Raises
+        ------
+            PerplexityClientError
+        If `bufferSize` is less than 1 or `policy` is unknown.
+        """
+        if bufferSize < 1:
+            raise PerplexityClientError('bufferSize must be 1 or greater')
+        if policy not in (BROADCAST_BLOCK, BROADCAST_DROP):
+            raise PerplexityClientError('policy must be %s or %s' % (BROADCAST_BLOCK, BROADCAST_DROP))
+        self._responses = responses
+        self._iterator = iter(responses)
+        self._buffer = [ None, ]*bufferSize
+        self._size = bufferSize
+        self._policy = policy
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._head = 0
+        self._reading = False
+        self._finished = False
+        self._error = None
+        self._subscriptions = set()
+        self._dropped = 0
+
+
+    def subscribe(self) -> Subscription:
+        """
+        Start a new subscription at the oldest buffered chunk.
+
+        Returns
+        -------
+        A `perplexipy.broadcast.Subscription` iterator.
+        """
+        with self._condition:
+            subscription = Subscription(self, max(0, self._head-self._size))
+            self._subscriptions.add(subscription)
+
+        return subscription
+
+
+    def _drop(self, subscription: Subscription):
+        # Called with the condition held.
+        subscription._dropped = True
+        self._subscriptions.discard(subscription)
+        self._dropped += 1
+        self._condition.notify_all()
+
+
+    def _unsubscribe(self, subscription: Subscription):
+        with self._condition:
+            self._subscriptions.discard(subscription)
+            self._condition.notify_all()
+
+
+    def _waitForSpace(self) -> bool:
+        # Called with the condition held, by the reader under BROADCAST_BLOCK.
+        # The next chunk overwrites chunk head-size; wait until nobody still
+        # needs it.  The reader itself is never the slow one:  it's at the
+        # head.  Returns False if the broadcast finished in the meantime.
+        oldest = self._head-self._size
+        deadline = None if self._timeout is None else time.monotonic()+self._timeout
+        while True:
+            if self._finished:
+                return False
+            slow = [ subscription for subscription in self._subscriptions if subscription._position <= oldest ]
+            if not slow:
+                return True
+            wait = None if deadline is None else deadline-time.monotonic()
+            if wait is not None and wait <= 0.0:
+                for subscription in slow:
+                    self._drop(subscription)
+                return True
+            self._condition.wait(wait)
+
+
+    def _finish(self, error: Exception = None):
+        # Called with the condition held.
+        self._finished = True
+        self._error = error
+        self._condition.notify_all()
+
+
+    def _next(self, subscription: Subscription) -> str:
+        with self._condition:
+            while True:
+                if subscription._dropped:
+                    raise BroadcastOverrun('subscriber fell more than %d chunks behind' % self._size)
+                position = subscription._position
+                if position < self._head:
+                    if position < self._head-self._size:
+                        self._drop(subscription)
+                        continue
+                    chunk = self._buffer[position%self._size]
+                    # Advanced with the condition held, so that a reader
+                    # waiting for space never sees a stale position.
+                    subscription._position = position+1
+                    self._condition.notify_all()
+                    return chunk
+                if self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    raise StopIteration
+                if not self._reading:
+                    self._reading = True
+                    if self._policy == BROADCAST_BLOCK and self._head >= self._size and not self._waitForSpace():
+                        self._reading = False
+                        continue
+                    break
+                self._condition.wait()
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            with self._condition:
+                self._reading = False
+                self._finish()
+            raise
+        except Exception as e:
+            with self._condition:
+                self._reading = False
+                self._finish(e)
+            raise
+        if isinstance(self._responses, Responses):
+            # The ring buffer holds the text; don't let the upstream object
+            # accumulate all of it too.
+            self._responses._chunks.clear()
+        with self._condition:
+            self._reading = False
+            self._buffer[self._head%self._size] = chunk
+            self._head += 1
+            subscription._position = self._head
+            self._condition.notify_all()
+
+        return chunk
+
+
+    def close(self):
+        """
+        Close the upstream stream; subscribers read what's still buffered and
+        then stop.
+        """
+        with self._condition:
+            if not self._finished:
+                self._finish()
+        close = getattr(self._responses, 'close', None)
+        if close:
+            close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *_):
+        self.close()
+
+
+    @property
+    def chunks(self) -> int:
+        """
+        Chunks read from upstream so far.
+        """
+        return self._head
+
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscriptions)
+
+
+    @property
+    def dropped(self) -> int:
+        """
+        Subscribers dropped for falling behind.
+        """
+        return self._dropped
+
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
@@ -0,0 +1,325 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import OrderedDict
+from collections import namedtuple
+
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+import zlib
+
+
+# +++ constants +++
+
+CACHE_DEFAULT_MAX_ENTRIES = 1024
+CACHE_FILE_NAME = 'response-cache.sqlite'
+"""
+Default file name of the `DiskCache` database, stored in the PerplexiPy user
+configuration directory, the same one used by `perplexipy.codex`.
+"""
+
+
+CacheStats = namedtuple('CacheStats', [
+    'hits',
+    'misses',
+    'entries',
+    'evictions',
+])
+"""
+Immutable snapshot of a cache's counters.
+
+Attributes
+----------
+    hits
+Number of lookups that returned a cached value.
+
+    misses
+Number of lookups that found no value, or an expired one.
+
+    entries
+Number of values currently stored in the cache.
+
+    evictions
+Number of values removed because of size or TTL limits.
+"""
+
+
+# +++ functions +++
+
+def cacheKey(endpoint: str, model: str, role: str, messages: list, params: dict = None) -> str:
+    """
+    Build a cache key from all the request attributes that affect the
+    response.
+
+    Arguments
+    ---------
+        endpoint
+    The service URL.
+
+        model
+    The model name.
+
+        role
+    The role used for the query messages.
+
+        messages
+    The list of messages sent to the service.
+
+        params
+    A dictionary of generation parameters, or `None`.
+
+    Returns
+    -------
+    A hex digest string, stable across processes and Python versions.
+    """
+    payload = json.dumps([ endpoint, model, role, messages, params or { }, ], sort_keys = True, separators = (',', ':'))
+
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _defaultCachePath() -> pathlib.Path:
+    from appdirs import AppDirs
+
+    return pathlib.Path(AppDirs(appname = 'PerplexiPy').user_config_dir)
+
+
+# +++ classes +++
+
+class MemoryCache:
+    """
+    In-process, thread-safe LRU cache with optional TTL eviction.
+    """
+    def __init__(self, maxEntries: int = CACHE_DEFAULT_MAX_ENTRIES, ttl: float = None):
+        """
+        Arguments
+        ---------
+            maxEntries
+        The maximum number of values held; the least recently used value is
+        evicted when a new one would exceed it.
+
+            ttl
+        Time to live in seconds for each value, or `None` for no expiration.
+        """
+        self._entries = OrderedDict()
+        self._maxEntries = maxEntries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+
+    def get(self, key: str):
+        """
+        Return the value stored for `key`, or `None` on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self._evictions += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+            return entry[1]
+
+
+    def set(self, key: str, value):
+        """
+        Store `value` under `key`, evicting the least recently used values if
+        the cache is full.
+        """
+        expires = time.monotonic()+self._ttl if self._ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last = False)
+                self._evictions += 1
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+    @property
+    def stats(self) -> CacheStats:
+        """
+        A `perplexipy.cache.CacheStats` snapshot of the cache counters.
+        """
+        with self._lock:
+            return CacheStats(self._hits, self._misses, len(self._entries), self._evictions)
+
+
+class DiskCache:
+    """
+    Persistent cache backed by a SQLite database.  Values are stored as
+    zlib-compressed JSON.  Safe for use across threads and processes.
+    """
+    def __init__(self, fileName: str = None, ttl: float = None, compressionLevel: int = 6):
+        """
+        Arguments
+        ---------
+            fileName
+        Path to the SQLite database.  Defaults to `CACHE_FILE_NAME` in the
+        PerplexiPy user configuration directory.
+
+            ttl
+        Time to live in seconds for each value, or `None` for no expiration.
+
+            compressionLevel
+        The zlib compression level, 0-9.
+        """
+        if not fileName:
+            fileName = _defaultCachePath() / CACHE_FILE_NAME
+        fileName = pathlib.Path(fileName)
+        os.makedirs(fileName.parent, exist_ok = True)
+
+        self._fileName = fileName
+        self._ttl = ttl
+        self._compressionLevel = compressionLevel
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # sqlite3 is imported only when a disk cache is used.
+        import sqlite3
+
+        self._connection = sqlite3.connect(str(fileName), check_same_thread = False, isolation_level = None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL, value BLOB)')
+
+
+    @property
+    def fileName(self) -> pathlib.Path:
+        return self._fileName
+
+
+    def get(self, key: str):
+        """
+        Return the value stored for `key`, or `None` on a miss.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT expires, value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[0] is not None and row[0] < time.time():
+                self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._evictions += 1
+                row = None
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+
+        return json.loads(zlib.decompress(row[1]))
+
+
+    def set(self, key: str, value):
+        """
+        Store `value`, which must be JSON serializable, under `key`.
+        """
+        expires = time.time()+self._ttl if self._ttl else None
+        blob = zlib.compress(json.dumps(value, separators = (',', ':')).encode('utf-8'), self._compressionLevel)
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, expires, value) VALUES (?, ?, ?)', (key, expires, blob))
+
+
+    def purge(self) -> int:
+        """
+        Delete all expired values.
+
+        Returns
+        -------
+        The number of values deleted.
+        """
+        with self._lock:
+            count = self._connection.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?', (time.time(),)).rowcount
+            self._evictions += count
+
+        return count
+
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM responses')
+
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+    @property
+    def stats(self) -> CacheStats:
+        """
+        A `perplexipy.cache.CacheStats` snapshot of the cache counters.
+        """
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return CacheStats(self._hits, self._misses, entries, self._evictions)
+
+
+class TieredCache:
+    """
+    Combines several caches, fastest first, e.g. a `MemoryCache` in front of a
+    `DiskCache`.  A hit in a slower tier is copied to all the faster ones.
+
+    ```python
+    cache = TieredCache(MemoryCache(ttl = 3600.0), DiskCache(ttl = 86400.0))
+    client = PerplexityClient(key = key, cache = cache)
+    ```
+    """
+    def __init__(self, *tiers):
+        self._tiers = tiers
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+
+    @property
+    def tiers(self) -> tuple:
+        return self._tiers
+
+
+    def get(self, key: str):
+        for n, tier in enumerate(self._tiers):
+            value = tier.get(key)
+            if value is not None:
+                for fasterTier in self._tiers[:n]:
+                    fasterTier.set(key, value)
+                with self._lock:
+                    self._hits += 1
+                return value
+        with self._lock:
+            self._misses += 1
+
+        return None
+
+
+    def set(self, key: str, value):
+        for tier in self._tiers:
+            tier.set(key, value)
+
+
+    def clear(self):
+        for tier in self._tiers:
+            tier.clear()
+
+
+    @property
+    def stats(self) -> CacheStats:
+        """
+        A `perplexipy.cache.CacheStats` snapshot of the combined lookups.  The
+        `entries` and `evictions` counters are those of the slowest tier.
+        """
+        last = self._tiers[-1].stats if self._tiers else CacheStats(0, 0, 0, 0)
+        with self._lock:
+            return CacheStats(self._hits, self._misses, last.entries, last.evictions)
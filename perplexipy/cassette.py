@@ -0,0 +1,445 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from perplexipy import PERPLEXITY_API_URL
+from perplexipy import PERPLEXITY_TIMEOUT
+from perplexipy.errors import PerplexityClientError
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+# +++ constants +++
+
+CASSETTE_AUTO = 'auto'
+"""
+Replay recorded requests, record the others.
+"""
+CASSETTE_HOST = '127.0.0.1'
+CASSETTE_MODES = ( 'auto', 'record', 'replay', )
+CASSETTE_MODE_VARIABLE = 'PERPLEXITY_CASSETTE_MODE'
+CASSETTE_PATH_VARIABLE = 'PERPLEXITY_CASSETTE'
+"""
+Environment variable with the cassette path used by `cassetteFromEnvironment()`,
+and through it by `perplexipy.codex` and the live API tests.
+"""
+CASSETTE_RECORD = 'record'
+"""
+Send every request upstream and record it.
+"""
+CASSETTE_REPLAY = 'replay'
+"""
+Answer from the cassette only; unrecorded requests fail with HTTP 404.
+"""
+CASSETTE_SPEED_VARIABLE = 'PERPLEXITY_CASSETTE_SPEED'
+
+# Request headers not forwarded upstream while recording; the rest, including
+# Authorization, are passed through and never stored.
+_HOP_HEADERS = frozenset(( 'accept-encoding', 'connection', 'content-length', 'host', 'keep-alive', 'transfer-encoding', ))
+# Response headers kept in the cassette, for retry and rate limiting logic.
+_KEPT_HEADERS = ( 'retry-after', 'retry-after-ms', 'x-ratelimit-limit-requests', 'x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests', )
+
+
+# +++ functions +++
+
+def requestKey(path: str, body: bytes) -> str:
+    """
+    The cassette key of a request:  a digest of its path and JSON body, with
+    the keys sorted, so that equivalent requests match regardless of how the
+    client serialized them.  Headers, including the API key, aren't part of it.
+
+    Arguments
+    ---------
+        path
+    The request path, e.g. `'/chat/completions'`.
+
+        body
+    The request body.
+
+    Returns
+    -------
+    A hex digest string.
+    """
+    try:
+        request = json.loads(body or b'{}')
+    except ValueError:
+        request = body.decode('utf-8', 'replace')
+    payload = json.dumps([ path.rstrip('/'), request, ], sort_keys = True, separators = (',', ':'))
+
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cassetteFromEnvironment() -> 'CassetteServer':
+    """
+    Start a `CassetteServer` configured from the environment:
+
+    - `PERPLEXITY_CASSETTE`:  the cassette path; if unset, nothing is started
+    - `PERPLEXITY_CASSETTE_MODE`:  `replay` (default), `record`, or `auto`
+    - `PERPLEXITY_CASSETTE_SPEED`:  replay speed factor, default 1.0; 0 replays
+      without waits
+
+    ```bash
+    PERPLEXITY_CASSETTE=tests/live.jsonl.gz PERPLEXITY_CASSETTE_MODE=record pytest
+    PERPLEXITY_CASSETTE=tests/live.jsonl.gz PERPLEXITY_CASSETTE_SPEED=0 pytest
+    ```
+
+    Returns
+    -------
+    The running `CassetteServer`, whose `url` is the client `endpoint` to use,
+    or `None` if `PERPLEXITY_CASSETTE` is unset.
+
+    Raises
+    ------
+        PerplexityClientError
+    If the mode or speed is invalid.
+    """
+    path = os.environ.get(CASSETTE_PATH_VARIABLE)
+    if not path:
+        return None
+    try:
+        speed = float(os.environ.get(CASSETTE_SPEED_VARIABLE, '1.0'))
+    except ValueError:
+        raise PerplexityClientError('%s must be a number' % CASSETTE_SPEED_VARIABLE)
+
+    return CassetteServer(Cassette(path), os.environ.get(CASSETTE_MODE_VARIABLE, CASSETTE_REPLAY), speed = speed or None).start()
+
+
+# +++ classes +++
+
+class Cassette:
+    """
+    Recorded request/response pairs in a JSON Lines file, gzip-compressed if
+    its name ends in `.gz`.  Each line holds the request key, the status, the
+    response body or, for streams, its events with their arrival times.
+    Recordings are appended as they happen, so an interrupted run keeps what
+    it recorded.
+
+    Identical requests recorded more than once are replayed in recording
+    order; once the recordings run out, the last one repeats, which lets a
+    short recording drive a long load run.
+    """
+    def __init__(self, path: str):
+        """
+        Arguments
+        ---------
+            path
+        The cassette file; it's created on the first recording if it doesn't
+        exist.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._interactions = dict()
+        self._replays = dict()
+        if os.path.exists(path):
+            with self._open('r') as cassetteFile:
+                for line in cassetteFile:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        self._interactions.setdefault(interaction['key'], [ ]).append(interaction)
+
+
+    def _open(self, mode: str):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode+'t', encoding = 'utf-8')
+
+        return open(self.path, mode, encoding = 'utf-8')
+
+
+    def find(self, key: str) -> dict:
+        """
+        The next recorded interaction for the request `key`, or `None`.
+        """
+        with self._lock:
+            interactions = self._interactions.get(key)
+            if not interactions:
+                return None
+            replays = self._replays.get(key, 0)
+            self._replays[key] = replays+1
+
+            return interactions[min(replays, len(interactions)-1)]
+
+
+    def add(self, interaction: dict):
+        """
+        Record an `interaction` and append it to the file.
+        """
+        line = json.dumps(interaction, separators = (',', ':'))+'\n'
+        with self._lock:
+            self._interactions.setdefault(interaction['key'], [ ]).append(interaction)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            with self._open('a') as cassetteFile:
+                cassetteFile.write(line)
+
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._interactions
+
+
+    def __len__(self) -> int:
+        return sum(len(interactions) for interactions in self._interactions.values())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    disable_nagle_algorithm = True
+    protocol_version = 'HTTP/1.1'
+
+
+    def log_message(self, *_):
+        pass
+
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+    def _send(self, status: int, body: bytes, contentType: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or { }).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _sendChunk(self, data: bytes):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+    def _startStream(self, status: int, contentType: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in (headers or { }).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+
+    def do_POST(self):
+        server = self.server.cassette
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        key = requestKey(self.path, body)
+        interaction = server.cassette.find(key) if server.mode != CASSETTE_RECORD else None
+        if interaction:
+            server._count('replayed')
+            self._replay(server, interaction)
+        elif server.mode == CASSETTE_REPLAY:
+            server._count('misses')
+            message = 'No recorded response for %s %s in cassette %s' % (self.command, self.path, server.cassette.path)
+            self._send(404, json.dumps({ 'error': { 'message': message, 'type': 'cassette_miss', }, }).encode('utf-8'), 'application/json')
+        else:
+            self._record(server, key, body)
+
+
+    def _replay(self, server, interaction: dict):
+        started = time.monotonic()
+        speed = server.speed
+        if 'events' not in interaction:
+            if speed:
+                time.sleep(interaction.get('latency', 0.0)/speed)
+            self._send(interaction['status'], interaction['body'].encode('utf-8'), interaction['contentType'], interaction.get('headers'))
+            return
+
+        self._startStream(interaction['status'], interaction['contentType'], interaction.get('headers'))
+        for offset, event in interaction['events']:
+            if speed:
+                delay = started+offset/speed-time.monotonic()
+                if delay > 0.0:
+                    time.sleep(delay)
+            self._sendChunk(event.encode('utf-8'))
+        self._sendChunk(b'')
+
+
+    def _record(self, server, key: str, body: bytes):
+        headers = { name: value for name, value in self.headers.items() if name.lower() not in _HOP_HEADERS }
+        request = urllib.request.Request(server.upstream+self.path, data = body, headers = headers, method = 'POST')
+        started = time.monotonic()
+        try:
+            response = urllib.request.urlopen(request, timeout = PERPLEXITY_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            response = e
+        except OSError as e:
+            # Not recorded:  a network failure says nothing about the service.
+            server._count('errors')
+            self._send(502, json.dumps({ 'error': { 'message': 'Upstream unavailable: %s' % e, 'type': 'upstream_unavailable', }, }).encode('utf-8'), 'application/json')
+            return
+
+        with response:
+            status = response.getcode()
+            contentType = response.headers.get('Content-Type', 'application/json')
+            kept = { name: response.headers[name] for name in _KEPT_HEADERS if response.headers.get(name) }
+            interaction = { 'key': key, 'status': status, 'contentType': contentType, }
+            if kept:
+                interaction['headers'] = kept
+            if contentType.startswith('text/event-stream'):
+                interaction['events'] = self._recordStream(response, started, status, contentType, kept)
+                server.cassette.add(interaction)
+                server._count('recorded')
+                self._sendChunk(b'')
+                return
+            responseBody = response.read()
+        interaction['latency'] = round(time.monotonic()-started, 4)
+        interaction['body'] = responseBody.decode('utf-8')
+        server.cassette.add(interaction)
+        server._count('recorded')
+        self._send(status, responseBody, contentType, kept)
+
+
+    def _recordStream(self, response, started: float, status: int, contentType: str, headers: dict) -> list:
+        # Forward each server-sent event as it arrives, recording it with its
+        # offset from the start of the request.  The caller ends the stream
+        # once the interaction is saved.
+        self._startStream(status, contentType, headers)
+        events = [ ]
+        lines = [ ]
+        for line in response:
+            lines.append(line)
+            if not line.strip():
+                event = b''.join(lines)
+                lines = [ ]
+                events.append([ round(time.monotonic()-started, 4), event.decode('utf-8'), ])
+                self._sendChunk(event)
+        if lines:
+            event = b''.join(lines)
+            events.append([ round(time.monotonic()-started, 4), event.decode('utf-8'), ])
+            self._sendChunk(event)
+
+        return events
+
+
+class CassetteServer:
+    """
+    Local record/replay server for the OpenAI-compatible `/chat/completions`
+    protocol, for deterministic, network-free tests and reproducible load
+    runs.  In `record` mode it forwards each request to the real service and
+    stores the response, streamed events included with their timing, in a
+    `perplexipy.cassette.Cassette`; in `replay` mode it answers from the
+    cassette alone, at the recorded pace scaled by `speed`.  Clients only need
+    their `endpoint` pointed at it.
+
+    ```python
+    cassette = Cassette('tests/cassettes/queries.jsonl.gz')
+    with CassetteServer(cassette, CASSETTE_AUTO) as server:
+        client = PerplexityClient(key = key, endpoint = server.url)
+        print(client.query('Hello'))
+    ```
+
+    Requests match on their path and JSON body; the API key isn't recorded.
+    """
+    def __init__(self, cassette: Cassette, mode: str = CASSETTE_REPLAY, upstream: str = PERPLEXITY_API_URL, speed: float = 1.0, port: int = 0):
+        """
+        Arguments
+        ---------
+            cassette
+        The `perplexipy.cassette.Cassette` to replay from and record to.
+
+            mode
+        `'replay'`, `'record'`, or `'auto'`; see the `CASSETTE_*` constants.
+
+            upstream
+        The service URL requests are recorded from.
+
+            speed
+        Replay speed factor:  2.0 replays twice as fast as recorded; `None` or
+        0 replays without waiting.
+
+            port
+        TCP port on the loopback interface; 0 picks a free one.
+
+        Raises
+        ------
+            PerplexityClientError
+        If `mode` is invalid.
+        """
+        if mode not in CASSETTE_MODES:
+            raise PerplexityClientError('mode = %s error; valid modes: %s' % (mode, ', '.join(CASSETTE_MODES)))
+        self.cassette = cassette
+        self.mode = mode
+        self.upstream = upstream.rstrip('/')
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._counters = { 'replayed': 0, 'recorded': 0, 'misses': 0, 'errors': 0, }
+        self._httpServer = ThreadingHTTPServer((CASSETTE_HOST, port), _Handler)
+        self._httpServer.daemon_threads = True
+        self._httpServer.cassette = self
+        self._thread = None
+
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+    def start(self):
+        """
+        Serve requests in a daemon thread.  Returns the server, for chaining.
+        """
+        if not self._thread:
+            self._thread = threading.Thread(target = self._httpServer.serve_forever, name = 'perplexipy-cassette', daemon = True)
+            self._thread.start()
+
+        return self
+
+
+    def stop(self):
+        if self._thread:
+            self._httpServer.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpServer.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL to pass as the client `endpoint`.
+        """
+        return 'http://%s:%d' % self._httpServer.server_address[:2]
+
+
+    @property
+    def replayed(self) -> int:
+        """
+        Number of requests answered from the cassette.
+        """
+        return self._counters['replayed']
+
+
+    @property
+    def recorded(self) -> int:
+        """
+        Number of requests recorded from upstream.
+        """
+        return self._counters['recorded']
+
+
+    @property
+    def misses(self) -> int:
+        """
+        Number of requests not found in the cassette in `replay` mode.
+        """
+        return self._counters['misses']
@@ -1,16 +1,22 @@
 # See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
 
 
+# prompt_toolkit, yaml, the map-reduce and proxy modules, and the
+# PerplexityClient, which loads openai, are imported or instantiated only by
+# the code paths that use them, so that one-shot queries, --help, and
+# --version start fast.
+
 from appdirs import AppDirs
 from datetime import datetime
-from prompt_toolkit import HTML
-from prompt_toolkit import PromptSession
-from prompt_toolkit import print_formatted_text as printF
-from prompt_toolkit.enums import EditingMode
 
+from perplexipy import PERPLEXITY_API_URL
 from perplexipy import PERPLEXITY_DEFAULT_MODEL
+from perplexipy import PERPLEXITY_MAX_CONCURRENCY
 from perplexipy import PerplexityClient
-from perplexipy import __VERSION__
+from perplexipy.config import ConfigFile
+from perplexipy.errors import PerplexityClientError
+from perplexipy.registry import REGISTRY_FILE_NAME
+from perplexipy.registry import ModelRegistry
 
 import os
 import pathlib
@@ -18,15 +24,22 @@ import select
 import sys
 
 import click
-import yaml
 
 
 # *** constants ***
 
+ARG_BATCH = 'batch'
+"""
+@private
+"""
 ARG_REPL = 'repl'
 """
 @private
 """
+ARG_SERVE = 'serve'
+"""
+@private
+"""
 
 CONFIG_PATH = pathlib.Path(AppDirs(appname = 'PerplexiPy').user_config_dir)
 """
@@ -52,6 +65,11 @@ HISTORY_FILE_NAME = CONFIG_PATH / 'history'
 @private
 """
 
+MODEL_REGISTRY_FILE_NAME = CONFIG_PATH / REGISTRY_FILE_NAME
+"""
+@private
+"""
+
 QUERY_CRISP = 'Concise, code only reply to this prompt: '
 """
 @private
@@ -74,15 +92,13 @@ def _die(msg: str, exitCode: int = 99):
 
 # *** globals ***
 
-try:
-    _client = PerplexityClient(key = os.environ['PERPLEXITY_API_KEY'])
-except:
-    _die('PERPLEXITY_API_KEY undefined in the environment or .env file', 2)
-
-_client.model = DEFAULT_MODEL_NAME
+_cassetteServer = None # _endpoint() initializes it
+_client = None # _getClient() initializes it
+_config = None # _getConfig() initializes it
 _lastQuery = None
 _lastResponse = None
 _queryCodeStyle = True
+_streamOutput = True
 
 
 # *** classes and objects ***
@@ -90,7 +106,46 @@ _queryCodeStyle = True
 # *** implementation ***
 
 def _helpUser() -> str:
-    return "Syntax: codex repl | 'your coding question here in single quotes'\n"
+    return "Syntax: codex repl | batch in.jsonl [-o out.jsonl] | serve [--port N] | 'your coding question here in single quotes'\n"
+
+
+def _endpoint() -> str:
+    """
+    Return the service URL or, if `PERPLEXITY_CASSETTE` is set, the URL of a
+    `perplexipy.cassette.CassetteServer` recording or replaying the service,
+    started on first use.
+    """
+    global _cassetteServer
+
+    # Checked before importing perplexipy.cassette, which loads http.server.
+    if not os.environ.get('PERPLEXITY_CASSETTE'):
+        return PERPLEXITY_API_URL
+    if not _cassetteServer:
+        from perplexipy.cassette import cassetteFromEnvironment
+
+        try:
+            _cassetteServer = cassetteFromEnvironment()
+        except (OSError, PerplexityClientError) as e:
+            _die('Invalid cassette: %s' % e, 2)
+
+    return _cassetteServer.url
+
+
+def _getClient() -> PerplexityClient:
+    """
+    Return the module's `PerplexityClient`, instantiating it on first use.
+    """
+    global _client
+
+    if not _client:
+        registry = ModelRegistry(MODEL_REGISTRY_FILE_NAME)
+        try:
+            _client = PerplexityClient(key = os.environ['PERPLEXITY_API_KEY'], endpoint = _endpoint(), registry = registry)
+        except (KeyError, PerplexityClientError):
+            _die('PERPLEXITY_API_KEY undefined in the environment or .env file', 2)
+        _client.model = DEFAULT_MODEL_NAME
+
+    return _client
 
 
 def codexCore(userQuery: str) -> str:
@@ -106,18 +161,47 @@ def codexCore(userQuery: str) -> str:
     -------
     The result of the query, or `None` if the query was empty.
     """
-    global _client
-
     result = None
     if userQuery:
-        if not _client:
-            _client = PerplexityClient(key = os.environ['PERPLEXITY_API_KEY'])
-            _client.model = DEFAULT_MODEL_NAME
-        result = _client.query(userQuery)
+        result = _getClient().query(userQuery)
 
     return result
 
 
+def _streamQuery(userQuery: str) -> tuple:
+    """
+    Send a user query to the model and echo the response to the console as it
+    streams in.  Ctrl-C cancels the query and releases its connection.
+
+    Arguments
+    ---------
+        userQuery
+    A string with the user query.
+
+    Returns
+    -------
+    A tuple `(text, cancelled)` with the response text, or the part of it
+    received before a Ctrl-C, and `True` if the user cancelled the query.
+    """
+    responses = None
+    cancelled = False
+    try:
+        # Opening the stream waits for the service too; Ctrl-C may come then.
+        responses = _getClient().queryStreamable(userQuery)
+        for chunk in responses:
+            click.echo(chunk, nl = False)
+    except KeyboardInterrupt:
+        if responses is not None:
+            responses.close()
+        cancelled = True
+    click.echo()
+    if cancelled:
+        click.secho('Cancelled', fg = 'bright_yellow')
+
+    # A closed stream returns only the chunks read before it was closed.
+    return responses.text() if responses is not None else '', cancelled
+
+
 def _stdinHasData() -> bool:
     """
     Checks if there's data pending to be processed off `stdin`.  It's a
@@ -130,15 +214,81 @@ def _stdinHasData() -> bool:
     return select.select([sys.stdin], [], [], 0) == ([sys.stdin], [], [])
 
 
-def _assembleInput() -> str:
-    result = ''
-    for line in sys.stdin:
-        result += line
+def _assembleInput(compactor = None) -> list:
+    from perplexipy.mapreduce import readInput
+
+    try:
+        return readInput(compactor.compact(sys.stdin) if compactor else sys.stdin)
+    except PerplexityClientError as e:
+        _die('Invalid input: %s' % e, 3)
+
+
+def _makeCompactor(compact: bool, compactLevel: int, compactCode: bool):
+    """
+    Return a `perplexipy.compaction.Compactor` for the command line options,
+    or `None` if compaction wasn't requested.
+    """
+    if not (compact or compactLevel or compactCode):
+        return None
+    from perplexipy.compaction import COMPACTION_DEFAULT_LEVEL
+    from perplexipy.compaction import Compactor
+
+    return Compactor(compactLevel or COMPACTION_DEFAULT_LEVEL, compactCode)
+
+
+def _reportCompaction(compactor):
+    stats = compactor.stats
+    saved = stats.bytesIn-stats.bytesOut
+    click.echo('Compacted input: %d -> %d lines, %d bytes (%.0f%%) and ~%d tokens saved' % (stats.linesIn, stats.linesOut, saved, 100.0*saved/stats.bytesIn if stats.bytesIn else 0.0, stats.tokensIn-stats.tokensOut), err = True)
+
+
+def _queryInput(instruction: str, source, size: int) -> str:
+    """
+    Query about an input from stdin or a file, and display the result.  Inputs
+    larger than the active model's context are split into chunks that are
+    queried concurrently, and their answers combined by a final query.
+
+    Arguments
+    ---------
+        instruction
+    The query about the input.
+
+        source
+    An iterable of input lines, or a `perplexipy.mapreduce.openInput` object.
+
+        size
+    The input size in characters or bytes.
+
+    Returns
+    -------
+    The response string.
+    """
+    from perplexipy.mapreduce import chunkLines
+    from perplexipy.mapreduce import inputBudget
+    from perplexipy.mapreduce import mapReduce
+
+    budget = inputBudget(_getClient(), instruction)
+    if size <= budget:
+        text = source.text() if hasattr(source, 'text') else ''.join(source)
+        return _displayQuery(instruction+text)
+
+    total = -(-size//budget)
+    progress = None
+    if sys.stderr.isatty():
+        def progress(done, total):
+            click.echo('\rchunks: %d/%d' % (done, total), err = True, nl = False)
+
+    click.echo('Input of %d characters exceeds the model context; querying it in about %d chunks' % (size, total), err = True)
+    result = mapReduce(_getClient(), instruction, chunkLines(source, budget), PERPLEXITY_MAX_CONCURRENCY, progress, total)
+    if progress:
+        click.echo(err = True)
+    click.echo(result)
 
     return result
 
 
 def _activeModel(modelID: int = 0) -> str:
+    _client = _getClient()
     if modelID:
         try:
             modelsList = list(_client.models.keys())
@@ -154,6 +304,9 @@ def _activeModel(modelID: int = 0) -> str:
 
 
 def _REPLHello():
+    from prompt_toolkit import HTML
+    from prompt_toolkit import print_formatted_text as printF
+
     click.clear()
     printF(HTML('PerplexiPy <b><ansigreen>Codex playground - coding, scripting, and sysops assistant</ansigreen></b>'))
     _activeModel()
@@ -190,15 +343,18 @@ def _displayModels() -> list:
     _activeModel()
     print('Available models:\n')
     n = 1
-    for model in _client.models.keys():
+    for model in _getClient().models.keys():
         print('%2d - %s' % (n, model))
         n += 1
     print()
 
-    return list(_client.models.keys())
+    return list(_getClient().models.keys())
 
 
-def _editingMode(session: PromptSession, mode = None):
+def _editingMode(session: 'PromptSession', mode = None):
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.enums import EditingMode
+
     if mode:
         mode = mode.lower()
         newEditingMode = EditingMode.EMACS if mode == 'emacs' else EditingMode.VI
@@ -219,45 +375,48 @@ def _queryStyle(newStyle: str = None):
     return _queryCodeStyle
 
 
-def _makeQuery(userQuery: str) -> str:
+def _styledQuery(userQuery: str) -> str:
     if _queryCodeStyle:
         userQuery = QUERY_DETAILED+userQuery
 
-    return codexCore(userQuery)
+    return userQuery
+
+
+def _makeQuery(userQuery: str) -> str:
+    return codexCore(_styledQuery(userQuery))
 
 
 def _displayVersion():
-    click.secho('PerplexiPy Codex version %s\n' % __VERSION__, fg='bright_green')
+    from perplexipy import __VERSION__
 
+    click.secho('PerplexiPy Codex version %s\n' % __VERSION__, fg='bright_green')
 
-def _saveConfigTo(config: dict, fileName: str = CONFIG_FILE_NAME, pathName = CONFIG_PATH):
-    if not os.path.exists(pathName):
-        os.makedirs(pathName)
-    with open(fileName, 'w') as outputFile:
-        yaml.dump(config, outputFile)
 
+def _getConfig() -> ConfigFile:
+    """
+    Return the REPL configuration, loading it on first use.  It's served from
+    memory afterwards, and changes are written behind.
+    """
+    global _config
 
-def _loadConfigFrom(fileName: str = CONFIG_FILE_NAME, pathName = CONFIG_PATH) -> dict:
-    if os.path.exists(fileName):
-        with open(fileName, 'r') as inputFile:
-            config = yaml.safe_load(inputFile)
-    else:
-        config = {
+    if not _config:
+        _config = ConfigFile(CONFIG_FILE_NAME, defaults = {
             'activeModel': DEFAULT_MODEL_NAME,
             'editingMode': 'vi',
             'queryCodeStyle': _queryCodeStyle,
-        }
-        _saveConfigTo(config, fileName, pathName)
-    return config
+        })
+
+    return _config
 
 
 def _displayConfigInfo():
-    click.secho('Config file: %s' % CONFIG_FILE_NAME)
-    click.secho(str(_loadConfigFrom())+'\n')
+    config = _getConfig()
+    click.secho('Config file: %s' % config.fileName)
+    click.secho(str(config.asDict())+'\n')
 
 
 def _displayWorkArea():
-    config = _loadConfigFrom()
+    config = _getConfig()
     path = pathlib.Path(config.get('workArea', '~')).expanduser().resolve()
     click.secho('Work area: %s' % path.as_posix())
 
@@ -266,7 +425,7 @@ def _saveResult(query, result):
     if query == None and result == None:
         click.secho('Nothing to save', fg='yellow')
     else:
-        config = _loadConfigFrom()
+        config = _getConfig()
         now = datetime.now().strftime('%Y%m%d-%H:%M:%S')
         fileName = 'prompt-%s.md' % now
         path = pathlib.Path(config.get('workArea', '~')).expanduser().resolve()
@@ -288,7 +447,10 @@ def _runREPL() -> str:
     The word "REPL" to signal to the `codex` command that it received valid
     input.
     """
-    config = _loadConfigFrom()
+    from prompt_toolkit import PromptSession
+
+    _client = _getClient()
+    config = _getConfig()
     session = PromptSession()
     model = config['activeModel']
     lastQuery = None
@@ -296,7 +458,6 @@ def _runREPL() -> str:
     if model not in _client.models.keys():
         model = tuple(_client.models.keys())[0]
         config['activeModel'] = model
-        _saveConfigTo(config)
     _activeModel(list(_client.models.keys()).index(config['activeModel'])+1)
     _REPLHello()
     session = _editingMode(session, config['editingMode'])
@@ -315,7 +476,6 @@ def _runREPL() -> str:
                     try:
                         model = int(parts[1])
                         config['activeModel'] = _activeModel(model)
-                        _saveConfigTo(config)
                     except:
                         # Invalid input, ignore and leave the current model
                         # active.
@@ -334,7 +494,6 @@ def _runREPL() -> str:
                     try:
                         session = _editingMode(session, parts[1])
                         config['editingMode'] = parts[1]
-                        _saveConfigTo(config)
                     except:
                         pass
                 else:
@@ -347,7 +506,6 @@ def _runREPL() -> str:
                 if len(parts) > 1:
                     queryStyleType = parts[1]
                     config['queryCodeStyle'] = _queryStyle(queryStyleType)
-                    _saveConfigTo(config)
                 else:
                     _queryStyle()
             elif command == '/version':
@@ -356,25 +514,138 @@ def _runREPL() -> str:
                 if len(parts) > 1:
                     path = parts[1]
                     config['workArea'] = path
-                    _saveConfigTo(config)
                 else:
                     _displayWorkArea()
             continue
         else:
             lastQuery = userQuery
-        result = _makeQuery(userQuery)
+        if _streamOutput:
+            result, _ = _streamQuery(_styledQuery(userQuery))
+        else:
+            result = _makeQuery(userQuery)
+            print('%s' % result)
         lastResponse = result
-        print('%s' % result)
         click.secho('--------------------------------------------------', fg='green')
         print()
 
     return 'REPL'
 
 
-@click.command('codex')
-@click.version_option(__VERSION__, prog_name = 'codex')
-@click.argument('tokens', nargs = -1, type = click.STRING)
-def codex(tokens: list) -> str:
+def _isBatch(tokens: list) -> bool:
+    # 'codex batch processing in bash' is a query; 'codex batch in.jsonl' and
+    # 'codex batch --help' are batch runs.
+    return len(tokens) > 1 and tokens[0].lower() == ARG_BATCH and (tokens[1].startswith('-') or os.path.exists(tokens[1]))
+
+
+@click.command('batch')
+@click.argument('source', metavar = 'INPUT', type = click.Path(allow_dash = True, dir_okay = False))
+@click.option('--output', '-o', 'outputFileName', default = '-', type = click.Path(allow_dash = True, dir_okay = False), help = 'JSONL output file; stdout by default.')
+@click.option('--concurrency', '-c', default = PERPLEXITY_MAX_CONCURRENCY, show_default = True, type = click.IntRange(1), help = 'Queries in flight.')
+@click.option('--checkpoint', 'checkpointFileName', default = None, type = click.Path(dir_okay = False), help = 'Checkpoint file; defaults to OUTPUT.checkpoint when OUTPUT is a file.')
+@click.option('--ordered', is_flag = True, help = 'Write results in input order.')
+def codexBatch(source: str, outputFileName: str, concurrency: int, checkpointFileName: str, ordered: bool):
+    """
+    Answer the prompts in the JSONL file INPUT concurrently, one JSON string or
+    object with a prompt field per line, and write the results as JSONL.
+    Interrupted runs resume from the checkpoint without re-sending completed
+    prompts.
+    """
+    from perplexipy.batch import BATCH_CHECKPOINT_SUFFIX
+    from perplexipy.batch import resumeOutput
+    from perplexipy.batch import runBatch
+
+    if outputFileName != '-' and not checkpointFileName:
+        checkpointFileName = outputFileName+BATCH_CHECKPOINT_SUFFIX
+    resuming = bool(checkpointFileName) and os.path.exists(checkpointFileName)
+    if resuming and outputFileName != '-':
+        # Failed records are retried; keep one result per record.
+        resumeOutput(outputFileName, checkpointFileName)
+
+    progress = None
+    if sys.stderr.isatty():
+        def progress(stats):
+            click.echo('\rcompleted: %d  failed: %d  skipped: %d' % stats, err = True, nl = False)
+
+    with click.open_file(source, 'r') as inputFile, click.open_file(outputFileName, 'a' if resuming else 'w') as outputFile:
+        try:
+            stats = runBatch(_getClient(), inputFile, outputFile, concurrency, checkpointFileName, ordered, progress)
+        except ValueError as e:
+            _die('Invalid input: %s' % e, 3)
+    click.echo('\rcompleted: %d  failed: %d  skipped: %d' % stats, err = True)
+    if stats.failed:
+        sys.exit(4)
+
+
+def _isServe(tokens: list) -> bool:
+    # 'codex serve' and 'codex serve --port 8000' run the proxy; 'codex serve
+    # static files with nginx' is a query.
+    return tokens[0].lower() == ARG_SERVE and (len(tokens) == 1 or tokens[1].startswith('-'))
+
+
+@click.command('serve')
+@click.option('--host', default = None, help = 'Interface to listen on.  [default: 127.0.0.1]')
+@click.option('--port', '-p', default = None, type = click.IntRange(0, 65535), help = 'TCP port.  [default: 8089]')
+@click.option('--concurrency', '-c', default = None, type = click.IntRange(1), help = 'Requests in flight per client.  [default: 8]')
+@click.option('--cache', 'cacheType', default = 'memory', show_default = True, type = click.Choice([ 'memory', 'disk', 'none', ]), help = 'Response cache.')
+def codexServe(host: str, port: int, concurrency: int, cacheType: str):
+    """
+    Serve a local OpenAI-compatible /chat/completions endpoint that forwards
+    requests through one shared client, with response caching, request
+    coalescing, per-client concurrency limits, and metrics at /metrics.
+    Point clients' endpoint or base URL at it.
+    """
+    from perplexipy.cache import DiskCache
+    from perplexipy.cache import MemoryCache
+    from perplexipy.metrics import MetricsAggregator
+    from perplexipy.proxy import PROXY_CLIENT_CONCURRENCY
+    from perplexipy.proxy import PROXY_DEFAULT_PORT
+    from perplexipy.proxy import PROXY_HOST
+    from perplexipy.proxy import ProxyServer
+    from perplexipy.singleflight import SingleFlight
+
+    # The option defaults are resolved here so that perplexipy.proxy is only
+    # imported by codex serve.
+    host = PROXY_HOST if host is None else host
+    port = PROXY_DEFAULT_PORT if port is None else port
+    concurrency = PROXY_CLIENT_CONCURRENCY if concurrency is None else concurrency
+    cache = { 'memory': MemoryCache, 'disk': DiskCache, 'none': lambda: None, }[cacheType]()
+    try:
+        client = PerplexityClient(key = os.environ['PERPLEXITY_API_KEY'], endpoint = _endpoint(), cache = cache, registry = ModelRegistry(MODEL_REGISTRY_FILE_NAME), observer = MetricsAggregator(), singleFlight = SingleFlight())
+    except (KeyError, PerplexityClientError):
+        _die('PERPLEXITY_API_KEY undefined in the environment or .env file', 2)
+    client.model = DEFAULT_MODEL_NAME
+    try:
+        server = ProxyServer(client, host, port, concurrency)
+    except OSError as e:
+        _die('Cannot listen on %s:%d: %s' % (host, port, e), 3)
+    click.echo('codex serve: listening on %s' % server.url, err = True)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+def _displayQuery(userQuery: str) -> str:
+    if _streamOutput:
+        result, cancelled = _streamQuery(userQuery)
+        if cancelled:
+            sys.exit(130)
+    else:
+        result = codexCore(userQuery)
+        click.echo(result)
+
+    return result
+
+
+@click.command('codex', context_settings = { 'ignore_unknown_options': True, 'allow_interspersed_args': False, })
+@click.version_option(package_name = 'PerplexiPy', prog_name = 'codex')
+@click.option('--no-stream', 'noStream', is_flag = True, help = 'Display the response once it is complete instead of as it streams in.')
+@click.option('--file', '-f', 'inputFileName', default = None, type = click.Path(exists = True, dir_okay = False), help = 'Query about the contents of this file.')
+@click.option('--compact', is_flag = True, help = 'Compact stdin or file input before sending it:  collapse repeated lines, strip ANSI escapes, elide blobs.')
+@click.option('--compact-level', 'compactLevel', default = None, type = click.IntRange(1, 3), help = 'Compaction aggressiveness, 1-3; implies --compact.  [default: 2]')
+@click.option('--compact-code', 'compactCode', is_flag = True, help = 'Compact fenced code blocks too; implies --compact.')
+@click.argument('tokens', nargs = -1, type = click.UNPROCESSED)
+def codex(tokens: list, noStream: bool = False, inputFileName: str = None, compact: bool = False, compactLevel: int = None, compactCode: bool = False) -> str:
     """
     Process a command line query and display the result to the console.
 
@@ -384,29 +655,56 @@ def codex(tokens: list) -> str:
     A list of tokens that will be assembled as a single string for
     processing.
 
+        noStream
+    If `True`, display the response once it's complete.  By default it's
+    displayed as it streams in, in one-shot and REPL modes.
+
+        inputFileName
+    Optional path of a file to query about; `tokens` are the query.  Large
+    files are memory-mapped and, like large stdin inputs, queried in chunks.
+
+        compact, compactLevel, compactCode
+    Compact stdin or file input with a `perplexipy.compaction.Compactor` of
+    the given level, reporting the savings to stderr.  Fenced code blocks are
+    left alone unless `compactCode` is set.
+
     Returns
     -------
     A string with the response to the query, after displaying it to the
     console.
     """
-    result = None
-    userQuery = None
+    global _streamOutput
+
+    _streamOutput = not noStream
+    compactor = _makeCompactor(compact, compactLevel, compactCode)
+    if inputFileName:
+        from perplexipy.mapreduce import openInput
+
+        instruction = QUERY_DETAILED+' '.join(tokens)+'\n\n'
+        try:
+            with openInput(inputFileName) as source:
+                if not compactor:
+                    return _queryInput(instruction, source, source.size)
+                lines = list(compactor.compact(source))
+        except (OSError, PerplexityClientError) as e:
+            _die('Invalid input: %s' % e, 3)
+        _reportCompaction(compactor)
+        return _queryInput(instruction, lines, sum(len(line) for line in lines))
     if len(tokens):
         if len(tokens) == 1 and tokens[0].lower() == ARG_REPL:
-            userQuery = _runREPL()
-        else:
-            userQuery = QUERY_CRISP+''.join(tokens)
+            return _runREPL()
+        elif _isBatch(tokens):
+            return codexBatch.main(list(tokens[1:]), prog_name = 'codex batch')
+        elif _isServe(tokens):
+            return codexServe.main(list(tokens[1:]), prog_name = 'codex serve')
+        return _displayQuery(QUERY_CRISP+''.join(tokens))
     elif _stdinHasData():
-        userQuery = _assembleInput()
-        userQuery = QUERY_DETAILED+userQuery
+        lines = _assembleInput(compactor)
+        if compactor:
+            _reportCompaction(compactor)
+        return _queryInput(QUERY_DETAILED, lines, sum(len(line) for line in lines))
 
-    if userQuery:
-        result = codexCore(userQuery)
-        click.echo(result)
-    else:
-        _die(_helpUser(), 1)
-
-    return result
+    _die(_helpUser(), 1)
 
 
 if '__main__' == __name__:
@@ -0,0 +1,262 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+from perplexipy.errors import PerplexityClientError
+from perplexipy.tokens import CHARACTERS_PER_TOKEN
+
+import re
+
+
+# +++ constants +++
+
+COMPACTION_LIGHT = 1
+"""
+Strip ANSI escapes and trailing whitespace, and collapse runs of identical
+lines.
+"""
+COMPACTION_NORMAL = 2
+"""
+`COMPACTION_LIGHT`, plus:  keep only what a terminal shows of lines rewritten
+with carriage returns, e.g. progress bars; collapse runs of blank lines; and
+elide base64 and hex blobs of `COMPACTION_BLOB_SIZE` characters or more.
+"""
+COMPACTION_AGGRESSIVE = 3
+"""
+`COMPACTION_NORMAL`, plus:  collapse runs of lines that differ only in their
+numbers, e.g. timestamps and counters in logs, and elide blobs from a quarter
+of `COMPACTION_BLOB_SIZE`.
+"""
+COMPACTION_BLOB_SIZE = 200
+"""
+Characters in a run of base64 or hex digits elided by `COMPACTION_NORMAL`.
+"""
+COMPACTION_DEFAULT_LEVEL = COMPACTION_NORMAL
+
+CompactionStats = namedtuple('CompactionStats', [
+    'bytesIn',
+    'bytesOut',
+    'tokensIn',
+    'tokensOut',
+    'linesIn',
+    'linesOut',
+])
+"""
+What a `perplexipy.compaction.Compactor` saved.  Token counts are
+`perplexipy.tokens` estimates.
+
+Attributes
+----------
+    bytesIn, bytesOut
+UTF-8 bytes read and written.
+
+    tokensIn, tokensOut
+Estimated tokens read and written.
+
+    linesIn, linesOut
+Lines read and written.
+"""
+
+_ANSI_ESCAPE = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])')
+_FENCE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+_LINE = re.compile(r'[^\n]*\n|[^\n]+')
+_NUMBER = re.compile(r'\d+')
+
+
+# +++ functions +++
+
+def _blobPattern(size: int):
+    # Runs of base64 (standard or URL-safe) or hex characters with at least
+    # one digit; long identifiers and words don't qualify.
+    return re.compile(r'(?=[A-Za-z0-9+/_-]*\d)[A-Za-z0-9+/_-]{%d,}={0,2}' % size)
+
+
+def compactText(text: str, level: int = COMPACTION_DEFAULT_LEVEL, compactCode: bool = False) -> tuple:
+    """
+    Compact a prompt in one call.
+
+    ```python
+    prompt, stats = compactText(QUERY+log)
+    print(client.query(prompt))
+    print('~%d tokens saved' % (stats.tokensIn-stats.tokensOut))
+    ```
+
+    Arguments
+    ---------
+        text
+    The text to compact.
+
+        level, compactCode
+    As for `perplexipy.compaction.Compactor`.
+
+    Returns
+    -------
+    A tuple `(text, stats)` with the compacted text and a
+    `perplexipy.compaction.CompactionStats`.
+    """
+    compactor = Compactor(level, compactCode)
+    # Split only at newlines; str.splitlines() would split at the carriage
+    # returns of progress bars too.
+    compacted = ''.join(compactor.compact(match.group(0) for match in _LINE.finditer(text)))
+
+    return compacted, compactor.stats
+
+
+# +++ classes +++
+
+class Compactor:
+    """
+    Streaming prompt compaction for piped logs, terminal captures, and code:
+    input lines go in, fewer and shorter lines come out, and `stats` reports
+    the savings.  Lines inside fenced code blocks (```` ``` ```` or `~~~`)
+    pass through untouched unless `compactCode` is set.  Only runs of
+    consecutive lines are held back, so memory stays flat on inputs of any
+    size.
+
+    ```python
+    compactor = Compactor(COMPACTION_AGGRESSIVE)
+    lines = readInput(compactor.compact(sys.stdin))
+    print(client.query(QUERY+''.join(lines)))
+    print(compactor.stats)
+    ```
+    """
+    def __init__(self, level: int = COMPACTION_DEFAULT_LEVEL, compactCode: bool = False):
+        """
+        Arguments
+        ---------
+            level
+        `COMPACTION_LIGHT`, `COMPACTION_NORMAL`, or `COMPACTION_AGGRESSIVE`.
+
+            compactCode
+        Compact fenced code blocks too.
+
+        Raises
+        ------
+            PerplexityClientError
+        If `level` is invalid.
+        """
+        if level not in (COMPACTION_LIGHT, COMPACTION_NORMAL, COMPACTION_AGGRESSIVE):
+            raise PerplexityClientError('level = %s error; valid levels: %d-%d' % (level, COMPACTION_LIGHT, COMPACTION_AGGRESSIVE))
+        self.level = level
+        self.compactCode = compactCode
+        self._blob = _blobPattern(COMPACTION_BLOB_SIZE if level == COMPACTION_NORMAL else COMPACTION_BLOB_SIZE//4) if level >= COMPACTION_NORMAL else None
+        self._counts = [ 0, ]*6
+
+
+    def _clean(self, line: str) -> str:
+        # The line without escapes, carriage return overwrites, blobs, and
+        # trailing whitespace; the newline is kept.
+        newline = '\n' if line.endswith('\n') else ''
+        line = _ANSI_ESCAPE.sub('', line).rstrip()
+        if self.level >= COMPACTION_NORMAL:
+            if '\r' in line:
+                line = line.rsplit('\r', 1)[1]
+            line = self._blob.sub(lambda match: '[blob: %d characters elided]' % len(match.group(0)), line)
+
+        return line+newline
+
+
+    def _key(self, line: str) -> str:
+        # Lines with equal keys collapse into one.
+        return _NUMBER.sub('#', line) if self.level == COMPACTION_AGGRESSIVE else line
+
+
+    def _count(self, index: int, line: str):
+        counts = self._counts
+        counts[index] += len(line.encode('utf-8'))
+        counts[index+2] += len(line)
+        counts[index+4] += 1
+
+
+    def compact(self, lines):
+        """
+        Compact `lines` as they're read.
+
+        Arguments
+        ---------
+            lines
+        An iterable of strings with their line endings, e.g. a file or
+        `sys.stdin`; consumed lazily.
+
+        Returns
+        -------
+        A generator of compacted lines.  `stats` is complete once it's
+        exhausted.
+        """
+        fence = None
+        previous = None
+        previousKey = None
+        repeats = 0
+        blanks = 0
+        for line in lines:
+            self._count(0, line)
+            if fence is None:
+                match = _FENCE.match(line)
+                if match and not self.compactCode:
+                    fence = match.group(1)
+            elif line.lstrip(' ').startswith(fence) and not line.strip().strip(fence[0]):
+                # The closing fence, same character and at least as long.
+                fence = None
+                self._count(1, line)
+                yield line
+                continue
+            if fence is not None:
+                if repeats:
+                    yield self._repeated(previous, repeats)
+                previous = previousKey = None
+                repeats = blanks = 0
+                self._count(1, line)
+                yield line
+                continue
+
+            line = self._clean(line)
+            if not line.strip():
+                if repeats:
+                    yield self._repeated(previous, repeats)
+                previous = previousKey = None
+                repeats = 0
+                blanks += 1
+                if blanks > 1 and self.level >= COMPACTION_NORMAL:
+                    continue
+                self._count(1, line)
+                yield line
+                continue
+            blanks = 0
+            key = self._key(line)
+            if key == previousKey:
+                repeats += 1
+                continue
+            if repeats:
+                yield self._repeated(previous, repeats)
+                repeats = 0
+            previous = line
+            previousKey = key
+            self._count(1, line)
+            yield line
+        if repeats:
+            yield self._repeated(previous, repeats)
+
+
+    def _repeated(self, line: str, repeats: int) -> str:
+        if self.level == COMPACTION_AGGRESSIVE:
+            note = '[previous line repeated %d more times, numbers may differ]\n' % repeats
+        else:
+            note = '[previous line repeated %d more times]\n' % repeats
+        self._count(1, note)
+
+        return note
+
+
+    @property
+    def stats(self) -> CompactionStats:
+        bytesIn, bytesOut, charactersIn, charactersOut, linesIn, linesOut = self._counts
+
+        return CompactionStats(
+            bytesIn,
+            bytesOut,
+            -(-charactersIn//CHARACTERS_PER_TOKEN),
+            -(-charactersOut//CHARACTERS_PER_TOKEN),
+            linesIn,
+            linesOut,
+        )
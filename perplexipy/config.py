@@ -0,0 +1,259 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+import atexit
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+
+# +++ constants +++
+
+CONFIG_CHECK_INTERVAL = 1.0 # seconds
+"""
+Minimum time between checks of the file modification time.
+"""
+CONFIG_WRITE_DELAY = 0.5 # seconds
+"""
+Default delay between a change and its write to disk; changes made within the
+delay are written together.
+"""
+
+
+# +++ functions +++
+
+def _yaml():
+    # PyYAML is imported on first use; the libyaml-based loader and dumper are
+    # several times faster than the pure Python ones when available.
+    import yaml
+
+    return yaml, getattr(yaml, 'CSafeLoader', yaml.SafeLoader), getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+# +++ classes +++
+
+class ConfigFile:
+    """
+    Thread-safe dictionary-like configuration backed by a YAML file.  The file
+    is read once and values are served from memory.  Changes are written
+    behind, after `writeDelay` seconds without further changes, by replacing
+    the file atomically, and pending changes are flushed at exit.
+
+    Changes made to the file by another process, e.g. a second REPL, are
+    detected from its modification time:  they're reloaded on the next read,
+    and merged with the local changes, key by key, before writing.
+
+    ```python
+    config = ConfigFile(CONFIG_PATH / 'codex-repl.yaml', defaults = { 'editingMode': 'vi', })
+    config['editingMode'] = 'emacs' # written in the background
+    ```
+    """
+    def __init__(self, fileName: str, defaults: dict = None, writeDelay: float = CONFIG_WRITE_DELAY, checkInterval: float = CONFIG_CHECK_INTERVAL):
+        """
+        Arguments
+        ---------
+            fileName
+        Path to the YAML file.  It's created with the `defaults` if it doesn't
+        exist.
+
+            defaults
+        An optional dictionary of values for keys missing from the file.
+
+            writeDelay
+        Seconds to wait after a change before writing the file; 0 writes
+        immediately.
+
+            checkInterval
+        Minimum seconds between checks of the file modification time.
+        """
+        self._fileName = pathlib.Path(fileName)
+        self._defaults = dict(defaults or { })
+        self._writeDelay = writeDelay
+        self._checkInterval = checkInterval
+        self._lock = threading.RLock()
+        self._values = dict()
+        self._dirty = set()
+        self._signature = None
+        self._checkedAt = 0.0
+        self._timer = None
+        self._writes = 0
+        with self._lock:
+            self._load()
+            if self._signature is None:
+                self._dirty.update(self._values)
+                self._write()
+        atexit.register(self.flush)
+
+
+    def _stat(self) -> tuple:
+        try:
+            stat = os.stat(self._fileName)
+        except OSError:
+            return None
+
+        # Writers replace the file, so the inode changes even when the mtime
+        # resolution is too coarse to tell two writes apart.
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+    def _load(self):
+        # Called with the lock held.  Local changes not written yet win over
+        # the file's values.
+        signature = self._stat()
+        values = dict(self._defaults)
+        if signature is not None:
+            yaml, loader, _ = _yaml()
+            try:
+                with open(self._fileName, 'r') as inputFile:
+                    values.update(yaml.load(inputFile, Loader = loader) or { })
+            except (OSError, ValueError, yaml.YAMLError):
+                # Keep what's in memory; the next write replaces the file.
+                signature = None
+                values.update(self._values)
+        for key in self._dirty:
+            if key in self._values:
+                values[key] = self._values[key]
+            else:
+                values.pop(key, None)
+        self._values = values
+        self._signature = signature
+        self._checkedAt = time.monotonic()
+
+
+    def _refresh(self):
+        # Called with the lock held.
+        if time.monotonic()-self._checkedAt < self._checkInterval:
+            return
+        self._checkedAt = time.monotonic()
+        if self._stat() != self._signature:
+            self._load()
+
+
+    def _write(self):
+        # Called with the lock held.
+        if self._stat() != self._signature:
+            self._load()
+        yaml, _, dumper = _yaml()
+        tempName = None
+        try:
+            os.makedirs(self._fileName.parent, exist_ok = True)
+            fd, tempName = tempfile.mkstemp(dir = self._fileName.parent, prefix = '.%s-' % self._fileName.name)
+            with os.fdopen(fd, 'w') as outputFile:
+                yaml.dump(self._values, outputFile, Dumper = dumper)
+            os.replace(tempName, self._fileName)
+        except OSError:
+            if tempName:
+                try:
+                    os.remove(tempName)
+                except OSError:
+                    pass
+            raise
+        self._dirty.clear()
+        self._signature = self._stat()
+        self._checkedAt = time.monotonic()
+        self._writes += 1
+
+
+    def _changed(self, key):
+        # Called with the lock held.
+        self._dirty.add(key)
+        if self._writeDelay <= 0.0:
+            self._write()
+            return
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(self._writeDelay, self._flushBehind)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+    def _flushBehind(self):
+        # Timer thread; on failure the changes stay pending for the next
+        # flush().
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+
+    def flush(self):
+        """
+        Write pending changes now, if any.
+
+        Raises
+        ------
+            OSError
+        If the file can't be written.
+        """
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if self._dirty:
+                self._write()
+
+
+    def get(self, key, default = None):
+        with self._lock:
+            self._refresh()
+            return self._values.get(key, default)
+
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._refresh()
+            return self._values[key]
+
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._refresh()
+            if key in self._values and self._values[key] == value:
+                return
+            self._values[key] = value
+            self._changed(key)
+
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._refresh()
+            del self._values[key]
+            self._changed(key)
+
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            self._refresh()
+            return key in self._values
+
+
+    def asDict(self) -> dict:
+        """
+        Return a copy of the current values.
+        """
+        with self._lock:
+            self._refresh()
+            return dict(self._values)
+
+
+    @property
+    def fileName(self) -> pathlib.Path:
+        return self._fileName
+
+
+    @property
+    def pending(self) -> bool:
+        """
+        `True` if there are changes not written to disk yet.
+        """
+        return bool(self._dirty)
+
+
+    @property
+    def writes(self) -> int:
+        """
+        Number of times the file was written.
+        """
+        return self._writes
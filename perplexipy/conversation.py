@@ -0,0 +1,256 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.errors import PerplexityClientError
+from perplexipy.responses import Responses
+from perplexipy.tokens import estimateTokens
+
+
+# +++ constants +++
+
+CONVERSATION_DEFAULT_CONTEXT = 127072
+"""
+Context length in tokens assumed for models without a `perplexipy.ModelInfo`
+entry.
+"""
+CONVERSATION_MESSAGE_OVERHEAD = 4
+"""
+Tokens added to each message estimate for the role and separators.
+"""
+CONVERSATION_RESERVE_TOKENS = 4096
+"""
+Default number of context tokens left free for the response.
+"""
+CONVERSATION_SUMMARY_PROMPT = 'Summarize this conversation in under %d words, keeping names, facts, decisions, and open questions:\n\n%s'
+CONVERSATION_SUMMARY_WORDS = 200
+
+
+# +++ classes +++
+
+class Conversation:
+    """
+    Multi-turn conversation with a `perplexipy.PerplexityClient`, kept within a
+    token budget.  Turns are appended to the history as they happen; each
+    request sends the stable system prefix plus the most recent turns that fit
+    the budget, so prompt tokens, and latency, stay bounded no matter how long
+    the session runs.  Older turns are dropped or, if `summarize` is set,
+    folded into a running summary.
+
+    ```python
+    conversation = Conversation(client, system = 'Be precise and concise.')
+    print(conversation.ask('Who wrote The Hobbit?'))
+    print(conversation.ask('When was it published?'))
+    for chunk in conversation.askStreamable('And its sequel?'):
+        print(chunk, end = '')
+    ```
+    """
+    def __init__(self, client, system: str = None, maxTokens: int = None, reserveTokens: int = CONVERSATION_RESERVE_TOKENS, summarize: bool = False):
+        """
+        Arguments
+        ---------
+            client
+        A `perplexipy.PerplexityClient`.
+
+            system
+        An optional system prompt, sent first with every request and never
+        trimmed.
+
+            maxTokens
+        Prompt token budget.  Defaults to the context length of the client's
+        model, from `client.models`, minus `reserveTokens`.
+
+            reserveTokens
+        Context tokens left free for the response when `maxTokens` is derived
+        from the model.
+
+            summarize
+        If `True`, turns trimmed from the window are summarized with an extra
+        query and the summary is sent after the system prompt.  If `False`,
+        they're dropped.
+        """
+        self._client = client
+        self._maxTokens = maxTokens
+        self._reserveTokens = reserveTokens
+        self._summarize = summarize
+        self._prefix = [ { 'role': 'system', 'content': system, }, ] if system else [ ]
+        self._prefixTokens = sum(self._estimate(message) for message in self._prefix)
+        self._summary = None
+        self._summaryTokens = 0
+        self._turns = [ ]
+        self._tokens = [ ]
+        self._start = 0
+        self._windowTokens = 0
+        self._pending = None
+
+
+    @staticmethod
+    def _estimate(message: dict) -> int:
+        return estimateTokens(message['content'])+CONVERSATION_MESSAGE_OVERHEAD
+
+
+    @property
+    def budget(self) -> int:
+        """
+        Prompt token budget for each request.
+        """
+        if self._maxTokens:
+            return self._maxTokens
+        info = self._client.models.get(self._client.model)
+        contextLength = info.contextLength if info else CONVERSATION_DEFAULT_CONTEXT
+
+        return max(1, contextLength-self._reserveTokens)
+
+
+    def _append(self, role: str, content: str):
+        message = { 'role': role, 'content': content, }
+        tokens = self._estimate(message)
+        self._turns.append(message)
+        self._tokens.append(tokens)
+        self._windowTokens += tokens
+
+
+    def _settle(self):
+        # Record the answer of a streamed turn; reads the rest of the stream if
+        # the caller didn't.
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            self._append('assistant', ''.join(pending._chunks) if pending.done else pending.text())
+
+
+    def _trim(self):
+        # Advance the window start, a user turn, until the window fits the
+        # budget; the last user turn is always sent.  Amortized O(1) per turn.
+        budget = self.budget-self._prefixTokens
+        last = len(self._turns)-1
+        trimmed = self._start
+        while self._start < last and self._windowTokens+self._summaryTokens > budget:
+            self._windowTokens -= self._tokens[self._start]
+            self._start += 1
+            while self._start < last and self._turns[self._start]['role'] != 'user':
+                self._windowTokens -= self._tokens[self._start]
+                self._start += 1
+        if self._summarize and self._start > trimmed:
+            self._summarizeTurns(self._turns[trimmed:self._start])
+
+
+    def _summarizeTurns(self, turns: list):
+        lines = [ 'Earlier summary: %s' % self._summary, ] if self._summary else [ ]
+        lines.extend('%s: %s' % (turn['role'], turn['content']) for turn in turns)
+        query = CONVERSATION_SUMMARY_PROMPT % (CONVERSATION_SUMMARY_WORDS, '\n'.join(lines))
+        self._summary = self._client._complete(self._client._messagesFor(query), cache = False, method = 'summarize')[0]
+        self._summaryTokens = self._estimate({ 'content': self._summary, })
+
+
+    def _messages(self) -> list:
+        messages = list(self._prefix)
+        if self._summary:
+            messages.append({ 'role': 'system', 'content': 'Summary of the earlier conversation: %s' % self._summary, })
+        messages.extend(self._turns[self._start:])
+
+        return messages
+
+
+    def _prepare(self, query: str) -> list:
+        if not query:
+            raise PerplexityClientError('query cannot be None or empty')
+        self._settle()
+        self._append('user', query)
+        self._trim()
+
+        return self._messages()
+
+
+    def ask(self, query: str) -> str:
+        """
+        Send the next user turn and record the response in the history.
+
+        Returns
+        -------
+        The response string.
+
+        Raises
+        ------
+            PerplexityClientError
+        If the query is `None` or empty.
+
+            Exception
+        Whatever the API raised; the user turn is removed from the history.
+        """
+        messages = self._prepare(query)
+        try:
+            result = self._client._complete(messages, cache = False, method = 'conversation')[0]
+        except Exception:
+            self._rollback()
+            raise
+        self._append('assistant', result)
+
+        return result
+
+
+    def askStreamable(self, query: str) -> Responses:
+        """
+        Send the next user turn and return its streamed response.  The text
+        read from the stream is recorded in the history before the next turn.
+
+        Returns
+        -------
+        A `perplexipy.responses.Responses` object.
+        """
+        messages = self._prepare(query)
+        try:
+            self._pending = self._client._stream(messages, method = 'conversation')
+        except Exception:
+            self._rollback()
+            raise
+
+        return self._pending
+
+
+    def _rollback(self):
+        self._windowTokens -= self._tokens.pop()
+        self._turns.pop()
+        self._start = min(self._start, len(self._turns))
+
+
+    def reset(self):
+        """
+        Clear the history and the summary; the system prompt is kept.
+        """
+        self._pending = None
+        self._summary = None
+        self._summaryTokens = 0
+        self._turns.clear()
+        self._tokens.clear()
+        self._start = 0
+        self._windowTokens = 0
+
+
+    @property
+    def history(self) -> tuple:
+        """
+        All the turns as message dictionaries, including those trimmed from
+        the window.
+        """
+        self._settle()
+
+        return tuple(self._turns)
+
+
+    @property
+    def summary(self) -> str:
+        """
+        The summary of the trimmed turns, or `None`.
+        """
+        return self._summary
+
+
+    @property
+    def promptTokens(self) -> int:
+        """
+        Estimated prompt tokens of the current window, including the system
+        prompt and summary.
+        """
+        self._settle()
+
+        return self._prefixTokens+self._summaryTokens+self._windowTokens
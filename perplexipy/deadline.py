@@ -0,0 +1,316 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.errors import PerplexityClientError
+
+import threading
+import time
+
+
+# +++ constants +++
+
+DEADLINE_POLL_INTERVAL = 0.05
+"""
+Seconds between cancellation checks while waiting on another thread, e.g. a
+coalesced call.
+"""
+
+
+# +++ functions +++
+
+def deadlineFor(timeout: float = None, deadline = None, cancelToken: 'CancellationToken' = None, stallTimeout: float = None) -> 'Deadline':
+    """
+    Combine the limits of a call into a `perplexipy.deadline.Deadline`.
+
+    Arguments
+    ---------
+        timeout
+    Seconds from now, or `None`.
+
+        deadline
+    An absolute `time.monotonic()` value, a `Deadline` inherited from an
+    enclosing call, or `None`.
+
+        cancelToken, stallTimeout
+    As for `Deadline`; they take precedence over those of an inherited
+    `deadline`.
+
+    Returns
+    -------
+    A `Deadline`, or `None` if the call has no limits, so that calls without
+    them pay nothing.
+    """
+    if isinstance(deadline, Deadline):
+        if timeout is None and cancelToken is None and stallTimeout is None:
+            return deadline
+        return Deadline(timeout, deadline.at, cancelToken or deadline.cancelToken, deadline.stallTimeout if stallTimeout is None else stallTimeout)
+    if timeout is None and deadline is None and cancelToken is None and stallTimeout is None:
+        return None
+
+    return Deadline(timeout, deadline, cancelToken, stallTimeout)
+
+
+# +++ classes +++
+
+class DeadlineExceeded(PerplexityClientError):
+    """
+    Raised when a call runs past its `timeout` or `deadline`.
+    """
+    def __init__(self, errorMessage):
+        super().__init__(errorMessage)
+
+
+class StreamStalled(DeadlineExceeded):
+    """
+    Raised when a stream sends no chunk for longer than its `stallTimeout`.
+    """
+    def __init__(self, errorMessage):
+        super().__init__(errorMessage)
+
+
+class CallCancelled(PerplexityClientError):
+    """
+    Raised when a call's `perplexipy.deadline.CancellationToken` is cancelled.
+    """
+    def __init__(self, errorMessage):
+        super().__init__(errorMessage)
+
+
+class CancellationToken:
+    """
+    Thread-safe, cooperative cancellation of one or more calls, e.g. all the
+    queries of a `queryMany()` batch, from another thread:
+
+    ```python
+    token = CancellationToken()
+    threading.Timer(5.0, token.cancel).start()
+    for chunk in client.queryStreamable(query, cancelToken = token):
+        print(chunk, end = '')
+    ```
+
+    Cancelling closes the streams opened with the token, which releases their
+    HTTP connections, interrupts retry backoff waits, and makes the calls
+    raise `perplexipy.deadline.CallCancelled` at their next checkpoint.  A
+    non-streaming request already sent can't be interrupted; its response is
+    discarded.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = dict()
+        self._nextID = 0
+
+
+    def cancel(self):
+        """
+        Cancel every call using the token.  Safe to call more than once.
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # A stream failing to close must not stop the others.
+                pass
+
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+    def _watch(self, callback):
+        # Run callback() on cancel, right away if already cancelled.  Returns a
+        # function that unregisters it.
+        with self._lock:
+            if not self._event.is_set():
+                callbackID = self._nextID
+                self._nextID += 1
+                self._callbacks[callbackID] = callback
+                return lambda: self._callbacks.pop(callbackID, None)
+        callback()
+
+        return lambda: None
+
+
+class Deadline:
+    """
+    The time limits and cancellation token of a call, carried through the
+    client's internals and fan-out helpers like `queryMany()` and
+    `perplexipy.mapreduce.mapReduce`.  Client methods build one from their
+    `timeout`, `deadline`, `cancelToken`, and `stallTimeout` arguments; pass a
+    `Deadline` as the `deadline` argument to give several calls the same
+    limits.
+    """
+    def __init__(self, timeout: float = None, at: float = None, cancelToken: CancellationToken = None, stallTimeout: float = None):
+        """
+        Arguments
+        ---------
+            timeout
+        Seconds from now.
+
+            at
+        An absolute `time.monotonic()` value; the earliest of `timeout` and
+        `at` applies.
+
+            cancelToken
+        An optional `perplexipy.deadline.CancellationToken`.
+
+            stallTimeout
+        Maximum seconds between two chunks of a stream.
+        """
+        if timeout is not None:
+            at = time.monotonic()+timeout if at is None else min(at, time.monotonic()+timeout)
+        self.at = at
+        self.cancelToken = cancelToken
+        self.stallTimeout = stallTimeout
+
+
+    def remaining(self) -> float:
+        """
+        Seconds left, 0.0 if expired, or `None` if there's no time limit.
+        """
+        if self.at is None:
+            return None
+
+        return max(0.0, self.at-time.monotonic())
+
+
+    @property
+    def expired(self) -> bool:
+        return self.at is not None and time.monotonic() >= self.at
+
+
+    def check(self):
+        """
+        Raise if the call should stop now.
+
+        Raises
+        ------
+            CallCancelled
+        If the cancellation token was cancelled.
+
+            DeadlineExceeded
+        If the time is up.
+        """
+        if self.cancelToken is not None and self.cancelToken.cancelled:
+            raise CallCancelled('call cancelled')
+        if self.expired:
+            raise DeadlineExceeded('deadline exceeded')
+
+
+    def requestTimeout(self, stream: bool = False) -> float:
+        # Timeout for the next HTTP request, applied by httpx to each socket
+        # operation, or None for the client default.  For streams it's also
+        # the stall timeout between chunks.
+        self.check()
+        timeouts = [ timeout for timeout in (self.remaining(), self.stallTimeout if stream else None) if timeout is not None ]
+
+        return min(timeouts) if timeouts else None
+
+
+    def sleep(self, seconds: float):
+        """
+        Sleep for `seconds`, e.g. a retry backoff, waking up early if the call
+        is cancelled.
+
+        Raises
+        ------
+            CallCancelled, DeadlineExceeded
+        If the call was cancelled, or the time is up after sleeping.
+        """
+        remaining = self.remaining()
+        if remaining is not None and seconds > remaining:
+            raise DeadlineExceeded('deadline exceeded before the next retry')
+        if self.cancelToken is not None:
+            self.cancelToken._event.wait(seconds)
+        else:
+            time.sleep(seconds)
+        self.check()
+
+
+    def wait(self, event: threading.Event):
+        """
+        Wait for `event`, e.g. another thread's result, within the limits.
+
+        Raises
+        ------
+            CallCancelled, DeadlineExceeded
+        If the call was cancelled or the time ran out first.
+        """
+        while not event.is_set():
+            self.check()
+            remaining = self.remaining()
+            if self.cancelToken is not None:
+                remaining = DEADLINE_POLL_INTERVAL if remaining is None else min(remaining, DEADLINE_POLL_INTERVAL)
+            event.wait(remaining)
+        self.check()
+
+
+    async def waitFor(self, awaitable):
+        """
+        Await `awaitable`, e.g. a request of `perplexipy.AsyncPerplexityClient`,
+        within the limits:  it's cancelled when the time is up or when the
+        cancellation token is cancelled, from any thread.
+
+        Returns
+        -------
+        The result of `awaitable`.
+
+        Raises
+        ------
+            CallCancelled, DeadlineExceeded
+        If the call was cancelled or the time ran out first.
+        """
+        import asyncio
+
+        try:
+            self.check()
+        except PerplexityClientError:
+            if asyncio.iscoroutine(awaitable):
+                # Never started; close it so that it isn't reported as never
+                # awaited.
+                awaitable.close()
+            raise
+        task = asyncio.ensure_future(awaitable)
+        unwatch = None
+        if self.cancelToken is not None:
+            loop = asyncio.get_running_loop()
+            unwatch = self.cancelToken._watch(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            return await asyncio.wait_for(task, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded('deadline exceeded') from None
+        except asyncio.CancelledError:
+            if self.cancelToken is not None and self.cancelToken.cancelled:
+                raise CallCancelled('call cancelled') from None
+            raise
+        except Exception as e:
+            error = self.translate(e)
+            if error is e:
+                raise
+            raise error from e
+        finally:
+            if unwatch:
+                unwatch()
+
+
+    def translate(self, error: Exception) -> Exception:
+        # The exception to raise for an error caused by the limits, e.g. the
+        # HTTP timeout or the stream closed on cancellation, else error.
+        if self.cancelToken is not None and self.cancelToken.cancelled:
+            return CallCancelled('call cancelled')
+        from openai import APITimeoutError
+
+        if isinstance(error, (APITimeoutError, TimeoutError)):
+            if self.expired:
+                return DeadlineExceeded('deadline exceeded')
+            if self.stallTimeout is not None:
+                return StreamStalled('no chunk received in %g seconds' % self.stallTimeout)
+
+        return error
@@ -0,0 +1,258 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import deque
+from collections import namedtuple
+
+import threading
+import time
+
+
+# +++ constants +++
+
+HEDGE_DEFAULT_MAX_RATIO = 0.05
+"""
+Default cap on the fraction of requests that get a hedge.
+"""
+HEDGE_DEFAULT_PERCENTILE = 0.95
+HEDGE_DEFAULT_WINDOW = 256
+"""
+Default number of recent latencies kept to compute the hedge delay.
+"""
+HEDGE_MIN_SAMPLES = 20
+"""
+Latencies observed before hedging starts.
+"""
+
+
+HedgeStats = namedtuple('HedgeStats', [
+    'requests',
+    'hedged',
+    'wins',
+    'hedgeRate',
+    'delay',
+])
+"""
+Immutable snapshot of a `perplexipy.hedging.HedgePolicy`.
+
+Attributes
+----------
+    requests
+Requests issued under the policy, not counting hedges.
+
+    hedged
+Requests that got a hedge.
+
+    wins
+Hedges that answered before their original request.
+
+    hedgeRate
+`hedged/requests`, the extra load caused by hedging.
+
+    delay
+The current hedge delay in seconds, or `None` until enough latencies were
+observed.
+"""
+
+
+# +++ functions +++
+
+def _discard(loser, discard):
+    if loser.cancelled() or loser.exception() is not None:
+        return
+    result = loser.result()
+    if discard is None:
+        close = getattr(result, 'close', None)
+        if close:
+            close()
+    else:
+        discard(result)
+
+
+# +++ classes +++
+
+class HedgePolicy:
+    """
+    Thread-safe hedging policy for `perplexipy.PerplexityClient`.  When a
+    request hasn't answered after the `percentile` of the recently observed
+    latencies, an identical request is sent; the first response wins and the
+    other one is abandoned.  Hedges are capped at `maxRatio` of the requests,
+    so the extra load stays bounded even when the service slows down as a
+    whole.
+
+    ```python
+    policy = HedgePolicy(percentile = 0.95, maxRatio = 0.05)
+    client = PerplexityClient(key = key, hedgePolicy = policy)
+    ...
+    print(policy.stats)
+    ```
+
+    Hedged requests hold a worker thread each; an abandoned request runs to
+    completion in the background, and its response is closed.  No hedge is
+    sent while all the workers are busy.
+    """
+    def __init__(self, percentile: float = HEDGE_DEFAULT_PERCENTILE, maxRatio: float = HEDGE_DEFAULT_MAX_RATIO, window: int = HEDGE_DEFAULT_WINDOW, minSamples: int = HEDGE_MIN_SAMPLES, maxWorkers: int = 32):
+        """
+        Arguments
+        ---------
+            percentile
+        Latency percentile, 0.0-1.0, after which a request is hedged.
+
+            maxRatio
+        Maximum fraction of requests hedged, 0.0-1.0.
+
+            window
+        Number of recent latencies the percentile is computed from.
+
+            minSamples
+        Latencies observed before hedging starts.
+
+            maxWorkers
+        Threads available to run requests and their hedges.
+        """
+        self._percentile = percentile
+        self._maxRatio = maxRatio
+        self._minSamples = minSamples
+        self._maxWorkers = maxWorkers
+        self._latencies = deque(maxlen = window)
+        self._delay = None
+        self._stale = False
+        self._lock = threading.Lock()
+        self._executor = None
+        self._running = 0
+        self._requests = 0
+        self._hedged = 0
+        self._wins = 0
+
+
+    def record(self, latency: float):
+        """
+        Record the latency in seconds of a successful request.
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._stale = True
+
+
+    @property
+    def delay(self) -> float:
+        """
+        Seconds after which a request is hedged, or `None` until `minSamples`
+        latencies were observed.
+        """
+        with self._lock:
+            if self._stale:
+                self._stale = False
+                if len(self._latencies) >= self._minSamples:
+                    latencies = sorted(self._latencies)
+                    self._delay = latencies[min(len(latencies)-1, int(self._percentile*len(latencies)))]
+
+            return self._delay
+
+
+    def _allowHedge(self) -> bool:
+        with self._lock:
+            if self._hedged+1 > self._maxRatio*self._requests or self._running >= self._maxWorkers:
+                return False
+            self._hedged += 1
+
+            return True
+
+
+    def _submit(self, function):
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers = self._maxWorkers, thread_name_prefix = 'perplexipy-hedge')
+
+        return self._executor.submit(function)
+
+
+    def _timed(self, function):
+        def call():
+            with self._lock:
+                self._running += 1
+            try:
+                started = time.perf_counter()
+                result = function()
+                self.record(time.perf_counter()-started)
+            finally:
+                with self._lock:
+                    self._running -= 1
+            return result
+
+        return call
+
+
+    def run(self, function, discard = None, hasCapacity = None):
+        """
+        Run `function()`, a request, hedging it with a second call if it takes
+        longer than `delay`.
+
+        Arguments
+        ---------
+            function
+        A callable that makes the request.
+
+            discard
+        A callable invoked with the result of the losing call if it succeeds
+        after the winner, to release what it holds; defaults to calling its
+        `close()` method, if it has one.
+
+            hasCapacity
+        An optional callable; no hedge is sent while it returns `False`, e.g.
+        while the connection pool or the rate limiter has no room.
+
+        Returns
+        -------
+        The value returned by the first call to succeed.
+
+        Raises
+        ------
+            Exception
+        What the original request raised, if no call succeeded.
+        """
+        from concurrent.futures import FIRST_COMPLETED
+        from concurrent.futures import wait
+
+        with self._lock:
+            self._requests += 1
+        delay = self.delay
+        if delay is None:
+            return self._timed(function)()
+
+        timed = self._timed(function)
+        primary = self._submit(timed)
+        done, _ = wait(( primary, ), timeout = delay)
+        if done or (hasCapacity is not None and not hasCapacity()) or not self._allowHedge():
+            return primary.result()
+
+        hedge = self._submit(timed)
+        pending = { primary, hedge, }
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        # Cancelling only stops a call still queued; a call in
+                        # flight is discarded when it completes.
+                        if not other.cancel():
+                            other.add_done_callback(lambda loser: _discard(loser, discard))
+                    if future is hedge:
+                        with self._lock:
+                            self._wins += 1
+                    return future.result()
+        # Both failed.
+        return primary.result()
+
+
+    @property
+    def stats(self) -> HedgeStats:
+        """
+        A `perplexipy.hedging.HedgeStats` snapshot.
+        """
+        delay = self.delay
+        with self._lock:
+            return HedgeStats(self._requests, self._hedged, self._wins, self._hedged/self._requests if self._requests else 0.0, delay)
@@ -0,0 +1,249 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.conversation import CONVERSATION_DEFAULT_CONTEXT
+from perplexipy.conversation import CONVERSATION_RESERVE_TOKENS
+from perplexipy.deadline import deadlineFor
+from perplexipy.errors import PerplexityClientError
+from perplexipy.tokens import CHARACTERS_PER_TOKEN
+from perplexipy.tokens import estimateTokens
+
+
+# +++ constants +++
+
+MAPREDUCE_MAP_PROMPT = '%s\n\nThis is part %d of a larger input that is processed in parts; answer for this part only.\n\n%s'
+MAPREDUCE_MAX_INPUT = 64*1024*1024 # bytes
+"""
+Default size cap for inputs read by `perplexipy.mapreduce.readInput` and
+`perplexipy.mapreduce.openInput`.
+"""
+MAPREDUCE_REDUCE_PROMPT = '%s\n\nThe input was too large for a single query, so it was split into parts and each part was answered separately.  Combine these partial answers into a single, complete answer without mentioning the parts:\n\n%s'
+
+
+# +++ functions +++
+
+def inputBudget(client, instruction: str = None) -> int:
+    """
+    Return the size in characters of the largest input that fits a single
+    query to the client's model, along with the `instruction` and the
+    response.  Based on `perplexipy.ModelInfo.contextLength` and the
+    `perplexipy.tokens` estimate.
+    """
+    info = client.models.get(client.model)
+    contextLength = info.contextLength if info else CONVERSATION_DEFAULT_CONTEXT
+    tokens = contextLength-CONVERSATION_RESERVE_TOKENS-estimateTokens(MAPREDUCE_REDUCE_PROMPT)-estimateTokens(instruction)
+
+    return max(1, tokens)*CHARACTERS_PER_TOKEN
+
+
+def readInput(stream, maxSize: int = MAPREDUCE_MAX_INPUT) -> list:
+    """
+    Read a text stream, e.g. `sys.stdin`, into a list of lines.  The lines are
+    joined, or chunked, by the caller only once, instead of growing a string
+    line by line.
+
+    Arguments
+    ---------
+        stream
+    An iterable of lines.
+
+        maxSize
+    Maximum number of characters to read.
+
+    Returns
+    -------
+    A list of strings.
+
+    Raises
+    ------
+        PerplexityClientError
+    If the input is larger than `maxSize`.
+    """
+    lines = [ ]
+    size = 0
+    for line in stream:
+        size += len(line)
+        if size > maxSize:
+            raise PerplexityClientError('input larger than %d characters' % maxSize)
+        lines.append(line)
+
+    return lines
+
+
+class _MappedInput:
+    """
+    @private
+    Lines of a memory-mapped file, decoded as they're read.  Iterating doesn't
+    load the file into memory; the operating system pages it in and out.
+    """
+    def __init__(self, fileName: str):
+        import mmap
+
+        self._file = open(fileName, 'rb')
+        self.size = self._file.seek(0, 2)
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ) if self.size else None
+
+
+    def __iter__(self):
+        if not self._map:
+            return
+        self._map.seek(0)
+        for line in iter(self._map.readline, b''):
+            yield line.decode('utf-8', errors = 'replace')
+
+
+    def text(self) -> str:
+        return self._map[:].decode('utf-8', errors = 'replace') if self._map else ''
+
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def openInput(fileName: str, maxSize: int = MAPREDUCE_MAX_INPUT) -> _MappedInput:
+    """
+    Memory-map a text file for `perplexipy.mapreduce.chunkLines`.  Use it as a
+    context manager; the object iterates over the file's lines, has the file
+    `size` in bytes, and a `text()` method that decodes it whole.
+
+    Raises
+    ------
+        PerplexityClientError
+    If the file is larger than `maxSize` bytes.
+
+        OSError
+    If the file can't be read.
+    """
+    mapped = _MappedInput(fileName)
+    if mapped.size > maxSize:
+        mapped.close()
+        raise PerplexityClientError('%s larger than %d bytes' % (fileName, maxSize))
+
+    return mapped
+
+
+def chunkLines(lines, chunkSize: int):
+    """
+    Group lines into chunks of up to `chunkSize` characters, splitting only at
+    line boundaries unless a single line is longer than `chunkSize`.
+
+    Arguments
+    ---------
+        lines
+    An iterable of strings, consumed lazily.
+
+        chunkSize
+    Maximum characters per chunk.
+
+    Returns
+    -------
+    A generator of strings.
+    """
+    chunk = [ ]
+    size = 0
+    for line in lines:
+        while len(line) > chunkSize:
+            if chunk:
+                yield ''.join(chunk)
+                chunk, size = [ ], 0
+            yield line[:chunkSize]
+            line = line[chunkSize:]
+        if size+len(line) > chunkSize:
+            yield ''.join(chunk)
+            chunk, size = [ ], 0
+        chunk.append(line)
+        size += len(line)
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _mapChunks(client, instruction: str, chunks, maxConcurrency: int, progress, total: int, deadline = None) -> list:
+    prompts = (MAPREDUCE_MAP_PROMPT % (instruction, n, chunk) for n, chunk in enumerate(chunks, 1))
+    answers = [ ]
+    for outcome in client.queryMany(prompts, maxConcurrency = maxConcurrency, ordered = True, deadline = deadline):
+        if outcome.error is not None:
+            raise outcome.error
+        answers.append(outcome.result)
+        if progress:
+            progress(len(answers), max(total or 0, len(answers)))
+
+    return answers
+
+
+def mapReduce(client, instruction: str, chunks, maxConcurrency: int = 8, progress = None, total: int = None, timeout: float = None, deadline = None, cancelToken = None) -> str:
+    """
+    Answer `instruction` over an input too large for a single query:  each
+    chunk is queried concurrently with the instruction (map), then the partial
+    answers are combined by a final query (reduce).  Partial answers that don't
+    fit a single reduce query are combined in groups first.
+
+    ```python
+    with openInput('server.log') as lines:
+        chunks = chunkLines(lines, inputBudget(client, instruction))
+        print(mapReduce(client, 'List the distinct errors.', chunks))
+    ```
+
+    Arguments
+    ---------
+        client
+    A `perplexipy.PerplexityClient`.
+
+        instruction
+    The query to answer about the input.
+
+        chunks
+    An iterable of input chunks, each small enough for a query, e.g. from
+    `perplexipy.mapreduce.chunkLines`; consumed lazily.
+
+        maxConcurrency
+    Maximum chunk queries in flight.
+
+        progress
+    An optional callable `progress(done, total)`, called after each chunk
+    query.
+
+        total
+    The expected number of chunks, for progress reporting, if known.
+
+        timeout, deadline, cancelToken
+    Optional limits for the whole map-reduce, as for
+    `perplexipy.PerplexityClient.query()`; every chunk and reduce query shares
+    them.
+
+    Returns
+    -------
+    The combined answer string; the answer itself if there was a single chunk.
+
+    Raises
+    ------
+        PerplexityClientError
+    If there are no chunks.
+
+        Exception
+    The first error raised by a chunk or reduce query.
+    """
+    deadline = deadlineFor(timeout, deadline, cancelToken)
+    answers = _mapChunks(client, instruction, chunks, maxConcurrency, progress, total, deadline)
+    if not answers:
+        raise PerplexityClientError('no input to process')
+    budget = inputBudget(client, instruction)
+    while len(answers) > 1:
+        parts = [ 'Part %d:\n%s\n' % (n, answer) for n, answer in enumerate(answers, 1) ]
+        groups = list(chunkLines(parts, budget))
+        if len(groups) >= len(answers):
+            # No two partial answers fit together; keep an equal share of each.
+            share = budget//len(parts)
+            groups = [ ''.join(part[:share] for part in parts), ]
+        answers = [ client.query(MAPREDUCE_REDUCE_PROMPT % (instruction, group), cache = False, deadline = deadline) for group in groups ]
+
+    return answers[0]
@@ -0,0 +1,321 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+from perplexipy.responses import Responses
+
+import bisect
+import threading
+import time
+
+
+# +++ constants +++
+
+METRICS_LATENCY_BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, )
+"""
+Upper bounds, in seconds, of the histogram buckets for time measurements.
+"""
+METRICS_TOKEN_BUCKETS = ( 16, 64, 256, 1024, 4096, 16384, 65536, )
+"""
+Upper bounds of the histogram buckets for token counts.
+"""
+METRICS_PREFIX = 'perplexipy'
+
+
+CallRecord = namedtuple('CallRecord', [
+    'method',
+    'model',
+    'queueWait',
+    'latency',
+    'timeToFirstToken',
+    'interTokenGaps',
+    'promptTokens',
+    'completionTokens',
+    'error',
+])
+"""
+Immutable measurements of one call to the service, passed to
+`Observer.record()`.  Times are in seconds.
+
+Attributes
+----------
+    method
+The client method that issued the call, e.g. `'query'` or `'queryStreamable'`.
+
+    model
+The model name.
+
+    queueWait
+Time spent waiting for a worker before the call started, e.g. in `queryMany()`;
+0.0 for direct calls.
+
+    latency
+Time from the start of the call until the response was complete, or until the
+error was raised.
+
+    timeToFirstToken
+Time until the first content chunk of a stream, `None` for non-streaming calls.
+
+    interTokenGaps
+Tuple of times between consecutive content chunks of a stream; empty for
+non-streaming calls.
+
+    promptTokens
+Prompt token count reported by the service, or `None`.
+
+    completionTokens
+Completion token count reported by the service, or `None`.
+
+    error
+The class name of the exception raised by the call, or `None`.
+"""
+
+
+# +++ functions +++
+
+def _labels(labels: tuple) -> str:
+    names = ( 'method', 'model', 'error', )
+
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, labels))
+
+
+# +++ classes +++
+
+class Observer:
+    """
+    Base class for call observers.  Pass an instance to
+    `perplexipy.PerplexityClient` as the `observer` argument to receive a
+    `CallRecord` after every call to the service.  Implementations must be
+    thread-safe and fast, since they run in the caller's thread.
+    """
+    def record(self, record: CallRecord):
+        pass
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds, in the Prometheus
+    style.  Not thread-safe on its own; `MetricsAggregator` serializes access.
+    """
+    def __init__(self, buckets: tuple):
+        self._bounds = tuple(buckets)
+        self._counts = [ 0, ]*(len(self._bounds)+1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value: float):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+    @property
+    def buckets(self) -> list:
+        """
+        List of `(upperBound, cumulativeCount)` tuples; the last upper bound
+        is `float('inf')`.
+        """
+        result = [ ]
+        total = 0
+        for bound, count in zip(self._bounds+(float('inf'),), self._counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the `q` quantile, 0.0-1.0, by linear interpolation within the
+        bucket that contains it.  Returns `None` if the histogram is empty.
+        """
+        if not self.count:
+            return None
+        rank = q*self.count
+        lower = 0.0
+        total = 0
+        for bound, count in zip(self._bounds, self._counts):
+            if total+count >= rank and count:
+                return lower+(bound-lower)*(rank-total)/count
+            total += count
+            lower = bound
+
+        return self._bounds[-1]
+
+
+class MetricsAggregator(Observer):
+    """
+    In-memory, thread-safe observer that aggregates call records into
+    histograms and counters, labeled by method and model.
+
+    ```python
+    metrics = MetricsAggregator()
+    client = PerplexityClient(key = key, observer = metrics)
+    ...
+    print(metrics.histogram('latency', 'query', 'sonar').quantile(0.99))
+    print(metrics.prometheus())
+    ```
+    """
+    _HISTOGRAMS = (
+        ('latency', 'request_latency_seconds', 'Time until the response was complete', METRICS_LATENCY_BUCKETS),
+        ('queueWait', 'queue_wait_seconds', 'Time waiting for a worker before the request started', METRICS_LATENCY_BUCKETS),
+        ('timeToFirstToken', 'time_to_first_token_seconds', 'Time until the first streamed chunk', METRICS_LATENCY_BUCKETS),
+        ('interTokenGap', 'inter_token_gap_seconds', 'Time between consecutive streamed chunks', METRICS_LATENCY_BUCKETS),
+        ('promptTokens', 'prompt_tokens', 'Prompt tokens per request', METRICS_TOKEN_BUCKETS),
+        ('completionTokens', 'completion_tokens', 'Completion tokens per request', METRICS_TOKEN_BUCKETS),
+    )
+
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = dict()
+        self._requests = dict()
+        self._errors = dict()
+
+
+    def _observe(self, name: str, labels: tuple, value: float):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            buckets = next(spec[3] for spec in self._HISTOGRAMS if spec[0] == name)
+            histogram = self._histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+    def record(self, record: CallRecord):
+        labels = (record.method, record.model)
+        with self._lock:
+            self._requests[labels] = self._requests.get(labels, 0)+1
+            if record.error:
+                errorLabels = labels+(record.error,)
+                self._errors[errorLabels] = self._errors.get(errorLabels, 0)+1
+            self._observe('latency', labels, record.latency)
+            self._observe('queueWait', labels, record.queueWait)
+            if record.timeToFirstToken is not None:
+                self._observe('timeToFirstToken', labels, record.timeToFirstToken)
+            for gap in record.interTokenGaps:
+                self._observe('interTokenGap', labels, gap)
+            if record.promptTokens is not None:
+                self._observe('promptTokens', labels, record.promptTokens)
+            if record.completionTokens is not None:
+                self._observe('completionTokens', labels, record.completionTokens)
+
+
+    def histogram(self, name: str, method: str, model: str) -> Histogram:
+        """
+        Return the `Histogram` for the metric `name`, e.g. `'latency'` or
+        `'timeToFirstToken'`, or `None` if nothing was recorded for it.
+        """
+        return self._histograms.get((name, (method, model)))
+
+
+    def requests(self, method: str, model: str) -> int:
+        return self._requests.get((method, model), 0)
+
+
+    def errors(self, method: str, model: str, error: str) -> int:
+        return self._errors.get((method, model, error), 0)
+
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._requests.clear()
+            self._errors.clear()
+
+
+    def prometheus(self, prefix: str = METRICS_PREFIX) -> str:
+        """
+        Export all the metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        A string ready to serve from a `/metrics` endpoint.
+        """
+        lines = [ ]
+        with self._lock:
+            lines.append('# HELP %s_requests_total Requests sent to the service' % prefix)
+            lines.append('# TYPE %s_requests_total counter' % prefix)
+            for labels, count in sorted(self._requests.items()):
+                lines.append('%s_requests_total{%s} %d' % (prefix, _labels(labels), count))
+            lines.append('# HELP %s_request_errors_total Requests that raised an error' % prefix)
+            lines.append('# TYPE %s_request_errors_total counter' % prefix)
+            for labels, count in sorted(self._errors.items()):
+                lines.append('%s_request_errors_total{%s} %d' % (prefix, _labels(labels), count))
+            for name, metric, description, _ in self._HISTOGRAMS:
+                metric = '%s_%s' % (prefix, metric)
+                lines.append('# HELP %s %s' % (metric, description))
+                lines.append('# TYPE %s histogram' % metric)
+                for (histogramName, labels), histogram in sorted(self._histograms.items(), key = lambda item: item[0]):
+                    if histogramName != name:
+                        continue
+                    for bound, count in histogram.buckets:
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (metric, _labels(labels), '+Inf' if bound == float('inf') else repr(bound), count))
+                    lines.append('%s_sum{%s} %s' % (metric, _labels(labels), repr(histogram.sum)))
+                    lines.append('%s_count{%s} %d' % (metric, _labels(labels), histogram.count))
+
+        return '\n'.join(lines)+'\n'
+
+
+class ObservedResponses(Responses):
+    """
+    `perplexipy.responses.Responses` that times every chunk and reports a
+    `CallRecord` to the observer when the stream ends, fails, or is closed.
+    Only used when the client has an observer, so that uninstrumented streams
+    pay nothing for it.
+    """
+    def __init__(self, responsesStream, observer: Observer, method: str, model: str, started: float, queueWait: float = 0.0, onDone = None, deadline = None):
+        super().__init__(responsesStream, onDone, deadline)
+        self._observer = observer
+        self._method = method
+        self._model = model
+        self._started = started
+        self._queueWait = queueWait
+        self._firstToken = None
+        self._lastToken = None
+        self._gaps = [ ]
+        self._reported = False
+
+
+    def _report(self, error: Exception = None):
+        if self._reported:
+            return
+        self._reported = True
+        usage = self._usage
+        self._observer.record(CallRecord(
+            self._method,
+            self._model,
+            self._queueWait,
+            time.perf_counter()-self._started,
+            self._firstToken-self._started if self._firstToken is not None else None,
+            tuple(self._gaps),
+            getattr(usage, 'prompt_tokens', None),
+            getattr(usage, 'completion_tokens', None),
+            type(error).__name__ if error else None,
+        ))
+
+
+    def __next__(self):
+        try:
+            result = super().__next__()
+        except StopIteration:
+            self._report()
+            raise
+        except Exception as e:
+            self._report(e)
+            raise
+        now = time.perf_counter()
+        if self._firstToken is None:
+            self._firstToken = now
+        else:
+            self._gaps.append(now-self._lastToken)
+        self._lastToken = now
+
+        return result
+
+
+    def close(self):
+        super().close()
+        self._report()
@@ -0,0 +1,253 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import json
+import random
+import threading
+import time
+
+
+# +++ constants +++
+
+MOCKSERVER_CITATIONS = [ 'https://example.com/mock-citation', ]
+MOCKSERVER_HOST = '127.0.0.1'
+
+
+# +++ functions +++
+
+def _tokenize(text: str) -> list:
+    # Words with their trailing space, so that the chunks join back into the
+    # original text.
+    words = text.split(' ')
+
+    return [ word+' ' for word in words[:-1] ]+[ words[-1], ]
+
+
+# +++ classes +++
+
+class _Handler(BaseHTTPRequestHandler):
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # response would wait on the client's delayed ACK.
+    disable_nagle_algorithm = True
+    protocol_version = 'HTTP/1.1'
+
+
+    def log_message(self, *_):
+        pass
+
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, e.g. on a deadline or a closed stream.
+            self.close_connection = True
+
+
+    def _sendJSON(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or { }).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _sendChunk(self, data: bytes):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+    def do_POST(self):
+        server = self.server.mock
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._sendJSON(404, { 'error': { 'message': 'Unknown path %s' % self.path, 'type': 'invalid_request_error', }, })
+            return
+
+        error = server._nextError()
+        if server.latency:
+            time.sleep(server.latency)
+        if error:
+            headers = { 'Retry-After': '%g' % server.retryAfter, } if server.retryAfter is not None else None
+            self._sendJSON(error, { 'error': { 'message': 'Injected error %d' % error, 'type': 'mock_error', 'code': error, }, }, headers)
+            return
+
+        model = request.get('model', 'sonar')
+        messages = request.get('messages') or [ { 'content': '', }, ]
+        content = server.response if server.response is not None else messages[-1].get('content', '')
+        tokens = _tokenize(content)
+        promptTokens = sum(len(str(message.get('content', '')).split()) for message in messages)
+        usage = { 'prompt_tokens': promptTokens, 'completion_tokens': len(tokens), 'total_tokens': promptTokens+len(tokens), }
+        identifier = 'mock-%d' % server._nextID()
+        created = int(time.time())
+
+        if not request.get('stream'):
+            if server.tokenRate:
+                time.sleep(len(tokens)/server.tokenRate)
+            self._sendJSON(200, {
+                'id': identifier,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'citations': MOCKSERVER_CITATIONS,
+                'search_results': [ { 'title': 'Mock search result %d' % n, 'url': url, } for n, url in enumerate(MOCKSERVER_CITATIONS) ],
+                'choices': [ { 'index': 0, 'message': { 'role': 'assistant', 'content': content, }, 'finish_reason': 'stop', }, ],
+                'usage': usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for n, token in enumerate(tokens):
+            if n and server.tokenRate:
+                time.sleep(1.0/server.tokenRate)
+            last = n == len(tokens)-1
+            chunk = {
+                'id': identifier,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'citations': MOCKSERVER_CITATIONS,
+                'choices': [ { 'index': 0, 'delta': { 'role': 'assistant', 'content': token, }, 'finish_reason': 'stop' if last else None, }, ],
+            }
+            if last:
+                chunk['usage'] = usage
+            self._sendChunk(b'data: %s\n\n' % json.dumps(chunk).encode('utf-8'))
+        self._sendChunk(b'data: [DONE]\n\n')
+        self._sendChunk(b'')
+
+
+class MockServer:
+    """
+    Local, stdlib-only server speaking the OpenAI-compatible
+    `/chat/completions` protocol used by Perplexity, streaming and
+    non-streaming, for offline tests, benchmarks, and load runs.  Responses
+    echo the last message unless a fixed `response` is set, and include usage
+    and citations like the real service.
+
+    ```python
+    with MockServer(latency = 0.05, tokenRate = 200.0) as server:
+        client = PerplexityClient(key = 'pplx-mock', endpoint = server.url)
+        print(client.query('Hello'))
+    ```
+    """
+    def __init__(self, port: int = 0, latency: float = 0.0, tokenRate: float = None, errorRate: float = 0.0, errorStatus: int = 429, retryAfter: float = None, response: str = None, seed: int = None):
+        """
+        Arguments
+        ---------
+            port
+        TCP port on the loopback interface; 0 picks a free one.
+
+            latency
+        Seconds to wait before answering each request; the time to first
+        token for streams.
+
+            tokenRate
+        Tokens per second generated after the first one, or `None` to answer
+        at full speed.
+
+            errorRate
+        Fraction of requests, 0.0-1.0, answered with `errorStatus`.
+
+            errorStatus
+        HTTP status of injected errors, e.g. 429 or 503.
+
+            retryAfter
+        Value in seconds of the `Retry-After` header sent with injected
+        errors, or `None` to omit it.
+
+            response
+        Fixed response text, or `None` to echo the last message.
+
+            seed
+        Seed for the error injection, for reproducible runs.
+        """
+        self.latency = latency
+        self.tokenRate = tokenRate
+        self.errorRate = errorRate
+        self.errorStatus = errorStatus
+        self.retryAfter = retryAfter
+        self.response = response
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._httpServer = ThreadingHTTPServer((MOCKSERVER_HOST, port), _Handler)
+        self._httpServer.daemon_threads = True
+        self._httpServer.mock = self
+        self._thread = None
+
+
+    def _nextError(self) -> int:
+        with self._lock:
+            if self.errorRate and self._random.random() < self.errorRate:
+                self._errors += 1
+                return self.errorStatus
+
+        return None
+
+
+    def _nextID(self) -> int:
+        with self._lock:
+            self._requests += 1
+            return self._requests
+
+
+    def start(self):
+        """
+        Serve requests in a daemon thread.  Returns the server, for chaining.
+        """
+        if not self._thread:
+            self._thread = threading.Thread(target = self._httpServer.serve_forever, name = 'perplexipy-mockserver', daemon = True)
+            self._thread.start()
+
+        return self
+
+
+    def stop(self):
+        if self._thread:
+            self._httpServer.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpServer.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL to pass as the client `endpoint`.
+        """
+        return 'http://%s:%d' % self._httpServer.server_address[:2]
+
+
+    @property
+    def requests(self) -> int:
+        """
+        Number of requests answered successfully.
+        """
+        return self._requests
+
+
+    @property
+    def errors(self) -> int:
+        """
+        Number of injected errors.
+        """
+        return self._errors
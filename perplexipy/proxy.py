@@ -0,0 +1,412 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+# http.server is imported when a server is created; perplexipy.codex imports
+# this module for its defaults and must start fast.
+
+from perplexipy import PerplexityClient
+from perplexipy.errors import PerplexityClientError
+
+import json
+import threading
+import time
+
+
+# +++ constants +++
+
+PROXY_CLIENT_CONCURRENCY = 8
+"""
+Default requests in flight per proxy client; more are answered with HTTP 429.
+"""
+PROXY_DEFAULT_PORT = 8089
+PROXY_HOST = '127.0.0.1'
+"""
+Default interface:  loopback only.  The proxy answers with its own upstream
+key; expose it on a network only behind something that authenticates.
+"""
+PROXY_MAX_REQUEST_SIZE = 8*1024*1024
+
+
+_handlerClass = None
+
+
+# +++ functions +++
+
+def _errorBody(message: str, errorType: str, code = None) -> dict:
+    return { 'error': { 'message': message, 'type': errorType, 'code': code, }, }
+
+
+def _upstreamError(error: Exception) -> tuple:
+    # (status, body) for an exception raised by the client, passing the
+    # service's own status through when there is one.
+    from openai import APIConnectionError
+
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status, _errorBody(str(error), 'upstream_error', status)
+    if isinstance(error, APIConnectionError):
+        return 502, _errorBody(str(error), 'upstream_unavailable')
+    if isinstance(error, PerplexityClientError):
+        return 400, _errorBody(str(error), 'invalid_request_error')
+
+    return 500, _errorBody('%s: %s' % (type(error).__name__, error), 'proxy_error')
+
+
+def _parseRequest(body: bytes) -> tuple:
+    # (model, messages, stream) from a chat completions request.  Parameters
+    # other than these aren't forwarded.
+    try:
+        request = json.loads(body or b'{}')
+    except ValueError:
+        raise PerplexityClientError('request body is not valid JSON')
+    if not isinstance(request, dict):
+        raise PerplexityClientError('request body must be a JSON object')
+    messages = request.get('messages')
+    if not isinstance(messages, list) or not messages:
+        raise PerplexityClientError('messages must be a non-empty list')
+    for message in messages:
+        if not isinstance(message, dict) or not isinstance(message.get('content'), str) or not isinstance(message.get('role'), str):
+            raise PerplexityClientError('each message must have string role and content fields')
+    model = request.get('model')
+    if model is not None and not isinstance(model, str):
+        raise PerplexityClientError('model must be a string')
+
+    return model, [ { 'role': message['role'], 'content': message['content'], } for message in messages ], bool(request.get('stream'))
+
+
+def _makeHandler():
+    global _handlerClass
+
+    if _handlerClass is None:
+        from http.server import BaseHTTPRequestHandler
+
+        _handlerClass = type('_ProxyHandler', (_Handler, BaseHTTPRequestHandler), { 'disable_nagle_algorithm': True, 'protocol_version': 'HTTP/1.1', })
+
+    return _handlerClass
+
+
+# +++ classes +++
+
+class _Handler:
+    # Request handling, mixed into http.server.BaseHTTPRequestHandler by
+    # _makeHandler().
+    def log_message(self, *_):
+        pass
+
+
+    def _send(self, status: int, body: bytes, contentType: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or { }).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _sendJSON(self, status: int, payload: dict, headers: dict = None):
+        self._send(status, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+
+
+    def _sendChunk(self, data: bytes):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+    def _clientID(self) -> str:
+        # Clients are told apart by their API key, e.g. one per developer or
+        # service, or else by address.  Keys are only kept hashed.
+        authorization = self.headers.get('Authorization')
+        if authorization:
+            import hashlib
+
+            return hashlib.blake2b(authorization.encode('utf-8'), digest_size = 16).hexdigest()
+
+        return self.client_address[0]
+
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/metrics':
+            self._send(200, self.server.proxy.metrics().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        self._sendJSON(404, _errorBody('Unknown path %s' % self.path, 'invalid_request_error'))
+
+
+    def do_POST(self):
+        proxy = self.server.proxy
+        length = int(self.headers.get('Content-Length', 0))
+        if length > PROXY_MAX_REQUEST_SIZE:
+            self.close_connection = True
+            self._sendJSON(413, _errorBody('Request larger than %d bytes' % PROXY_MAX_REQUEST_SIZE, 'invalid_request_error'))
+            return
+        body = self.rfile.read(length)
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._sendJSON(404, _errorBody('Unknown path %s' % self.path, 'invalid_request_error'))
+            return
+        try:
+            model, messages, stream = _parseRequest(body)
+        except PerplexityClientError as e:
+            self._sendJSON(400, _errorBody(str(e), 'invalid_request_error'))
+            return
+
+        clientID = self._clientID()
+        if not proxy._admit(clientID):
+            self._sendJSON(429, _errorBody('Too many concurrent requests from this client', 'rate_limit_error', 429), { 'Retry-After': '1', })
+            return
+        try:
+            if stream:
+                self._stream(proxy, model, messages)
+            else:
+                self._complete(proxy, model, messages)
+        finally:
+            proxy._release(clientID)
+
+
+    def _complete(self, proxy, model: str, messages: list):
+        model = model or proxy.client.model
+        try:
+            # The upstream body passes through undecoded, with its usage and
+            # citations; cache hits return the body stored as str.
+            body = proxy.client._complete(messages, model = model, method = 'proxy', raw = True)
+        except Exception as e:
+            proxy._count('errors')
+            self._sendJSON(*_upstreamError(e))
+            return
+        self._send(200, body.encode('utf-8') if isinstance(body, str) else body, 'application/json')
+
+
+    def _stream(self, proxy, model: str, messages: list):
+        model = model or proxy.client.model
+        try:
+            responses = proxy.client._stream(messages, model, method = 'proxyStream')
+        except Exception as e:
+            proxy._count('errors')
+            self._sendJSON(*_upstreamError(e))
+            return
+
+        identifier = proxy._nextID()
+        created = int(time.time())
+
+        def event(delta: dict, finishReason: str = None, extra: dict = None) -> bytes:
+            chunk = {
+                'id': identifier,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [ { 'index': 0, 'delta': delta, 'finish_reason': finishReason, }, ],
+            }
+            if extra:
+                chunk.update(extra)
+            return b'data: %s\n\n' % json.dumps(chunk).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        with responses:
+            try:
+                self._sendChunk(event({ 'role': 'assistant', 'content': '', }))
+                for content in responses:
+                    self._sendChunk(event({ 'content': content, }))
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away; closing the responses frees the
+                # upstream connection, unless other subscribers share it.
+                self.close_connection = True
+                return
+            except Exception as e:
+                # Too late for an HTTP status; the error goes in the stream.
+                proxy._count('errors')
+                self._sendChunk(b'data: %s\n\n' % json.dumps(_upstreamError(e)[1]).encode('utf-8'))
+                self._sendChunk(b'')
+                self.close_connection = True
+                return
+            extra = { }
+            usage = responses.usage
+            if usage is not None:
+                extra['usage'] = { 'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens, 'total_tokens': usage.total_tokens, }
+            if responses.citations:
+                extra['citations'] = list(responses.citations)
+            self._sendChunk(event({ }, responses.finishReason or 'stop', extra))
+        self._sendChunk(b'data: [DONE]\n\n')
+        self._sendChunk(b'')
+
+
+class ProxyServer:
+    """
+    Local OpenAI-compatible `/chat/completions` endpoint, streaming and
+    non-streaming, that forwards requests through one shared
+    `perplexipy.PerplexityClient`.  Every client of the proxy, e.g. each
+    developer's tools and each service on a host, benefits from the shared
+    client's connection pool, response cache, request coalescing, rate
+    limiter, and retry policy; existing clients only need their `endpoint`
+    pointed at the proxy.  Each proxy client, identified by its API key or
+    else its address, gets at most `clientConcurrency` requests in flight.
+    Metrics are served in the Prometheus format from `/metrics`.
+
+    ```python
+    client = PerplexityClient(key = key, cache = MemoryCache(), singleFlight = SingleFlight(), observer = MetricsAggregator())
+    with ProxyServer(client, port = 8089) as proxy:
+        teamClient = PerplexityClient(key = 'pplx-team', endpoint = proxy.url)
+        print(teamClient.query('Hello'))
+    ```
+
+    Only the `model`, `messages`, and `stream` request fields are forwarded.
+    """
+    def __init__(self, client: PerplexityClient, host: str = PROXY_HOST, port: int = PROXY_DEFAULT_PORT, clientConcurrency: int = PROXY_CLIENT_CONCURRENCY):
+        """
+        Arguments
+        ---------
+            client
+        The `perplexipy.PerplexityClient` that sends requests upstream; its
+        `model` is used for requests that don't name one.
+
+            host
+        Interface to listen on.
+
+            port
+        TCP port; 0 picks a free one.
+
+            clientConcurrency
+        Maximum requests in flight per proxy client.
+        """
+        self.client = client
+        self._clientConcurrency = clientConcurrency
+        self._lock = threading.Lock()
+        self._inFlight = dict()
+        self._counters = { 'requests': 0, 'rejected': 0, 'errors': 0, }
+        self._responses = 0
+        from http.server import ThreadingHTTPServer
+
+        self._httpServer = ThreadingHTTPServer((host, port), _makeHandler())
+        self._httpServer.daemon_threads = True
+        self._httpServer.proxy = self
+        self._thread = None
+
+
+    def _admit(self, clientID: str) -> bool:
+        with self._lock:
+            inFlight = self._inFlight.get(clientID, 0)
+            if inFlight >= self._clientConcurrency:
+                self._counters['rejected'] += 1
+                return False
+            self._inFlight[clientID] = inFlight+1
+            self._counters['requests'] += 1
+
+            return True
+
+
+    def _release(self, clientID: str):
+        with self._lock:
+            inFlight = self._inFlight[clientID]-1
+            if inFlight:
+                self._inFlight[clientID] = inFlight
+            else:
+                del self._inFlight[clientID]
+
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+    def _nextID(self) -> str:
+        with self._lock:
+            self._responses += 1
+            return 'proxy-%d' % self._responses
+
+
+    def metrics(self) -> str:
+        """
+        The proxy metrics, followed by the shared client observer's if it has a
+        `prometheus()` method, e.g. a `perplexipy.metrics.MetricsAggregator`.
+
+        Returns
+        -------
+        A string in the Prometheus text exposition format.
+        """
+        from perplexipy.metrics import METRICS_PREFIX
+
+        prefix = '%s_proxy' % METRICS_PREFIX
+        with self._lock:
+            counters = dict(self._counters)
+            inFlight = sum(self._inFlight.values())
+            clients = len(self._inFlight)
+        lines = [
+            '# HELP %s_requests_total Requests admitted by the proxy' % prefix,
+            '# TYPE %s_requests_total counter' % prefix,
+            '%s_requests_total %d' % (prefix, counters['requests']),
+            '# HELP %s_rejected_total Requests rejected by the per-client concurrency limit' % prefix,
+            '# TYPE %s_rejected_total counter' % prefix,
+            '%s_rejected_total %d' % (prefix, counters['rejected']),
+            '# HELP %s_errors_total Requests that failed upstream' % prefix,
+            '# TYPE %s_errors_total counter' % prefix,
+            '%s_errors_total %d' % (prefix, counters['errors']),
+            '# HELP %s_in_flight Requests in progress' % prefix,
+            '# TYPE %s_in_flight gauge' % prefix,
+            '%s_in_flight %d' % (prefix, inFlight),
+            '# HELP %s_active_clients Clients with requests in progress' % prefix,
+            '# TYPE %s_active_clients gauge' % prefix,
+            '%s_active_clients %d' % (prefix, clients),
+        ]
+        cache = self.client.cache
+        if cache is not None:
+            stats = cache.stats
+            for name, description in (('hits', 'Response cache hits'), ('misses', 'Response cache misses')):
+                lines.append('# HELP %s_cache_%s_total %s' % (prefix, name, description))
+                lines.append('# TYPE %s_cache_%s_total counter' % (prefix, name))
+                lines.append('%s_cache_%s_total %d' % (prefix, name, getattr(stats, name)))
+            lines.append('# HELP %s_cache_entries Responses in the cache' % prefix)
+            lines.append('# TYPE %s_cache_entries gauge' % prefix)
+            lines.append('%s_cache_entries %d' % (prefix, stats.entries))
+        result = '\n'.join(lines)+'\n'
+        prometheus = getattr(self.client.observer, 'prometheus', None)
+        if prometheus:
+            result += prometheus()
+
+        return result
+
+
+    def start(self):
+        """
+        Serve requests in a daemon thread.  Returns the server, for chaining.
+        """
+        if not self._thread:
+            self._thread = threading.Thread(target = self._httpServer.serve_forever, name = 'perplexipy-proxy', daemon = True)
+            self._thread.start()
+
+        return self
+
+
+    def serve(self):
+        """
+        Serve requests in the calling thread until interrupted, e.g. by Ctrl-C.
+        """
+        try:
+            self._httpServer.serve_forever()
+        finally:
+            self._httpServer.server_close()
+
+
+    def stop(self):
+        if self._thread:
+            self._httpServer.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpServer.server_close()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL to pass as the client `endpoint`.
+        """
+        return 'http://%s:%d' % self._httpServer.server_address[:2]
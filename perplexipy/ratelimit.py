@@ -0,0 +1,421 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+import random
+import threading
+import time
+
+
+# +++ constants +++
+
+RATELIMIT_DEFAULT_COMPLETION_TOKENS = 256
+"""
+Completion tokens reserved from the tokens per minute budget before a request
+is sent; the difference is settled when the service reports the actual usage.
+"""
+RATELIMIT_RETRYABLE_STATUS = { 408, 409, 429, 500, 502, 503, 504, }
+
+
+_Permit = namedtuple('_Permit', [ 'startedAt', 'tokens', ])
+
+
+# +++ functions +++
+
+def retryAfter(error: Exception) -> float:
+    """
+    Extract the delay requested by the service from the `Retry-After` or
+    `retry-after-ms` headers of the response attached to an
+    `openai.APIStatusError`.
+
+    Returns
+    -------
+    The delay in seconds, or `None` if the error carries no such header.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value)/1000.0
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # HTTP-date form; rare, so email.utils is imported only here.
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp()-time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _statusCode(error: Exception) -> int:
+    return getattr(error, 'status_code', None)
+
+
+# +++ classes +++
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.  Holds up to `capacity` tokens and refills at
+    `rate` tokens per second.  The level may go negative when a caller
+    settles a debt, e.g. when a request used more tokens than it reserved;
+    later callers wait until the bucket recovers.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._level = float(capacity)
+        self._updatedAt = time.monotonic()
+        self._condition = threading.Condition()
+
+
+    def _refill(self, now: float):
+        self._level = min(self._capacity, self._level+(now-self._updatedAt)*self._rate)
+        self._updatedAt = now
+
+
+    def acquire(self, amount: float = 1.0, timeout: float = None) -> bool:
+        """
+        Take `amount` tokens, waiting until they're available.  Amounts larger
+        than the capacity are admitted once the bucket is full.
+
+        Returns
+        -------
+        `True` if the tokens were taken, `False` if `timeout` seconds elapsed
+        first.
+        """
+        deadline = None if timeout is None else time.monotonic()+timeout
+        needed = min(amount, self._capacity)
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._level >= needed:
+                    self._level -= amount
+                    return True
+                wait = (needed-self._level)/self._rate
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = min(wait, deadline-now)
+                self._condition.wait(wait)
+
+
+    def adjust(self, amount: float):
+        """
+        Return `amount` tokens to the bucket, or take them if negative,
+        without waiting.
+        """
+        with self._condition:
+            self._refill(time.monotonic())
+            self._level = min(self._capacity, self._level+amount)
+            self._condition.notify_all()
+
+
+    @property
+    def level(self) -> float:
+        with self._condition:
+            self._refill(time.monotonic())
+            return self._level
+
+
+class AIMDController:
+    """
+    Adaptive concurrency limit using additive increase, multiplicative
+    decrease, the TCP congestion control scheme.  Each successful request
+    below the latency target grows the limit by `1/limit`, i.e. by about one
+    per round of requests; a throttled or slow request cuts it by
+    `backoffRatio`.  Only requests started after the last cut can cut it
+    again, so a burst of 429s from one congestion event counts once.
+    """
+    def __init__(self, initialLimit: float = 8.0, minLimit: float = 1.0, maxLimit: float = 64.0, latencyTarget: float = None, backoffRatio: float = 0.5):
+        """
+        Arguments
+        ---------
+            initialLimit
+        Starting number of requests allowed in flight.
+
+            minLimit, maxLimit
+        Bounds for the limit.
+
+            latencyTarget
+        Latency in seconds above which a request counts as congestion, or
+        `None` to react to throttling only.
+
+            backoffRatio
+        Factor applied to the limit on congestion.
+        """
+        self._limit = float(initialLimit)
+        self._minLimit = float(minLimit)
+        self._maxLimit = float(maxLimit)
+        self._latencyTarget = latencyTarget
+        self._backoffRatio = backoffRatio
+        self._inFlight = 0
+        self._lastDecrease = 0.0
+        self._condition = threading.Condition()
+
+
+    def acquire(self, timeout: float = None) -> float:
+        """
+        Wait until a request may start.
+
+        Returns
+        -------
+        The start time, to pass to `release()`, or `None` on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic()+timeout
+        with self._condition:
+            while self._inFlight >= int(self._limit):
+                wait = None if deadline is None else deadline-time.monotonic()
+                if wait is not None and wait <= 0.0:
+                    return None
+                self._condition.wait(wait)
+            self._inFlight += 1
+
+        return time.monotonic()
+
+
+    def release(self, startedAt: float, throttled: bool = False):
+        """
+        Mark a request as finished and adjust the limit.
+
+        Arguments
+        ---------
+            startedAt
+        The value returned by `acquire()`.
+
+            throttled
+        `True` if the service rejected the request with a rate limit error.
+        """
+        now = time.monotonic()
+        congested = throttled or (self._latencyTarget is not None and now-startedAt > self._latencyTarget)
+        with self._condition:
+            self._inFlight -= 1
+            if congested:
+                if startedAt > self._lastDecrease:
+                    self._limit = max(self._minLimit, self._limit*self._backoffRatio)
+                    self._lastDecrease = now
+            else:
+                self._limit = min(self._maxLimit, self._limit+1.0/self._limit)
+            self._condition.notify_all()
+
+
+    def cancel(self):
+        """
+        Give back a slot taken with `acquire()` by a request that was never
+        sent, without adjusting the limit.
+        """
+        with self._condition:
+            self._inFlight -= 1
+            self._condition.notify_all()
+
+
+    @property
+    def limit(self) -> float:
+        return self._limit
+
+
+    @property
+    def inFlight(self) -> int:
+        return self._inFlight
+
+
+class RateLimiter:
+    """
+    Client-side rate limiter combining request and token budgets with an
+    adaptive concurrency limit.  Thread-safe; share one instance among all the
+    clients and threads that use the same API key:
+
+    ```python
+    limiter = RateLimiter(requestsPerMinute = 50, tokensPerMinute = 100000, concurrency = AIMDController())
+    clients = [ PerplexityClient(key = key, rateLimiter = limiter, retryPolicy = RetryPolicy()) for _ in range(4) ]
+    ```
+    """
+    def __init__(self, requestsPerMinute: float = None, tokensPerMinute: float = None, concurrency: AIMDController = None, completionTokens: int = RATELIMIT_DEFAULT_COMPLETION_TOKENS):
+        """
+        Arguments
+        ---------
+            requestsPerMinute
+        Request budget, or `None` for no limit.  Bursts of up to one second
+        worth of requests are allowed.
+
+            tokensPerMinute
+        Prompt plus completion token budget, or `None` for no limit.
+
+            concurrency
+        An optional `AIMDController` limiting the requests in flight.
+
+            completionTokens
+        Completion tokens reserved per request until the actual usage is
+        known.
+        """
+        self._requests = TokenBucket(requestsPerMinute/60.0, max(1.0, requestsPerMinute/60.0)) if requestsPerMinute else None
+        self._tokens = TokenBucket(tokensPerMinute/60.0, tokensPerMinute) if tokensPerMinute else None
+        self._concurrency = concurrency
+        self._completionTokens = completionTokens
+        self._lock = threading.Lock()
+        self._throttled = 0
+
+
+    def acquire(self, promptTokens: int = 0, timeout: float = None) -> _Permit:
+        """
+        Wait until the budgets allow a request with `promptTokens` to start.
+
+        Arguments
+        ---------
+            promptTokens
+        Estimated prompt tokens of the request.
+
+            timeout
+        Maximum seconds to wait, or `None` to wait as long as needed; 0 only
+        checks the budgets.
+
+        Returns
+        -------
+        A permit to pass to `release()` when the request finishes, or `None`
+        if `timeout` seconds elapsed first.
+        """
+        deadline = None if timeout is None else time.monotonic()+timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline-time.monotonic())
+
+        if self._concurrency:
+            startedAt = self._concurrency.acquire(remaining())
+            if startedAt is None:
+                return None
+        else:
+            startedAt = time.monotonic()
+        tokens = promptTokens+self._completionTokens
+        if self._requests and not self._requests.acquire(1.0, remaining()):
+            if self._concurrency:
+                self._concurrency.cancel()
+            return None
+        if self._tokens and not self._tokens.acquire(tokens, remaining()):
+            if self._requests:
+                self._requests.adjust(1.0)
+            if self._concurrency:
+                self._concurrency.cancel()
+            return None
+
+        return _Permit(startedAt, tokens)
+
+
+    def hasCapacity(self, promptTokens: int = 0) -> bool:
+        """
+        Check, without taking anything, whether a request with `promptTokens`
+        could start now, e.g. before sending an optional hedge request.
+        """
+        concurrency = self._concurrency
+        if concurrency and concurrency.inFlight >= int(concurrency.limit):
+            return False
+        if self._requests and self._requests.level < 1.0:
+            return False
+        if self._tokens and self._tokens.level < min(promptTokens+self._completionTokens, self._tokens._capacity):
+            return False
+
+        return True
+
+
+    def release(self, permit: _Permit, usage = None, error: Exception = None):
+        """
+        Settle a permit once its request finished.
+
+        Arguments
+        ---------
+            permit
+        The value returned by `acquire()`.
+
+            usage
+        The `usage` object reported by the service, used to settle the token
+        reservation, or `None`.
+
+            error
+        The exception raised by the request, or `None`.
+        """
+        throttled = _statusCode(error) == 429
+        if throttled:
+            with self._lock:
+                self._throttled += 1
+        if self._concurrency:
+            self._concurrency.release(permit.startedAt, throttled)
+        total = getattr(usage, 'total_tokens', None)
+        if self._tokens and total is not None:
+            self._tokens.adjust(permit.tokens-total)
+
+
+    @property
+    def concurrency(self) -> AIMDController:
+        return self._concurrency
+
+
+    @property
+    def throttled(self) -> int:
+        """
+        Number of requests the service rejected with HTTP 429.
+        """
+        return self._throttled
+
+
+class RetryPolicy:
+    """
+    Retry policy for rate limit, timeout, and transient server errors, with
+    jittered exponential backoff.  Delays requested by the service through
+    `Retry-After` headers take precedence over the backoff schedule.
+    """
+    def __init__(self, maxRetries: int = 5, baseDelay: float = 0.5, maxDelay: float = 30.0):
+        """
+        Arguments
+        ---------
+            maxRetries
+        Maximum number of retries per request.
+
+            baseDelay
+        Backoff delay in seconds for the first retry; doubles with each retry.
+
+            maxDelay
+        Upper bound in seconds for any single delay.
+        """
+        self._maxRetries = maxRetries
+        self._baseDelay = baseDelay
+        self._maxDelay = maxDelay
+
+
+    def shouldRetry(self, error: Exception, attempt: int) -> bool:
+        """
+        `True` if a request that raised `error` on its `attempt`, counting from
+        0, should be retried.
+        """
+        if attempt >= self._maxRetries:
+            return False
+        from openai import APIConnectionError
+
+        status = _statusCode(error)
+        if status is not None:
+            return status in RATELIMIT_RETRYABLE_STATUS
+
+        # Includes openai.APITimeoutError.
+        return isinstance(error, APIConnectionError)
+
+
+    def delay(self, error: Exception, attempt: int) -> float:
+        """
+        Seconds to wait before retrying a request that raised `error` on its
+        `attempt`, counting from 0.
+        """
+        requested = retryAfter(error)
+        if requested is not None:
+            # Honor the service, plus up to 10% to spread synchronized clients.
+            return min(self._maxDelay, requested*(1.0+random.random()/10.0))
+
+        return random.uniform(0.0, min(self._maxDelay, self._baseDelay*2**attempt))
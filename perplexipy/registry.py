@@ -0,0 +1,196 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+
+# +++ constants +++
+
+REGISTRY_DEFAULT_TTL = 3600.0 # seconds
+REGISTRY_FILE_NAME = 'model-registry.json'
+"""
+Default file name for a persistent `ModelRegistry`, for use in the PerplexiPy
+user configuration directory.
+"""
+
+
+ModelHealth = namedtuple('ModelHealth', [
+    'model',
+    'endpoint',
+    'available',
+    'checkedAt',
+    'error',
+])
+"""
+Immutable record of the last known state of a model at an endpoint.
+
+Attributes
+----------
+    model
+The model name.
+
+    endpoint
+The service URL where the model was checked.
+
+    available
+`True` if the model answered a query, `False` if the service rejected it.
+
+    checkedAt
+Time of the check, in seconds since the epoch.
+
+    error
+The error message returned by the service if the model isn't available,
+otherwise `None`.
+"""
+
+
+# +++ classes +++
+
+class ModelRegistry:
+    """
+    Thread-safe registry of model health records, with TTL expiration and
+    optional persistence to a JSON file.  Clients consult the registry when
+    their `model` is set, and record the outcome of their queries in it, so
+    that model validation costs no extra round trips.
+
+    ```python
+    registry = ModelRegistry(CONFIG_PATH / REGISTRY_FILE_NAME)
+    client = PerplexityClient(key = key, registry = registry)
+    registry.refresh(client) # probe all models in a background thread
+    ```
+    """
+    def __init__(self, fileName: str = None, ttl: float = REGISTRY_DEFAULT_TTL):
+        """
+        Arguments
+        ---------
+            fileName
+        Path to the JSON file where records are persisted, or `None` to keep
+        the registry in memory only.
+
+            ttl
+        Time to live in seconds for each record.  Expired records are treated
+        as unknown.
+        """
+        self._fileName = pathlib.Path(fileName) if fileName else None
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._records = dict()
+        self._load()
+
+
+    def _load(self):
+        if not self._fileName or not self._fileName.exists():
+            return
+        try:
+            with open(self._fileName, 'r') as inputFile:
+                records = json.load(inputFile)
+            self._records = { (record[1], record[0]): ModelHealth(*record) for record in records }
+        except (OSError, ValueError, TypeError):
+            # A corrupt registry is only a cache; start over.
+            self._records = dict()
+
+
+    def _save(self):
+        if not self._fileName:
+            return
+        # The registry is only a cache; failing to persist it must never fail
+        # the query that updated it.
+        tempName = None
+        try:
+            os.makedirs(self._fileName.parent, exist_ok = True)
+            fd, tempName = tempfile.mkstemp(dir = self._fileName.parent, prefix = '.%s-' % self._fileName.name)
+            with os.fdopen(fd, 'w') as outputFile:
+                json.dump([ list(record) for record in self._records.values() ], outputFile)
+            os.replace(tempName, self._fileName)
+        except OSError:
+            if tempName:
+                try:
+                    os.remove(tempName)
+                except OSError:
+                    pass
+
+
+    def get(self, endpoint: str, model: str) -> ModelHealth:
+        """
+        Return the `perplexipy.registry.ModelHealth` record for `model` at
+        `endpoint`, or `None` if it's unknown or expired.
+        """
+        record = self._records.get((endpoint, model))
+        if record is not None and record.checkedAt+self._ttl < time.time():
+            record = None
+
+        return record
+
+
+    def record(self, endpoint: str, model: str, available: bool, error: str = None) -> ModelHealth:
+        """
+        Record the outcome of a query to `model` at `endpoint`.  Persists the
+        registry if the model's availability changed or its record was stale.
+
+        Returns
+        -------
+        The new `perplexipy.registry.ModelHealth` record.
+        """
+        health = ModelHealth(model, endpoint, available, time.time(), error)
+        with self._lock:
+            previous = self.get(endpoint, model)
+            self._records[(endpoint, model)] = health
+            if previous is None or previous.available != available:
+                self._save()
+
+        return health
+
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._save()
+
+
+    def refresh(self, client, models = None, background: bool = True):
+        """
+        Probe each model with a short query through `client`, recording the
+        results.  Transient errors, e.g. network failures, leave the model's
+        record unchanged.
+
+        Arguments
+        ---------
+            client
+        A `perplexipy.PerplexityClient` instance.
+
+            models
+        An iterable of model names; defaults to all `client.models`.
+
+            background
+        If `True`, run the probes in a daemon thread and return immediately.
+
+        Returns
+        -------
+        The `threading.Thread` running the probes if `background`, otherwise a
+        list of `perplexipy.registry.ModelHealth` records.
+        """
+        models = tuple(models if models is not None else client.models.keys())
+
+        def probeAll():
+            results = [ ]
+            for model in models:
+                try:
+                    results.append(client.checkModel(model))
+                except Exception:
+                    pass
+            return results
+
+        if not background:
+            return probeAll()
+
+        thread = threading.Thread(target = probeAll, name = 'perplexipy-registry', daemon = True)
+        thread.start()
+
+        return thread
@@ -1,25 +1,321 @@
 # See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
 
 
-class Responses:
+from perplexipy.deadline import CallCancelled
+from perplexipy.deadline import DeadlineExceeded
+
+import weakref
+
+
+class _ResponsesBase:
+    """
+    @private
+    Stream metadata and accumulated text shared by `Responses` and
+    `AsyncResponses`.
+    """
+    def __init__(self, responsesStream, onDone = None, deadline = None):
+        self._responsesStream = responsesStream
+        self._chunks = [ ]
+        self._citations = None
+        self._done = False
+        self._finishReason = None
+        self._usage = None
+        self._onDone = onDone
+        self._deadline = deadline
+        self._unwatch = None
+        self._finalizer = None
+        if onDone is not None:
+            # Streams dropped without being read to the end or closed settle
+            # their rate limiter permit when they're collected, so that the
+            # limiter doesn't lose the slot.
+            self._finalizer = weakref.finalize(self, onDone, None, None)
+        if deadline is not None and deadline.cancelToken is not None:
+            # Cancelling closes the HTTP stream right away, even if nobody is
+            # reading it.
+            self._unwatch = deadline.cancelToken._watch(self._closeStream)
+
+
+    def _closeStream(self):
+        close = getattr(self._responsesStream, 'close', None)
+        if close:
+            close()
+
+
+    def _finish(self, error: Exception = None):
+        # Called once when the stream ends, fails, or is closed; onDone(usage,
+        # error) lets the client settle rate limiter permits.
+        self._done = True
+        if self._unwatch:
+            self._unwatch()
+            self._unwatch = None
+        onDone = self._onDone
+        if onDone:
+            self._onDone = None
+            self._finalizer.detach()
+            onDone(self._usage, error)
+
+
+    def _update(self, chunk):
+        # Metadata is checked on every chunk but only set on a few of them;
+        # keep this path cheap for fast token streams.
+        choices = chunk.choices
+        content = None
+        if choices:
+            choice = choices[0]
+            content = choice.delta.content
+            if choice.finish_reason:
+                self._finishReason = choice.finish_reason
+        usage = getattr(chunk, 'usage', None)
+        if usage is not None:
+            self._usage = usage
+        citations = getattr(chunk, 'citations', None)
+        if citations:
+            self._citations = citations
+        if content:
+            self._chunks.append(content)
+
+        return content
+
+
+    @property
+    def done(self) -> bool:
+        """
+        `True` once the stream ended or was closed.
+        """
+        return self._done
+
+
+    @property
+    def finishReason(self) -> str:
+        """
+        The reason the model stopped generating, e.g. `'stop'` or `'length'`,
+        or `None` if the stream hasn't ended.
+        """
+        return self._finishReason
+
+
+    @property
+    def usage(self):
+        """
+        The OpenAI `CompletionUsage` object with the prompt, completion, and
+        total token counts, or `None` until the service reports it, usually in
+        the last chunk.
+        """
+        return self._usage
+
+
+    @property
+    def citations(self) -> list:
+        """
+        The list of citation URLs reported by Perplexity, or `None`.
+        """
+        return self._citations
+
+
+class Responses(_ResponsesBase):
     """
     Encapsulates all the streaming responses from a query and enables access to
     it using a purpose-built iterable.  Strips all the OpenAI response metadata
     and returns only the textual response.  It's a streaming iterable,
     open-ended.
-    """
-    def __init__(self, responsesStream):
-        self._responsesStream = responsesStream
 
+    Empty chunks are skipped.  The stream's finish reason, token usage, and
+    citations are available as attributes as soon as the service sends them,
+    and `text()` returns the complete response.  Close the object, or use it as
+    a context manager, to stop reading early and release the HTTP connection:
+
+    ```python
+    with client.queryStreamable('List all US presidents') as results:
+        for result in results:
+            print(result, end = '')
+    print(results.finishReason, results.usage, results.citations)
+    ```
+
+    A stream dropped without being closed gives its rate limiter permit back
+    when it's garbage collected.
 
+    Streams opened with a deadline, stall timeout, or cancellation token raise
+    a `perplexipy.deadline.DeadlineExceeded`, `StreamStalled`, or
+    `CallCancelled` error when they hit it, and release the connection.
+    """
     def __iter__(self):
         return self
 
 
     def __next__(self):
+        if self._done:
+            raise StopIteration
+        stream = self._responsesStream
+        update = self._update
+        deadline = self._deadline
         try:
-            result = self._responsesStream.__next__().choices[0].delta.content
+            while True:
+                if deadline is not None:
+                    deadline.check()
+                content = update(next(stream))
+                if content:
+                    return content
+        except StopIteration:
+            self._finish()
+            raise
         except Exception as e:
-            raise e
-        return result
+            if deadline is not None:
+                error = deadline.translate(e)
+                if isinstance(error, (CallCancelled, DeadlineExceeded)):
+                    self._finish(error)
+                    self._closeStream()
+                    if error is e:
+                        raise
+                    raise error from e
+            self._finish(e)
+            raise
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *_):
+        self.close()
+
+
+    def close(self):
+        """
+        Stop reading the stream and release the underlying HTTP connection.
+        Safe to call more than once.
+        """
+        if not self._done:
+            self._finish()
+            self._closeStream()
+
+
+    def collect(self) -> list:
+        """
+        Read the rest of the stream.
+
+        Returns
+        -------
+        A list of all the response chunks, including those already returned by
+        the iterator.
+        """
+        for _ in self:
+            pass
+
+        return self._chunks
+
+
+    def text(self) -> str:
+        """
+        Read the rest of the stream.
+
+        Returns
+        -------
+        The complete response text, including the chunks already returned by
+        the iterator.
+        """
+        return ''.join(self.collect())
+
+
+class AsyncResponses(_ResponsesBase):
+    """
+    Asynchronous counterpart of `perplexipy.responses.Responses`.  Wraps an
+    OpenAI `AsyncStream` and exposes only the textual responses through an
+    async iterable, for use with `async for`.  Supports the same metadata
+    attributes, deadlines, and `async with` for releasing the connection
+    early.
+    """
+    def __init__(self, responsesStream, onDone = None, deadline = None):
+        import asyncio
+
+        # The cancellation token may close the stream from another thread.
+        self._loop = asyncio.get_running_loop() if deadline is not None and deadline.cancelToken is not None else None
+        super().__init__(responsesStream, onDone, deadline)
+
+
+    def _closeStream(self):
+        close = getattr(self._responsesStream, 'close', None)
+        if close:
+            self._loop.call_soon_threadsafe(lambda: self._loop.create_task(close()))
+
+
+    async def _closeAsyncStream(self):
+        close = getattr(self._responsesStream, 'close', None)
+        if close:
+            await close()
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        stream = self._responsesStream
+        update = self._update
+        deadline = self._deadline
+        try:
+            while True:
+                if deadline is not None:
+                    deadline.check()
+                content = update(await stream.__anext__())
+                if content:
+                    return content
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        except Exception as e:
+            if deadline is not None:
+                error = deadline.translate(e)
+                if isinstance(error, (CallCancelled, DeadlineExceeded)):
+                    self._finish(error)
+                    await self._closeAsyncStream()
+                    if error is e:
+                        raise
+                    raise error from e
+            self._finish(e)
+            raise
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+
+    async def close(self):
+        """
+        Stop reading the stream and release the underlying HTTP connection.
+        Safe to call more than once.
+        """
+        if not self._done:
+            self._finish()
+            await self._closeAsyncStream()
+
+
+    async def collect(self) -> list:
+        """
+        Read the rest of the stream.
+
+        Returns
+        -------
+        A list of all the response chunks, including those already returned by
+        the iterator.
+        """
+        async for _ in self:
+            pass
+
+        return self._chunks
+
+
+    async def text(self) -> str:
+        """
+        Read the rest of the stream.
 
+        Returns
+        -------
+        The complete response text.
+        """
+        return ''.join(await self.collect())
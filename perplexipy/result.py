@@ -0,0 +1,250 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+import json
+
+
+ResultUsage = namedtuple('ResultUsage', [
+    'prompt_tokens',
+    'completion_tokens',
+    'total_tokens',
+])
+"""
+Token counts of a `perplexipy.result.QueryResult`, with the same field names
+as the openai `CompletionUsage` object reported by
+`perplexipy.responses.Responses.usage`.
+
+Attributes
+----------
+    prompt_tokens
+Tokens in the request messages.
+
+    completion_tokens
+Tokens in the response.
+
+    total_tokens
+The sum of both.
+"""
+
+_DECODER = json.JSONDecoder()
+
+
+# +++ functions +++
+
+def usageOf(response) -> object:
+    """
+    Token usage of a service response.
+
+    Arguments
+    ---------
+        response
+    An openai `ChatCompletion`, or the raw body of one as `bytes` or `str`.
+
+    Returns
+    -------
+    The response's usage object, a `perplexipy.result.ResultUsage` for raw
+    bodies, or `None` if not reported.
+    """
+    if isinstance(response, (bytes, str)):
+        return _scanUsage(response)
+
+    return getattr(response, 'usage', None)
+
+
+def _resultUsage(usage) -> ResultUsage:
+    if not usage:
+        return None
+
+    return ResultUsage(usage.get('prompt_tokens'), usage.get('completion_tokens'), usage.get('total_tokens'))
+
+
+def _scanUsage(body) -> ResultUsage:
+    # Decode only the usage object, found from the end of the body, where the
+    # service puts it after the choices; the rest of the body is decoded only
+    # if the scan doesn't find a plausible one.
+    key = b'"usage"' if isinstance(body, bytes) else '"usage"'
+    start = body.rfind(key)
+    if start < 0:
+        return None
+    tail = body[start+len(key):]
+    if isinstance(tail, bytes):
+        tail = tail.decode('utf-8', errors = 'replace')
+    tail = tail.lstrip()
+    if tail.startswith(':'):
+        try:
+            usage = _DECODER.raw_decode(tail[1:].lstrip())[0]
+        except ValueError:
+            usage = None
+        if isinstance(usage, dict) and 'total_tokens' in usage:
+            return _resultUsage(usage)
+
+    return QueryResult(body).usage
+
+
+# +++ classes +++
+
+class QueryResult:
+    """
+    Compact result of `perplexipy.PerplexityClient.queryResult()`:  the
+    response text with its citations, search results, token usage, and finish
+    reason.  It keeps the raw response body, a single `bytes` or `str`, until
+    one of its attributes is read; then all of them are decoded at once with
+    `json`, without the openai SDK's pydantic models, and the body is dropped.
+    Instances have no `__dict__`, so workers can keep millions of them.
+
+    ```python
+    result = client.queryResult('Who wrote The Hobbit?')
+    print(result.text)
+    for url in result.citations:
+        print(url)
+    print(result.usage.total_tokens, result.finishReason)
+    ```
+    """
+    __slots__ = (
+        '_body',
+        '_citations',
+        '_finishReason',
+        '_id',
+        '_model',
+        '_searchResults',
+        '_texts',
+        '_usage',
+    )
+
+
+    def __init__(self, body):
+        """
+        Arguments
+        ---------
+            body
+        The JSON body of a chat completion response, `bytes` or `str`.
+        """
+        self._body = body
+        self._citations = ()
+        self._finishReason = None
+        self._id = None
+        self._model = None
+        self._searchResults = ()
+        self._texts = ()
+        self._usage = None
+
+
+    def _decode(self):
+        data = json.loads(self._body)
+        choices = data.get('choices') or ()
+        self._texts = tuple((choice.get('message') or { }).get('content') or '' for choice in choices)
+        self._finishReason = choices[0].get('finish_reason') if choices else None
+        self._citations = tuple(data.get('citations') or ())
+        self._searchResults = tuple(data.get('search_results') or ())
+        self._usage = _resultUsage(data.get('usage'))
+        self._model = data.get('model')
+        self._id = data.get('id')
+        self._body = None
+
+
+    @property
+    def decoded(self) -> bool:
+        """
+        `True` once the body was decoded.
+        """
+        return self._body is None
+
+
+    @property
+    def text(self) -> str:
+        """
+        The response text of the first choice, as returned by `query()`.
+        """
+        if self._body is not None:
+            self._decode()
+
+        return self._texts[0] if self._texts else ''
+
+
+    @property
+    def texts(self) -> tuple:
+        """
+        The response texts of all choices, as returned by `queryBatch()`.
+        """
+        if self._body is not None:
+            self._decode()
+
+        return self._texts
+
+
+    @property
+    def finishReason(self) -> str:
+        """
+        The reason the model stopped generating, e.g. `'stop'` or `'length'`.
+        """
+        if self._body is not None:
+            self._decode()
+
+        return self._finishReason
+
+
+    @property
+    def citations(self) -> tuple:
+        """
+        The citation URLs reported by Perplexity; empty if none.
+        """
+        if self._body is not None:
+            self._decode()
+
+        return self._citations
+
+
+    @property
+    def searchResults(self) -> tuple:
+        """
+        The search results reported by Perplexity, as dictionaries with the
+        `title`, `url`, and other fields the service sends; empty if none.
+        """
+        if self._body is not None:
+            self._decode()
+
+        return self._searchResults
+
+
+    @property
+    def usage(self) -> ResultUsage:
+        """
+        A `perplexipy.result.ResultUsage` with the token counts, or `None` if
+        the service didn't report them.
+        """
+        if self._body is not None:
+            self._decode()
+
+        return self._usage
+
+
+    @property
+    def model(self) -> str:
+        if self._body is not None:
+            self._decode()
+
+        return self._model
+
+
+    @property
+    def id(self) -> str:
+        """
+        The service's response identifier.
+        """
+        if self._body is not None:
+            self._decode()
+
+        return self._id
+
+
+    def __str__(self) -> str:
+        return self.text
+
+
+    def __repr__(self) -> str:
+        if self._body is not None:
+            return 'QueryResult(<%d bytes, not decoded>)' % len(self._body)
+
+        return 'QueryResult(%r, finishReason = %r, citations = %d, usage = %r)' % (self.text[:40], self._finishReason, len(self._citations), self._usage)
@@ -0,0 +1,303 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy import PERPLEXITY_API_URL
+from perplexipy import PerplexityClient
+from perplexipy.deadline import DeadlineExceeded
+from perplexipy.errors import PerplexityClientError
+from perplexipy.ratelimit import RATELIMIT_RETRYABLE_STATUS
+from perplexipy.ratelimit import RateLimiter
+from perplexipy.ratelimit import RetryPolicy
+from perplexipy.ratelimit import retryAfter
+from perplexipy.result import usageOf
+from perplexipy.tokens import estimateMessagesTokens
+
+import threading
+import time
+
+
+# +++ constants +++
+
+ROUTING_EJECT_AFTER = 3
+"""
+Consecutive backend failures that eject a backend from the rotation.
+"""
+ROUTING_EJECT_SECONDS = 30.0
+"""
+Time a backend stays ejected the first time; it doubles with each
+consecutive ejection, up to `ROUTING_MAX_EJECT_SECONDS`.
+"""
+ROUTING_EWMA_ALPHA = 0.2
+"""
+Weight of the newest sample in the latency and error rate moving averages.
+"""
+ROUTING_MAX_EJECT_SECONDS = 300.0
+
+
+# +++ functions +++
+
+def _isBackendError(error: Exception) -> bool:
+    # Errors caused by the backend or its quota, as opposed to the request;
+    # only these count against a backend's health.
+    from openai import APIConnectionError
+
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RATELIMIT_RETRYABLE_STATUS
+
+    # Includes openai.APITimeoutError.
+    return isinstance(error, APIConnectionError)
+
+
+# +++ classes +++
+
+class Backend:
+    """
+    One `(endpoint, key)` pair served by a `perplexipy.routing.RoutingClient`,
+    with its quota and health statistics.
+
+    Attributes
+    ----------
+        latency
+    Exponentially weighted moving average of the response latency in seconds,
+    or `None` before the first response.
+
+        errorRate
+    Exponentially weighted moving average of the backend failure rate, 0.0-1.0.
+
+        inFlight, requests, errors
+    Requests in progress, completed, and failed because of the backend.
+
+        ejections, ejectedUntil
+    Consecutive ejections, and the `time.monotonic()` value until which the
+    backend is out of the rotation.
+    """
+    def __init__(self, key: str, endpoint: str = PERPLEXITY_API_URL, rateLimiter: RateLimiter = None, httpClient = None):
+        """
+        Arguments
+        ---------
+            key
+        A valid API key string.
+
+            endpoint
+        The service URL, e.g. Perplexity's or a compatible gateway's.
+
+            rateLimiter
+        An optional `perplexipy.ratelimit.RateLimiter` with the key's quota.
+        Requests are routed away from backends whose quota is spent.
+
+            httpClient
+        An optional HTTP client, as for `perplexipy.PerplexityClient`.
+        """
+        # No SDK retries:  the routing client fails over to another backend
+        # instead.
+        self._client = PerplexityClient(key = key, endpoint = endpoint, httpClient = httpClient, retryPolicy = RetryPolicy(maxRetries = 0))
+        self._rateLimiter = rateLimiter
+        self.latency = None
+        self.errorRate = 0.0
+        self.inFlight = 0
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+        self.ejectedUntil = 0.0
+        self._failures = 0
+
+
+    @property
+    def endpoint(self) -> str:
+        return self._client._endpoint
+
+
+    @property
+    def ejected(self) -> bool:
+        return time.monotonic() < self.ejectedUntil
+
+
+    def _score(self) -> float:
+        # Expected time to a successful response, with the requests already in
+        # flight queued ahead.  Backends without samples score 0 so that they
+        # get measured first, unless they only failed so far.
+        if self.latency is None:
+            return float('inf') if self.errors else 0.0
+
+        return self.latency*(1+self.inFlight)/max(0.05, 1.0-self.errorRate)
+
+
+    def __repr__(self) -> str:
+        return 'Backend(%s, latency = %s, errorRate = %.2f, inFlight = %d%s)' % (self.endpoint, self.latency, self.errorRate, self.inFlight, ', ejected' if self.ejected else '')
+
+
+class RoutingClient(PerplexityClient):
+    """
+    `perplexipy.PerplexityClient` that spreads requests over a pool of
+    backends, `(endpoint, key)` pairs, to raise the aggregate throughput.
+    Each request goes to the healthy backend with the lowest expected latency,
+    from its moving average latency, error rate, and requests in flight, among
+    those with quota left.  A backend that fails repeatedly is ejected for a
+    while, and a request that fails on a backend because of it fails over to
+    the next one.
+
+    ```python
+    client = RoutingClient([
+        Backend(key = firstKey, rateLimiter = RateLimiter(requestsPerMinute = 50)),
+        Backend(key = secondKey, rateLimiter = RateLimiter(requestsPerMinute = 50)),
+        Backend(key = gatewayKey, endpoint = 'https://gateway.example.com'),
+    ])
+    print(client.query('Hello'))
+    ```
+    """
+    def __init__(self, backends: list, cache = None, registry = None, observer = None, singleFlight = None, hedgePolicy = None, ejectAfter: int = ROUTING_EJECT_AFTER, ejectSeconds: float = ROUTING_EJECT_SECONDS, alpha: float = ROUTING_EWMA_ALPHA):
+        """
+        Arguments
+        ---------
+            backends
+        A list of `perplexipy.routing.Backend` objects.
+
+            cache, registry, observer, singleFlight, hedgePolicy
+        As for `perplexipy.PerplexityClient`; shared by all the backends.
+
+            ejectAfter
+        Consecutive failures caused by a backend, e.g. HTTP 429 or 503 or a
+        connection error, that eject it.
+
+            ejectSeconds
+        Time a backend stays ejected the first time; it doubles with each
+        consecutive ejection.  A `Retry-After` from the backend takes
+        precedence.
+
+            alpha
+        Weight of the newest sample in the moving averages.
+
+        Raises
+        ------
+            PerplexityClientError
+        If `backends` is empty.
+        """
+        if not backends:
+            raise PerplexityClientError('backends cannot be empty')
+        self._backends = list(backends)
+        self._ejectAfter = ejectAfter
+        self._ejectSeconds = ejectSeconds
+        self._alpha = alpha
+        self._routingLock = threading.Lock()
+        first = self._backends[0]
+        super().__init__(key = first._client._key, endpoint = first.endpoint, cache = cache, registry = registry, observer = observer, singleFlight = singleFlight, hedgePolicy = hedgePolicy)
+
+
+    def _makeClient(self):
+        # Requests go through the backends' clients.
+        return None
+
+
+    def _candidates(self) -> list:
+        with self._routingLock:
+            now = time.monotonic()
+            healthy = [ backend for backend in self._backends if backend.ejectedUntil <= now ]
+            if not healthy:
+                # Fail open:  try the backend that comes back first.
+                healthy = [ min(self._backends, key = lambda backend: backend.ejectedUntil), ]
+
+            return sorted(healthy, key = lambda backend: (backend._score(), backend.inFlight, backend.requests))
+
+
+    def _acquire(self, candidates: list, promptTokens: int, deadline = None) -> tuple:
+        # The best backend with quota left now, or else wait for the best one.
+        for backend in candidates:
+            if not backend._rateLimiter:
+                return backend, None
+            permit = backend._rateLimiter.acquire(promptTokens, timeout = 0.0)
+            if permit:
+                return backend, permit
+        backend = candidates[0]
+        permit = backend._rateLimiter.acquire(promptTokens, timeout = deadline.remaining() if deadline else None)
+        if permit is None:
+            raise DeadlineExceeded('deadline exceeded waiting for the rate limiter')
+
+        return backend, permit
+
+
+    def _record(self, backend: Backend, started: float, error: Exception = None):
+        alpha = self._alpha
+        with self._routingLock:
+            backend.inFlight -= 1
+            backend.requests += 1
+            if error is None:
+                latency = time.monotonic()-started
+                backend.latency = latency if backend.latency is None else alpha*latency+(1.0-alpha)*backend.latency
+                backend.errorRate *= 1.0-alpha
+                backend._failures = 0
+                backend.ejections = 0
+                return
+            if not _isBackendError(error):
+                return
+            backend.errors += 1
+            backend.errorRate = alpha+(1.0-alpha)*backend.errorRate
+            backend._failures += 1
+            requested = retryAfter(error)
+            if backend._failures >= self._ejectAfter or requested:
+                backend.ejections += 1
+                seconds = requested or min(ROUTING_MAX_EJECT_SECONDS, self._ejectSeconds*2**(backend.ejections-1))
+                backend.ejectedUntil = time.monotonic()+seconds
+                backend._failures = 0
+
+
+    def _create(self, model: str, messages: list, stream: bool = False, deadline = None, raw: bool = False):
+        # Each backend is tried at most once per request, within the deadline;
+        # errors caused by the request itself aren't retried.
+        candidates = self._candidates()
+        promptTokens = estimateMessagesTokens(messages)
+        options = { }
+        while True:
+            if deadline is not None:
+                timeout = deadline.requestTimeout(stream)
+                if timeout is not None:
+                    options['timeout'] = timeout
+            backend, permit = self._acquire(candidates, promptTokens, deadline)
+            candidates.remove(backend)
+            with self._routingLock:
+                backend.inFlight += 1
+            started = time.monotonic()
+            completions = backend._client._client.chat.completions
+            if raw:
+                completions = completions.with_raw_response
+            try:
+                response = completions.create(model = model, messages = messages, stream = stream, **options)
+                if raw:
+                    response = response.content
+            except Exception as e:
+                if permit:
+                    backend._rateLimiter.release(permit, error = e)
+                self._record(backend, started, e)
+                if candidates and _isBackendError(e):
+                    continue
+                if deadline is not None:
+                    error = deadline.translate(e)
+                    if error is not e:
+                        raise error from e
+                raise
+            self._record(backend, started)
+            if permit and not stream:
+                backend._rateLimiter.release(permit, usage = usageOf(response))
+                permit = None
+
+            return response, ((backend, permit) if permit else None)
+
+
+    def _streamDone(self, permit):
+        if permit is None:
+            return None
+        backend, permit = permit
+
+        def onDone(usage, error):
+            backend._rateLimiter.release(permit, usage = usage, error = error)
+
+        return onDone
+
+
+    @property
+    def backends(self) -> tuple:
+        """
+        The `perplexipy.routing.Backend` objects, with their current
+        statistics.
+        """
+        return tuple(self._backends)
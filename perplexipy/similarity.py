@@ -0,0 +1,284 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import Counter
+from collections import OrderedDict
+
+from perplexipy.cache import CacheStats
+
+import hashlib
+import json
+import os
+import pathlib
+import re
+import struct
+import tempfile
+import threading
+
+
+# +++ constants +++
+
+SIMILARITY_BANDS = 8
+"""
+LSH bands of `SIMILARITY_PERMUTATIONS/SIMILARITY_BANDS` MinHash values each;
+prompts that match in any band are compared.  With 8 bands of 4 values, pairs
+with a Jaccard similarity above about 0.6 are found with high probability.
+"""
+SIMILARITY_BOILERPLATE_RATIO = 0.5
+"""
+Tokens present in more than this fraction of the entries of a scope, e.g. a
+fixed prompt prefix, are ignored when comparing prompts.
+"""
+SIMILARITY_DEFAULT_MAX_ENTRIES = 100000
+SIMILARITY_DEFAULT_THRESHOLD = 0.9
+SIMILARITY_MAX_CANDIDATES = 32
+"""
+Maximum LSH candidates compared with each lookup, most band matches first.
+"""
+SIMILARITY_PERMUTATIONS = 32
+
+
+_TOKEN_PATTERN = re.compile(r'[^\W_]+')
+_unpackHashes = struct.Struct('<%dH' % SIMILARITY_PERMUTATIONS).unpack
+
+
+# +++ functions +++
+
+def shingles(text: str) -> frozenset:
+    """
+    Normalize a prompt into its set of tokens:  case, whitespace, punctuation,
+    and word order don't matter.
+
+    Returns
+    -------
+    A `frozenset` of lowercase word strings.
+    """
+    return frozenset(_TOKEN_PATTERN.findall(text.lower()))
+
+
+# +++ classes +++
+
+class SimilarityCache:
+    """
+    Near-duplicate response cache.  Prompts are normalized with `shingles()`
+    and indexed with MinHash signatures in LSH buckets, so that a lookup
+    compares the prompt with a handful of candidates instead of every entry.
+    A cached response is returned if the Jaccard similarity of the prompts'
+    tokens reaches the threshold; tokens shared by most prompts in the scope,
+    e.g. a fixed instruction prefix, don't count.
+
+    Use it as a second tier behind an exact response cache:
+
+    ```python
+    client = PerplexityClient(key = key, cache = MemoryCache(), similarityCache = SimilarityCache(fileName))
+    client.query('How do I reverse a string in Java?')
+    client.query('how do I reverse a  string in java', similarity = 0.8) # cached
+    ```
+
+    Paraphrases that change a word that matters, e.g. a language name, can
+    still score above the threshold on long prompts; pick it accordingly.
+    """
+    def __init__(self, fileName: str = None, threshold: float = SIMILARITY_DEFAULT_THRESHOLD, maxEntries: int = SIMILARITY_DEFAULT_MAX_ENTRIES):
+        """
+        Arguments
+        ---------
+            fileName
+        Optional path to a JSON Lines file where entries are persisted.
+        Entries are appended as they're added; the file is compacted when
+        evictions make it twice as large as needed.
+
+            threshold
+        Default minimum Jaccard similarity, 0.0-1.0, for a hit.
+
+            maxEntries
+        Maximum number of entries; the oldest ones are evicted first.
+        """
+        self._fileName = pathlib.Path(fileName) if fileName else None
+        self._threshold = threshold
+        self._maxEntries = maxEntries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # id: (scope, tokens, signature, value)
+        self._buckets = dict()
+        self._frequencies = dict() # scope: [ entries, Counter(token), ]
+        self._tokenHashes = dict()
+        self._nextID = 0
+        self._lines = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._load()
+
+
+    def _hashes(self, token: str) -> tuple:
+        # One MinHash value per permutation from a single blake2b digest,
+        # memoized:  prompts reuse a small vocabulary.
+        hashes = self._tokenHashes.get(token)
+        if hashes is None:
+            if len(self._tokenHashes) > 4*self._maxEntries:
+                self._tokenHashes.clear()
+            hashes = self._tokenHashes[token] = _unpackHashes(hashlib.blake2b(token.encode('utf-8'), digest_size = 2*SIMILARITY_PERMUTATIONS).digest())
+
+        return hashes
+
+
+    def _signature(self, tokens: frozenset) -> tuple:
+        if not tokens:
+            return (0,)*SIMILARITY_PERMUTATIONS
+
+        return tuple(map(min, zip(*map(self._hashes, tokens))))
+
+
+    @staticmethod
+    def _bandKeys(scope: str, signature: tuple) -> list:
+        rows = SIMILARITY_PERMUTATIONS//SIMILARITY_BANDS
+
+        return [ (scope, band, signature[band*rows:(band+1)*rows]) for band in range(SIMILARITY_BANDS) ]
+
+
+    def _insert(self, scope: str, tokens: frozenset, signature: tuple, value):
+        # Called with the lock held.
+        entryID = self._nextID
+        self._nextID += 1
+        self._entries[entryID] = (scope, tokens, signature, value)
+        for bandKey in self._bandKeys(scope, signature):
+            self._buckets.setdefault(bandKey, set()).add(entryID)
+        frequencies = self._frequencies.setdefault(scope, [ 0, Counter(), ])
+        frequencies[0] += 1
+        frequencies[1].update(tokens)
+        while len(self._entries) > self._maxEntries:
+            self._evict()
+
+
+    def _evict(self):
+        entryID, (scope, tokens, signature, _) = self._entries.popitem(last = False)
+        for bandKey in self._bandKeys(scope, signature):
+            bucket = self._buckets[bandKey]
+            bucket.discard(entryID)
+            if not bucket:
+                del self._buckets[bandKey]
+        frequencies = self._frequencies[scope]
+        frequencies[0] -= 1
+        frequencies[1].subtract(tokens)
+        self._evictions += 1
+
+
+    def _informative(self, scope: str, tokens: frozenset) -> frozenset:
+        entries, counts = self._frequencies.get(scope, (0, None))
+        if entries < 8:
+            return tokens
+        limit = SIMILARITY_BOILERPLATE_RATIO*entries
+        informative = frozenset(token for token in tokens if counts[token] <= limit)
+
+        return informative or tokens
+
+
+    def get(self, scope: str, text: str, threshold: float = None):
+        """
+        Return the value stored for the prompt most similar to `text` in
+        `scope`, e.g. a `perplexipy.cache.cacheKey` of the endpoint, model,
+        and role, or `None` if none reaches the `threshold`.
+        """
+        threshold = self._threshold if threshold is None else threshold
+        tokens = shingles(text)
+        with self._lock:
+            candidates = Counter()
+            for bandKey in self._bandKeys(scope, self._signature(tokens)):
+                candidates.update(self._buckets.get(bandKey, ()))
+            informative = self._informative(scope, tokens)
+            best, bestScore = None, threshold
+            for entryID, _ in candidates.most_common(SIMILARITY_MAX_CANDIDATES):
+                other = self._informative(scope, self._entries[entryID][1])
+                union = len(informative | other)
+                score = len(informative & other)/union if union else 1.0
+                if score >= bestScore:
+                    best, bestScore = entryID, score
+            if best is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+
+            return self._entries[best][3]
+
+
+    def set(self, scope: str, text: str, value):
+        """
+        Store `value`, which must be JSON serializable, for the prompt `text`
+        in `scope`.
+        """
+        tokens = shingles(text)
+        with self._lock:
+            signature = self._signature(tokens)
+            self._insert(scope, tokens, signature, value)
+            if self._fileName:
+                self._append(scope, tokens, signature, value)
+
+
+    def _load(self):
+        if not self._fileName or not self._fileName.exists():
+            return
+        with self._lock:
+            try:
+                with open(self._fileName, 'r') as inputFile:
+                    for line in inputFile:
+                        scope, tokens, signature, value = json.loads(line)
+                        self._insert(scope, frozenset(tokens), tuple(signature), value)
+                        self._lines += 1
+            except (OSError, ValueError, TypeError):
+                # A corrupt index is only a cache; keep what was read.
+                pass
+            self._evictions = 0
+
+
+    def _append(self, scope: str, tokens: frozenset, signature: tuple, value):
+        # Called with the lock held.  Persistence failures never fail a query.
+        if self._lines >= 2*self._maxEntries:
+            self._compact()
+            return
+        try:
+            os.makedirs(self._fileName.parent, exist_ok = True)
+            with open(self._fileName, 'a') as outputFile:
+                outputFile.write(json.dumps([ scope, sorted(tokens), signature, value, ], separators = (',', ':'))+'\n')
+            self._lines += 1
+        except (OSError, TypeError, ValueError):
+            pass
+
+
+    def _compact(self):
+        tempName = None
+        try:
+            os.makedirs(self._fileName.parent, exist_ok = True)
+            fd, tempName = tempfile.mkstemp(dir = self._fileName.parent, prefix = '.%s-' % self._fileName.name)
+            with os.fdopen(fd, 'w') as outputFile:
+                for scope, tokens, signature, value in self._entries.values():
+                    outputFile.write(json.dumps([ scope, sorted(tokens), signature, value, ], separators = (',', ':'))+'\n')
+            os.replace(tempName, self._fileName)
+            self._lines = len(self._entries)
+        except (OSError, TypeError, ValueError):
+            if tempName:
+                try:
+                    os.remove(tempName)
+                except OSError:
+                    pass
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._frequencies.clear()
+            if self._fileName and self._fileName.exists():
+                self._compact()
+
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+
+    @property
+    def stats(self) -> CacheStats:
+        """
+        A `perplexipy.cache.CacheStats` snapshot of the cache counters.
+        """
+        with self._lock:
+            return CacheStats(self._hits, self._misses, len(self._entries), self._evictions)
@@ -0,0 +1,498 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.deadline import CallCancelled
+from perplexipy.deadline import DeadlineExceeded
+
+import threading
+
+
+# +++ classes +++
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _StreamSource:
+    """
+    @private
+    Upstream stream shared by the subscribers of a single-flight key.  Chunks
+    are kept until the last subscriber is gone, so that subscribers joining
+    late replay the stream from the start.  Whichever subscriber needs a chunk
+    not read yet reads it from upstream; the others wait for it.
+    """
+    def __init__(self, owner, key):
+        self._owner = owner
+        self._key = key
+        self._condition = threading.Condition()
+        self._opened = threading.Event()
+        self._stream = None
+        self._onDone = None
+        self._chunks = [ ]
+        self._reading = False
+        self._finished = False
+        self._error = None
+        self._usage = None
+        self._subscribers = 0
+
+
+    def _open(self, stream, onDone):
+        self._stream = stream
+        self._onDone = onDone
+        self._opened.set()
+
+
+    def _finish(self, error: Exception = None, close: bool = False):
+        # Called with the condition held.
+        if self._finished:
+            return
+        self._finished = True
+        self._error = error
+        self._condition.notify_all()
+        self._owner._forget(self._key, self)
+        if close:
+            closeStream = getattr(self._stream, 'close', None)
+            if closeStream:
+                closeStream()
+        onDone = self._onDone
+        if onDone:
+            self._onDone = None
+            onDone(self._usage, error)
+
+
+    def _fail(self, error: Exception):
+        with self._condition:
+            self._error = error
+            self._finish(error)
+        self._opened.set()
+
+
+    def _next(self, index: int):
+        with self._condition:
+            while True:
+                if index < len(self._chunks):
+                    return self._chunks[index]
+                if self._error is not None:
+                    raise self._error
+                if self._finished:
+                    raise StopIteration
+                if not self._reading:
+                    self._reading = True
+                    break
+                self._condition.wait()
+        try:
+            chunk = next(self._stream)
+        except StopIteration:
+            with self._condition:
+                self._reading = False
+                self._finish()
+            raise
+        except Exception as e:
+            with self._condition:
+                self._reading = False
+                self._finish(e)
+            raise
+        with self._condition:
+            self._reading = False
+            usage = getattr(chunk, 'usage', None)
+            if usage is not None:
+                self._usage = usage
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+        return chunk
+
+
+    def _unsubscribe(self):
+        # _subscribers is guarded by the owner's lock.  Release it before
+        # taking the condition:  _finish() takes the owner's lock with the
+        # condition held.
+        with self._owner._lock:
+            self._subscribers -= 1
+            abandoned = self._subscribers <= 0 and not self._finished
+            if abandoned and self._owner._streams.get(self._key) is self:
+                del self._owner._streams[self._key]
+        if abandoned:
+            # Nobody is left to read the rest; release the connection.
+            with self._condition:
+                self._finish(close = True)
+
+
+class _Subscription:
+    """
+    @private
+    Raw chunk iterator over a `_StreamSource`, wrapped by the client in a
+    `perplexipy.responses.Responses` object.
+    """
+    def __init__(self, source: _StreamSource):
+        self._source = source
+        self._index = 0
+        self._closed = False
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        chunk = self._source._next(self._index)
+        self._index += 1
+
+        return chunk
+
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._source._unsubscribe()
+
+
+class SingleFlight:
+    """
+    Thread-safe request coalescing.  Concurrent calls with the same key share
+    a single in-flight request:  the first caller runs it, and the others wait
+    for it and get the same result, or the same exception.  Nothing is kept
+    once the request completes; pair it with a response cache for that.
+
+    Pass an instance to `perplexipy.PerplexityClient` as the `singleFlight`
+    argument, or share it among clients using the same endpoint:
+
+    ```python
+    client = PerplexityClient(key = key, singleFlight = SingleFlight())
+    ```
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self._streams = dict()
+        self._requests = 0
+        self._coalesced = 0
+
+
+    def do(self, key, function, deadline = None):
+        """
+        Run `function()` unless a call with the same `key` is in flight, in
+        which case wait for that call instead.
+
+        Arguments
+        ---------
+            key
+        A hashable key, e.g. from `perplexipy.cache.cacheKey`.
+
+            function
+        A callable that makes the call.
+
+            deadline
+        An optional `perplexipy.deadline.Deadline` bounding the wait for a
+        call in flight.  If that call failed on its own caller's deadline or
+        cancellation, it's run again for this caller.
+
+        Returns
+        -------
+        The value returned by `function()`, shared by all the callers.
+
+        Raises
+        ------
+            Exception
+        Whatever `function()` raised, in every caller.
+        """
+        while True:
+            with self._lock:
+                self._requests += 1
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    self._coalesced += 1
+
+            if leader:
+                break
+            if deadline is None:
+                call.event.wait()
+            else:
+                deadline.wait(call.event)
+            if call.error is not None:
+                if isinstance(call.error, (CallCancelled, DeadlineExceeded)):
+                    continue
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+
+    def stream(self, key, open) -> _Subscription:
+        """
+        Subscribe to the stream for `key`, opening it with `open()` unless it's
+        already in flight.  Every subscriber iterates over all the chunks from
+        the start, no matter when it joined; the upstream stream is read once
+        and closed when the last subscriber closes.
+
+        Arguments
+        ---------
+            key
+        A hashable key, e.g. from `perplexipy.cache.cacheKey`.
+
+            open
+        A callable returning a tuple `(stream, onDone)`:  an iterator of raw
+        chunks, e.g. an `openai.Stream`, and an optional callable
+        `onDone(usage, error)` invoked once when the stream ends.
+
+        Returns
+        -------
+        An iterator of raw chunks with a `close()` method.
+        """
+        with self._lock:
+            self._requests += 1
+            source = self._streams.get(key)
+            leader = source is None
+            if leader:
+                source = self._streams[key] = _StreamSource(self, key)
+            else:
+                self._coalesced += 1
+            source._subscribers += 1
+
+        if leader:
+            try:
+                stream, onDone = open()
+            except BaseException as e:
+                source._fail(e)
+                raise
+            source._open(stream, onDone)
+        else:
+            source._opened.wait()
+            if source._stream is None:
+                raise source._error
+
+        return _Subscription(source)
+
+
+    def _forget(self, key, source):
+        with self._lock:
+            if self._streams.get(key) is source:
+                del self._streams[key]
+
+
+    @property
+    def requests(self) -> int:
+        """
+        Number of calls and stream subscriptions.
+        """
+        return self._requests
+
+
+    @property
+    def coalesced(self) -> int:
+        """
+        Number of calls and stream subscriptions served by a request already
+        in flight instead of a new one.
+        """
+        return self._coalesced
+
+
+class _AsyncStreamSource:
+    """
+    @private
+    Asynchronous counterpart of `_StreamSource`, for use within a single event
+    loop.
+    """
+    def __init__(self, owner, key):
+        import asyncio
+
+        self._owner = owner
+        self._key = key
+        self._condition = asyncio.Condition()
+        self._opened = asyncio.Event()
+        self._stream = None
+        self._onDone = None
+        self._chunks = [ ]
+        self._reading = False
+        self._finished = False
+        self._error = None
+        self._usage = None
+        self._subscribers = 0
+
+
+    async def _finish(self, error: Exception = None, close: bool = False):
+        # Called with the condition held.
+        if self._finished:
+            return
+        self._finished = True
+        self._error = error
+        self._condition.notify_all()
+        self._owner._forget(self._key, self)
+        if close:
+            closeStream = getattr(self._stream, 'close', None)
+            if closeStream:
+                await closeStream()
+        onDone = self._onDone
+        if onDone:
+            self._onDone = None
+            onDone(self._usage, error)
+
+
+    async def _next(self, index: int):
+        async with self._condition:
+            while True:
+                if index < len(self._chunks):
+                    return self._chunks[index]
+                if self._error is not None:
+                    raise self._error
+                if self._finished:
+                    raise StopAsyncIteration
+                if not self._reading:
+                    self._reading = True
+                    break
+                await self._condition.wait()
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            async with self._condition:
+                self._reading = False
+                await self._finish()
+            raise
+        except Exception as e:
+            async with self._condition:
+                self._reading = False
+                await self._finish(e)
+            raise
+        async with self._condition:
+            self._reading = False
+            usage = getattr(chunk, 'usage', None)
+            if usage is not None:
+                self._usage = usage
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+        return chunk
+
+
+    async def _unsubscribe(self):
+        async with self._condition:
+            self._subscribers -= 1
+            if self._subscribers <= 0 and not self._finished:
+                await self._finish(close = True)
+
+
+class _AsyncSubscription:
+    def __init__(self, source: _AsyncStreamSource):
+        self._source = source
+        self._index = 0
+        self._closed = False
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        chunk = await self._source._next(self._index)
+        self._index += 1
+
+        return chunk
+
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            await self._source._unsubscribe()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    Request coalescing for `asyncio` tasks, the counterpart of
+    `perplexipy.singleflight.SingleFlight` for
+    `perplexipy.AsyncPerplexityClient`.  An instance must only be used from
+    one event loop.
+    """
+    async def do(self, key, function):
+        """
+        Await `function()`, a coroutine function, unless a call with the same
+        `key` is in flight, in which case await that call instead.  Cancelling
+        a waiter doesn't cancel the shared call; if the shared call is
+        cancelled, or fails on its own caller's deadline, one of the waiters
+        runs it again.
+        """
+        import asyncio
+
+        while True:
+            self._requests += 1
+            future = self._calls.get(key)
+            if future is None:
+                break
+            self._coalesced += 1
+            # asyncio.wait() leaves the shared future alone if this waiter is
+            # cancelled.
+            await asyncio.wait((future,))
+            if future.cancelled() or isinstance(future.exception(), (CallCancelled, DeadlineExceeded)):
+                continue
+            return future.result()
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieve it so that the loop doesn't report an unhandled
+            # exception when nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+
+        return result
+
+
+    async def stream(self, key, open) -> _AsyncSubscription:
+        """
+        Coroutine version of `perplexipy.singleflight.SingleFlight.stream`;
+        `open` is a coroutine function and `stream` an async iterator.
+        """
+        self._requests += 1
+        source = self._streams.get(key)
+        leader = source is None
+        if leader:
+            source = self._streams[key] = _AsyncStreamSource(self, key)
+        else:
+            self._coalesced += 1
+        source._subscribers += 1
+
+        if leader:
+            try:
+                source._stream, source._onDone = await open()
+            except BaseException as e:
+                source._error = e
+                source._finished = True
+                self._forget(key, source)
+                source._opened.set()
+                raise
+            source._opened.set()
+        else:
+            await source._opened.wait()
+            if source._stream is None:
+                raise source._error
+
+        return _AsyncSubscription(source)
+
+
+    def _forget(self, key, source):
+        if self._streams.get(key) is source:
+            del self._streams[key]
@@ -0,0 +1,40 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+# +++ constants +++
+
+CHARACTERS_PER_TOKEN = 4
+"""
+Average number of characters per token for English text and source code in
+the tokenizers used by the Perplexity models.  Good enough for budgeting; not
+a substitute for the usage the service reports.
+"""
+
+
+# +++ functions +++
+
+def estimateTokens(text: str) -> int:
+    """
+    Estimate the number of tokens in `text` without a tokenizer.
+
+    Arguments
+    ---------
+        text
+    A string, or `None`.
+
+    Returns
+    -------
+    An integer estimate; 0 for empty text, at least 1 otherwise.
+    """
+    if not text:
+        return 0
+
+    return max(1, (len(text)+CHARACTERS_PER_TOKEN-1)//CHARACTERS_PER_TOKEN)
+
+
+def estimateMessagesTokens(messages: list) -> int:
+    """
+    Estimate the number of prompt tokens in a list of chat `messages`,
+    including a small per-message overhead for the role and separators.
+    """
+    return sum(estimateTokens(message['content'])+4 for message in messages)
@@ -0,0 +1,169 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from collections import namedtuple
+
+from perplexipy.errors import PerplexityClientError
+
+import importlib
+import importlib.util
+import threading
+
+
+# +++ constants +++
+
+PoolConfig = namedtuple('PoolConfig', [
+    'maxConnections',
+    'maxKeepaliveConnections',
+    'keepaliveExpiry',
+    'http2',
+], defaults = ( 100, 20, 30.0, False, ))
+"""
+Immutable HTTP connection pool settings.  A pool serves a single endpoint, so
+the limits are effectively per host.
+
+Attributes
+----------
+    maxConnections
+Maximum number of concurrent connections to the endpoint.
+
+    maxKeepaliveConnections
+Maximum number of idle connections kept alive for reuse.
+
+    keepaliveExpiry
+Seconds an idle connection is kept alive.
+
+    http2
+Enable HTTP/2, which multiplexes requests over fewer connections.  Requires
+the `h2` package (`pip install h2`).
+"""
+
+
+# +++ functions +++
+
+def _httpModule():
+    # The HTTP library the installed openai SDK is built on, httpx or a fork
+    # like httpx2; its Limits must come from the same package as its client.
+    from openai import DefaultHttpxClient
+
+    return importlib.import_module(DefaultHttpxClient.__mro__[1].__module__.split('.')[0])
+
+
+def hasFreeConnection(httpClient) -> bool:
+    """
+    Check whether `httpClient` could send a request now without waiting for a
+    connection, e.g. before sending an optional hedge request.
+
+    Arguments
+    ---------
+        httpClient
+    An `openai.DefaultHttpxClient`, e.g. from `ConnectionPools.httpClient()`.
+
+    Returns
+    -------
+    `True` if its pool has an idle connection or room for a new one, or if
+    the pool can't be inspected.
+    """
+    # The connection pool of httpx and its forks isn't part of their public
+    # API; anything unexpected counts as free.
+    pool = getattr(getattr(httpClient, '_transport', None), '_pool', None)
+    connections = getattr(pool, 'connections', None)
+    maxConnections = getattr(pool, '_max_connections', None)
+    if connections is None or maxConnections is None:
+        return True
+
+    return len(connections) < maxConnections or any(connection.is_idle() for connection in connections)
+
+
+def _makeHTTPClient(config: PoolConfig = None):
+    from openai import DefaultHttpxClient
+
+    if config is None:
+        # The openai SDK defaults; no httpx-specific objects required.
+        return DefaultHttpxClient()
+
+    limits = _httpModule().Limits(
+        max_connections = config.maxConnections,
+        max_keepalive_connections = config.maxKeepaliveConnections,
+        keepalive_expiry = config.keepaliveExpiry,
+    )
+
+    return DefaultHttpxClient(limits = limits, http2 = config.http2)
+
+
+# +++ classes +++
+
+class ConnectionPools:
+    """
+    Thread-safe registry of HTTP connection pools, one per endpoint.  Clients
+    that get their HTTP client from the same registry and endpoint share
+    connections, TLS sessions, and keep-alive state.
+
+    `perplexipy.PerplexityClient` instances use the process-wide
+    `perplexipy.transport.connectionPools` registry by default:
+
+    ```python
+    connectionPools.configure(PERPLEXITY_API_URL, PoolConfig(maxConnections = 200, http2 = True))
+    clients = [ PerplexityClient(key = key) for key in tenantKeys ] # one pool
+    ```
+    """
+    def __init__(self):
+        self._configs = dict()
+        self._pools = dict()
+        self._lock = threading.Lock()
+
+
+    def configure(self, endpoint: str, config: PoolConfig):
+        """
+        Set the pool configuration for `endpoint`.  Clients created afterwards
+        get a pool with the new settings; those created before keep theirs.
+
+        Raises
+        ------
+            PerplexityClientError
+        If `config.http2` is set and the `h2` package isn't installed.
+        """
+        if config.http2 and importlib.util.find_spec('h2') is None:
+            raise PerplexityClientError('HTTP/2 requires the h2 package:  pip install h2')
+        with self._lock:
+            self._configs[endpoint] = config
+            self._pools.pop(endpoint, None)
+
+
+    def httpClient(self, endpoint: str):
+        """
+        Return the shared HTTP client for `endpoint`, creating it on first use.
+
+        Returns
+        -------
+        An `openai.DefaultHttpxClient`, suitable for the `http_client` argument
+        of `openai.OpenAI`.
+        """
+        with self._lock:
+            client = self._pools.get(endpoint)
+            if client is None or client.is_closed:
+                client = _makeHTTPClient(self._configs.get(endpoint))
+                self._pools[endpoint] = client
+
+        return client
+
+
+    def close(self):
+        """
+        Close all the pools.  Clients holding a closed pool get a new one on
+        their next call to `httpClient()`.
+        """
+        with self._lock:
+            pools = tuple(self._pools.values())
+            self._pools.clear()
+        for client in pools:
+            client.close()
+
+
+# +++ globals +++
+
+connectionPools = ConnectionPools()
+"""
+Process-wide `ConnectionPools` registry used by `perplexipy.PerplexityClient`
+unless the client is given its own HTTP client.
+"""
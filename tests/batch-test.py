@@ -0,0 +1,145 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from click.testing import CliRunner
+
+from perplexipy import PerplexityClient
+from perplexipy.batch import BatchStats
+from perplexipy.batch import loadCheckpoint
+from perplexipy.batch import resumeOutput
+from perplexipy.batch import runBatch
+from perplexipy.mockserver import MockServer
+
+import io
+import json
+import os
+import tempfile
+
+import perplexipy.codex
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_INPUT = '"first prompt"\n{"id": "b", "prompt": "second prompt"}\n\n{"query": "third prompt", "tag": 3}\n{"prompt": "bogus prompt"}\n'
+TEST_KEY = 'pplx-batch'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def mockClient():
+    with MockServer() as server:
+        client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+        client.server = server
+        yield client
+
+
+@pytest.fixture
+def workArea():
+    with tempfile.TemporaryDirectory() as path:
+        yield path
+
+
+# +++ tests +++
+
+def test_runBatch(mockClient, workArea):
+    checkpointFileName = os.path.join(workArea, 'out.checkpoint')
+    outputFile = io.StringIO()
+    progress = [ ]
+    stats = runBatch(mockClient, io.StringIO(TEST_INPUT), outputFile, 2, checkpointFileName, progress = progress.append)
+    assert stats == BatchStats(4, 0, 0)
+    assert len(progress) == 4
+    records = { record['id']: record for record in map(json.loads, outputFile.getvalue().splitlines()) }
+    assert records[1]['response'] == 'first prompt'
+    assert records['b']['response'] == 'second prompt'
+    assert records[4] == { 'query': 'third prompt', 'tag': 3, 'id': 4, 'response': 'third prompt', 'error': None, }
+    assert loadCheckpoint(checkpointFileName) == { '1', 'b', '4', '5', }
+
+    # Resume:  nothing left to send.
+    requests = mockClient.server.requests
+    stats = runBatch(mockClient, io.StringIO(TEST_INPUT+'"fourth prompt"\n'), io.StringIO(), 2, checkpointFileName)
+    assert stats == BatchStats(1, 0, 4)
+    assert mockClient.server.requests == requests+1
+
+
+def test_runBatch_errors(mockClient):
+    mockClient.server.errorRate = 1.0
+    mockClient.server.errorStatus = 400
+    outputFile = io.StringIO()
+    stats = runBatch(mockClient, io.StringIO('"a"\n"b"\n'), outputFile, ordered = True)
+    assert stats == BatchStats(0, 2, 0)
+    records = [ json.loads(line) for line in outputFile.getvalue().splitlines() ]
+    assert [ record['id'] for record in records ] == [ 1, 2, ]
+    assert all(record['error'] and record['response'] is None for record in records)
+
+    with pytest.raises(ValueError):
+        runBatch(mockClient, io.StringIO('[ 1, 2 ]\n'), io.StringIO())
+    with pytest.raises(ValueError):
+        runBatch(mockClient, io.StringIO('{ "id": 1 }\n'), io.StringIO())
+
+
+def test_resumeOutput(workArea):
+    outputFileName = os.path.join(workArea, 'out.jsonl')
+    checkpointFileName = outputFileName+'.checkpoint'
+    with open(outputFileName, 'w') as outputFile:
+        outputFile.write('{"id": 1, "response": "a", "error": null}\n')
+        outputFile.write('{"id": 2, "response": null, "error": "RateLimitError: slow down"}\n')
+        outputFile.write('{"id": 1, "response": "a", "error": null}\n')
+        outputFile.write('{"id": "c", "response": "c", "error": null}\n')
+        outputFile.write('{"id": 4, "respon')
+    with open(checkpointFileName, 'w') as checkpointFile:
+        # 5 was checkpointed but its result is gone.
+        checkpointFile.write('1\n5\n')
+
+    assert resumeOutput(outputFileName, checkpointFileName) == { '1', 'c', }
+    with open(outputFileName) as outputFile:
+        assert [ json.loads(line)['id'] for line in outputFile ] == [ 1, 'c', ]
+    assert loadCheckpoint(checkpointFileName) == { '1', 'c', }
+
+    assert resumeOutput(os.path.join(workArea, 'missing.jsonl'), checkpointFileName) == set()
+    assert loadCheckpoint(checkpointFileName) == set()
+
+
+def test_codexBatchResume(workArea, monkeypatch):
+    inputFileName = os.path.join(workArea, 'in.jsonl')
+    outputFileName = os.path.join(workArea, 'out.jsonl')
+    with open(inputFileName, 'w') as inputFile:
+        inputFile.write(TEST_INPUT)
+
+    # Some requests fail, then the resumed run retries the failures.
+    with MockServer(errorRate = 0.5, errorStatus = 400, seed = 1) as server:
+        monkeypatch.setattr(perplexipy.codex, '_client', PerplexityClient(key = TEST_KEY, endpoint = server.url))
+        runner = CliRunner()
+        result = runner.invoke(perplexipy.codex.codex, [ 'batch', inputFileName, '-o', outputFileName, '-c', '1', ])
+        assert result.exit_code == 4
+        server.errorRate = 0.0
+        result = runner.invoke(perplexipy.codex.codex, [ 'batch', inputFileName, '-o', outputFileName, ])
+        assert not result.exit_code, result.output
+        assert 'skipped: 0' not in result.output
+    with open(outputFileName) as outputFile:
+        records = [ json.loads(line) for line in outputFile ]
+    assert sorted(str(record['id']) for record in records) == [ '1', '4', '5', 'b', ]
+    assert not [ record for record in records if record['error'] ]
+
+
+def test_codexBatch(mockClient, workArea, monkeypatch):
+    monkeypatch.setattr(perplexipy.codex, '_client', mockClient)
+    inputFileName = os.path.join(workArea, 'in.jsonl')
+    outputFileName = os.path.join(workArea, 'out.jsonl')
+    with open(inputFileName, 'w') as inputFile:
+        inputFile.write(TEST_INPUT)
+
+    runner = CliRunner()
+    result = runner.invoke(perplexipy.codex.codex, [ 'batch', inputFileName, '-o', outputFileName, '-c', '3', ])
+    assert not result.exit_code, result.output
+    assert os.path.exists(outputFileName+'.checkpoint')
+    result = runner.invoke(perplexipy.codex.codex, [ 'batch', inputFileName, '-o', outputFileName, ])
+    assert not result.exit_code
+    with open(outputFileName) as outputFile:
+        assert len(outputFile.readlines()) == 4
+
+    result = runner.invoke(perplexipy.codex.codex, [ 'batch', '--help', ])
+    assert 'Usage: codex batch' in result.output
+    assert not perplexipy.codex._isBatch([ 'batch', 'processing', 'in', 'bash', ])
@@ -0,0 +1,58 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from click.testing import CliRunner
+
+from perplexipy.benchmark import BenchmarkResult
+from perplexipy.benchmark import benchmark
+from perplexipy.benchmark import compareResults
+from perplexipy.benchmark import measure
+from perplexipy.benchmark import runBenchmarks
+
+import json
+import os
+import tempfile
+
+
+# +++ tests +++
+
+def test_measure():
+    calls = [ ]
+
+    def call():
+        calls.append(1)
+        if len(calls) % 5 == 0:
+            raise ValueError
+
+    result = measure('test', call, requests = 20, concurrency = 4)
+    assert isinstance(result, BenchmarkResult)
+    assert len(calls) == 20
+    assert result.errors == 4
+    assert result.throughput > 0.0
+    assert result.p50 <= result.p99
+
+
+def test_runBenchmarks():
+    report = runBenchmarks(requests = 10, concurrency = 2)
+    assert set(report['results']) == { 'query', 'queryBatch', 'queryStreamable', 'codex', }
+    for result in report['results'].values():
+        assert result['requests'] == 10
+        assert not result['errors']
+    assert json.loads(json.dumps(report)) == report
+
+    comparison = compareResults(report, report)
+    assert comparison['query']['p99'] == 1.0
+
+
+def test_benchmark():
+    with tempfile.TemporaryDirectory() as path:
+        fileName = os.path.join(path, 'results.json')
+        runner = CliRunner()
+        result = runner.invoke(benchmark, [ '-n', '5', '-o', fileName, 'query', ])
+        assert not result.exit_code, result.output
+        assert 'query' in result.output
+        result = runner.invoke(benchmark, [ '-n', '5', '--compare', fileName, 'query', ])
+        assert not result.exit_code, result.output
+        assert 'throughput x' in result.output
+        with open(fileName) as inputFile:
+            assert list(json.load(inputFile)['results']) == [ 'query', ]
@@ -0,0 +1,191 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from perplexipy.broadcast import BROADCAST_BLOCK
+from perplexipy.broadcast import BROADCAST_DROP
+from perplexipy.broadcast import BroadcastOverrun
+from perplexipy.broadcast import Broadcaster
+from perplexipy.errors import PerplexityClientError
+from perplexipy.responses import Responses
+
+import sys
+import threading
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_CHUNKS = [ 'chunk-%d ' % n for n in range(20) ]
+
+
+# +++ helpers +++
+
+def _chunk(content):
+    return SimpleNamespace(choices = [ SimpleNamespace(delta = SimpleNamespace(content = content), finish_reason = None) ], usage = None)
+
+
+class _FakeStream:
+    def __init__(self, contents, error = None):
+        self._chunks = iter([ _chunk(content) for content in contents ])
+        self._error = error
+        self.reads = 0
+        self.closed = False
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        self.reads += 1
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            if self._error:
+                raise self._error
+            raise
+
+
+    def close(self):
+        self.closed = True
+
+
+# +++ tests +++
+
+def test_Broadcaster_replay():
+    upstream = _FakeStream(TEST_CHUNKS)
+    responses = Responses(upstream)
+    broadcaster = Broadcaster(responses, bufferSize = 32)
+    first = broadcaster.subscribe()
+    assert [ next(first) for _ in range(5) ] == TEST_CHUNKS[:5]
+    late = broadcaster.subscribe()
+    assert late.skipped == 0
+    assert late.text() == ''.join(TEST_CHUNKS)
+    assert first.text() == ''.join(TEST_CHUNKS[5:])
+    # Read once, and not accumulated by the upstream object.
+    assert upstream.reads == len(TEST_CHUNKS)+1
+    assert responses._chunks == [ ]
+    assert broadcaster.finished
+    assert broadcaster.chunks == len(TEST_CHUNKS)
+
+
+def test_Broadcaster_lateSubscriber():
+    broadcaster = Broadcaster(iter(TEST_CHUNKS), bufferSize = 4, policy = BROADCAST_DROP)
+    first = broadcaster.subscribe()
+    assert [ next(first) for _ in range(10) ] == TEST_CHUNKS[:10]
+    late = broadcaster.subscribe()
+    assert late.skipped == 6
+    assert list(late) == TEST_CHUNKS[6:]
+
+
+def test_Broadcaster_drop():
+    broadcaster = Broadcaster(iter(TEST_CHUNKS), bufferSize = 4, policy = BROADCAST_DROP)
+    fast = broadcaster.subscribe()
+    slow = broadcaster.subscribe()
+    assert next(slow) == TEST_CHUNKS[0]
+    assert list(fast) == TEST_CHUNKS
+    with pytest.raises(BroadcastOverrun):
+        next(slow)
+    assert slow.dropped
+    assert broadcaster.dropped == 1
+    assert broadcaster.subscribers == 1
+
+
+def test_Broadcaster_block():
+    broadcaster = Broadcaster(iter(TEST_CHUNKS), bufferSize = 4, policy = BROADCAST_BLOCK)
+    fast = broadcaster.subscribe()
+    slow = broadcaster.subscribe()
+    readAhead = threading.Event()
+    result = [ ]
+
+    def readFast():
+        for chunk in fast:
+            result.append(chunk)
+            if len(result) == 4:
+                readAhead.set()
+
+    thread = threading.Thread(target = readFast)
+    thread.start()
+    assert readAhead.wait(2.0)
+    thread.join(0.2)
+    # Backpressure:  the fast subscriber waits for the slow one.
+    assert thread.is_alive()
+    assert broadcaster.chunks == 4
+    assert list(slow) == TEST_CHUNKS
+    thread.join(2.0)
+    assert result == TEST_CHUNKS
+    assert not slow.dropped
+
+
+def test_Broadcaster_blockTimeout():
+    broadcaster = Broadcaster(iter(TEST_CHUNKS), bufferSize = 4, timeout = 0.05)
+    fast = broadcaster.subscribe()
+    slow = broadcaster.subscribe()
+    assert list(fast) == TEST_CHUNKS
+    with pytest.raises(BroadcastOverrun):
+        next(slow)
+    assert broadcaster.dropped == 1
+
+
+def test_Broadcaster_close():
+    broadcaster = Broadcaster(iter(TEST_CHUNKS), bufferSize = 4, policy = BROADCAST_BLOCK)
+    fast = broadcaster.subscribe()
+    slow = broadcaster.subscribe()
+    slow.close()
+    # A closed subscription doesn't hold back the others.
+    assert list(fast) == TEST_CHUNKS
+    assert broadcaster.subscribers == 1
+
+    upstream = _FakeStream(TEST_CHUNKS)
+    with Broadcaster(Responses(upstream)) as broadcaster:
+        subscription = broadcaster.subscribe()
+        next(subscription)
+    assert upstream.closed
+    assert list(subscription) == [ ]
+
+
+def test_Broadcaster_error():
+    broadcaster = Broadcaster(Responses(_FakeStream(TEST_CHUNKS[:3], error = RuntimeError('connection reset'))))
+    first = broadcaster.subscribe()
+    second = broadcaster.subscribe()
+    with pytest.raises(RuntimeError):
+        list(first)
+    # The buffered chunks first, then the upstream error.
+    assert [ next(second) for _ in range(3) ] == TEST_CHUNKS[:3]
+    with pytest.raises(RuntimeError):
+        next(second)
+
+    with pytest.raises(PerplexityClientError):
+        Broadcaster(iter(TEST_CHUNKS), bufferSize = 0)
+    with pytest.raises(PerplexityClientError):
+        Broadcaster(iter(TEST_CHUNKS), policy = 'bogus')
+
+
+def test_Broadcaster_concurrent():
+    broadcaster = Broadcaster(iter(TEST_CHUNKS*50), bufferSize = 8)
+    subscriptions = [ broadcaster.subscribe() for _ in range(8) ]
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        texts = list(executor.map(lambda subscription: subscription.text(), subscriptions))
+    assert texts == [ ''.join(TEST_CHUNKS*50), ]*8
+    assert broadcaster.chunks == len(TEST_CHUNKS)*50
+
+
+def test_Broadcaster_blockStress():
+    # Frequent thread switches between reading a chunk and advancing the
+    # position used to deadlock the reader and all the subscribers.
+    switchInterval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for _ in range(20):
+            broadcaster = Broadcaster(iter(TEST_CHUNKS*20), bufferSize = 1, policy = BROADCAST_BLOCK)
+            subscriptions = [ broadcaster.subscribe() for _ in range(3) ]
+            with ThreadPoolExecutor(max_workers = 3) as executor:
+                futures = [ executor.submit(subscription.text) for subscription in subscriptions ]
+                texts = [ future.result(timeout = 10.0) for future in futures ]
+            assert texts == [ ''.join(TEST_CHUNKS*20), ]*3
+    finally:
+        sys.setswitchinterval(switchInterval)
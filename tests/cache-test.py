@@ -0,0 +1,90 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.cache import CacheStats
+from perplexipy.cache import DiskCache
+from perplexipy.cache import MemoryCache
+from perplexipy.cache import TieredCache
+from perplexipy.cache import cacheKey
+
+import os
+import tempfile
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_MESSAGES = [ { 'role': 'user', 'content': 'What is the meaning of 42?', }, ]
+TEST_VALUE = [ 'The answer to everything', ]
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def cacheFileName():
+    with tempfile.TemporaryDirectory() as path:
+        yield os.path.join(path, 'cache', 'test-cache.sqlite')
+
+
+# +++ tests +++
+
+def test_cacheKey():
+    key = cacheKey('https://api.perplexity.ai', 'sonar', 'user', TEST_MESSAGES)
+    assert key == cacheKey('https://api.perplexity.ai', 'sonar', 'user', TEST_MESSAGES, { })
+    assert key != cacheKey('https://api.perplexity.ai', 'sonar-pro', 'user', TEST_MESSAGES)
+    assert key != cacheKey('https://api.perplexity.ai', 'sonar', 'user', TEST_MESSAGES, { 'temperature': 0.2, })
+    assert cacheKey('e', 'm', 'r', [ ], { 'a': 1, 'b': 2, }) == cacheKey('e', 'm', 'r', [ ], { 'b': 2, 'a': 1, })
+
+
+def test_MemoryCache():
+    cache = MemoryCache(maxEntries = 2)
+    assert cache.get('a') is None
+    cache.set('a', TEST_VALUE)
+    cache.set('b', TEST_VALUE)
+    assert cache.get('a') == TEST_VALUE
+    cache.set('c', TEST_VALUE)
+    assert cache.get('b') is None # least recently used
+    assert cache.get('c') == TEST_VALUE
+    assert cache.stats == CacheStats(hits = 2, misses = 2, entries = 2, evictions = 1)
+
+    cache = MemoryCache(ttl = 0.01)
+    cache.set('a', TEST_VALUE)
+    assert cache.get('a') == TEST_VALUE
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.stats.evictions == 1
+
+
+def test_DiskCache(cacheFileName):
+    cache = DiskCache(cacheFileName)
+    assert os.path.exists(cacheFileName)
+    assert cache.get('a') is None
+    cache.set('a', TEST_VALUE)
+    cache.close()
+
+    cache = DiskCache(cacheFileName, ttl = 0.01)
+    assert cache.get('a') == TEST_VALUE
+    cache.set('b', TEST_VALUE)
+    time.sleep(0.02)
+    assert cache.get('b') is None
+    assert cache.stats == CacheStats(hits = 1, misses = 1, entries = 1, evictions = 1)
+    cache.clear()
+    assert not cache.stats.entries
+    cache.close()
+
+
+def test_TieredCache(cacheFileName):
+    memory = MemoryCache()
+    disk = DiskCache(cacheFileName)
+    disk.set('a', TEST_VALUE)
+    cache = TieredCache(memory, disk)
+    assert cache.get('a') == TEST_VALUE
+    assert memory.get('a') == TEST_VALUE
+    assert cache.get('b') is None
+    cache.set('b', TEST_VALUE)
+    assert disk.get('b') == TEST_VALUE
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    disk.close()
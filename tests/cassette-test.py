@@ -0,0 +1,144 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy import PerplexityClient
+from perplexipy.cassette import CASSETTE_AUTO
+from perplexipy.cassette import CASSETTE_RECORD
+from perplexipy.cassette import CASSETTE_REPLAY
+from perplexipy.cassette import Cassette
+from perplexipy.cassette import CassetteServer
+from perplexipy.cassette import cassetteFromEnvironment
+from perplexipy.cassette import requestKey
+from perplexipy.errors import PerplexityClientError
+from perplexipy.mockserver import MockServer
+
+import os
+import time
+
+import openai
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-cassette'
+TEST_QUERY = 'Brief answer to the ultimate question about life, the Universe, and everything?'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def cassettePath(tmp_path):
+    return str(tmp_path / 'cassettes' / 'session.jsonl.gz')
+
+
+@pytest.fixture
+def recorded(cassettePath):
+    # A cassette with a query and a stream recorded from a mock service.
+    with MockServer(tokenRate = 40.0) as upstream:
+        with CassetteServer(Cassette(cassettePath), CASSETTE_RECORD, upstream = upstream.url) as server:
+            client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+            assert client.query(TEST_QUERY) == TEST_QUERY
+            assert ''.join(client.queryStreamable(TEST_QUERY)) == TEST_QUERY
+            assert server.recorded == 2
+        assert upstream.requests == 2
+
+    return cassettePath
+
+
+def _client(server: CassetteServer) -> PerplexityClient:
+    client = PerplexityClient(key = 'pplx-other-key', endpoint = server.url)
+    client._client = client._client.with_options(max_retries = 0)
+
+    return client
+
+
+# +++ tests +++
+
+def test_requestKey():
+    assert requestKey('/chat/completions', b'{"a": 1, "b": 2}') == requestKey('/chat/completions/', b'{"b":2,"a":1}')
+    assert requestKey('/chat/completions', b'{"a": 1}') != requestKey('/chat/completions', b'{"a": 2}')
+    assert requestKey('/chat/completions', b'not JSON')
+
+
+def test_CassetteServer_replay(recorded):
+    cassette = Cassette(recorded)
+    assert len(cassette) == 2
+    with open(recorded, 'rb') as cassetteFile:
+        assert cassetteFile.read(2) == b'\x1f\x8b'
+        assert b'pplx-' not in cassetteFile.read()
+
+    with CassetteServer(cassette, speed = None) as server:
+        client = _client(server)
+        assert client.query(TEST_QUERY) == TEST_QUERY
+        with client.queryStreamable(TEST_QUERY) as responses:
+            assert len(responses.collect()) == len(TEST_QUERY.split())
+        assert responses.text() == TEST_QUERY
+        assert responses.usage.completion_tokens == len(TEST_QUERY.split())
+        assert responses.citations
+        # Repeated requests replay the last recording.
+        assert client.queryResult(TEST_QUERY).text == TEST_QUERY
+        assert client.query(TEST_QUERY) == TEST_QUERY
+
+        with pytest.raises(openai.NotFoundError):
+            client.query('Never recorded')
+        assert server.misses == 1
+        assert server.recorded == 0
+
+
+def test_CassetteServer_speed(recorded):
+    # 14 tokens at 40 tokens/s take about 0.3 s to record.
+    durations = { }
+    for speed in (1.0, None):
+        with CassetteServer(Cassette(recorded), speed = speed) as server:
+            started = time.monotonic()
+            assert ''.join(_client(server).queryStreamable(TEST_QUERY)) == TEST_QUERY
+            durations[speed] = time.monotonic()-started
+    assert durations[1.0] > 0.25
+    assert durations[None] < durations[1.0]/2
+
+
+def test_CassetteServer_auto(cassettePath):
+    with MockServer() as upstream:
+        with CassetteServer(Cassette(cassettePath), CASSETTE_AUTO, upstream = upstream.url) as server:
+            client = _client(server)
+            for _ in range(3):
+                assert client.query(TEST_QUERY) == TEST_QUERY
+            assert client.query('Another question') == 'Another question'
+            assert (server.recorded, server.replayed) == (2, 2)
+        assert upstream.requests == 2
+
+
+def test_CassetteServer_errors(cassettePath):
+    with MockServer(errorRate = 1.0, errorStatus = 429, retryAfter = 0.01) as upstream:
+        with CassetteServer(Cassette(cassettePath), CASSETTE_RECORD, upstream = upstream.url) as server:
+            with pytest.raises(openai.RateLimitError):
+                _client(server).query(TEST_QUERY)
+    # Service errors replay too, with their Retry-After header.
+    with CassetteServer(Cassette(cassettePath), CASSETTE_REPLAY) as server:
+        with pytest.raises(openai.RateLimitError) as error:
+            _client(server).query(TEST_QUERY)
+        assert error.value.response.headers['Retry-After'] == '0.01'
+
+    with pytest.raises(PerplexityClientError):
+        CassetteServer(Cassette(cassettePath), 'rewind')
+
+
+def test_cassetteFromEnvironment(recorded, monkeypatch):
+    monkeypatch.delenv('PERPLEXITY_CASSETTE', raising = False)
+    assert cassetteFromEnvironment() is None
+
+    monkeypatch.setenv('PERPLEXITY_CASSETTE', recorded)
+    monkeypatch.setenv('PERPLEXITY_CASSETTE_SPEED', '0')
+    server = cassetteFromEnvironment()
+    try:
+        assert server.mode == CASSETTE_REPLAY
+        assert server.speed is None
+        assert _client(server).query(TEST_QUERY) == TEST_QUERY
+    finally:
+        server.stop()
+
+    monkeypatch.setenv('PERPLEXITY_CASSETTE_SPEED', 'fast')
+    with pytest.raises(PerplexityClientError):
+        cassetteFromEnvironment()
+    assert os.path.exists(recorded)
@@ -4,19 +4,43 @@
 from unittest.mock import patch
 
 from click.testing import CliRunner
+from types import SimpleNamespace
+
+from perplexipy import PerplexityClient
+from perplexipy.cassette import CASSETTE_RECORD
+from perplexipy.cassette import Cassette
+from perplexipy.cassette import CassetteServer
 # from perplexipy.codex import CodexREPL
 from perplexipy.codex import DEFAULT_MODEL_NAME
 from perplexipy.codex import _die # noqa: F401
 from perplexipy.codex import codex
+from perplexipy.codex import QUERY_CRISP
+from perplexipy.codex import QUERY_DETAILED
 from perplexipy.codex import codexCore
+from perplexipy.mockserver import MockServer
+from perplexipy.proxy import PROXY_CLIENT_CONCURRENCY
+from perplexipy.proxy import PROXY_DEFAULT_PORT
+from perplexipy.proxy import PROXY_HOST
+from perplexipy.responses import Responses
 from prompt_toolkit import PromptSession
 from prompt_toolkit.enums import EditingMode
 
+import compileall
 import os
+import perplexipy.codex
+import perplexipy.mapreduce
 import pytest
+import subprocess
+import sys
 import tempfile
 
 
+# Import time budget for perplexipy.codex, in microseconds; the best of a few
+# runs is checked against it.  Slow CI hosts may raise it:
+# CODEX_IMPORT_BUDGET=150000 pytest tests/codex-test.py
+CODEX_IMPORT_BUDGET = int(os.environ.get('CODEX_IMPORT_BUDGET', '100000'))
+CODEX_LAZY_MODULES = ( 'http', 'openai', 'prompt_toolkit', 'yaml', )
+CODEX_LAZY_SUBMODULES = ( 'perplexipy.hedging', 'perplexipy.mapreduce', 'perplexipy.metrics', 'perplexipy.proxy', 'perplexipy.ratelimit', 'perplexipy.singleflight', 'perplexipy.transport', )
 TEST_QUERY = 'How do I declare a variable in Dart?'
 TEST_CONFIG_PATH = tempfile.TemporaryDirectory().name
 TEST_CONFIG_FILE_NAME = os.path.join(TEST_CONFIG_PATH, 'codex-repl.yaml')
@@ -27,6 +51,30 @@ TEST_CONFIG_FILE_NAME = os.path.join(TEST_CONFIG_PATH, 'codex-repl.yaml')
 _codex = None # test_CodexREPL() initializes it
 
 
+# *** helpers ***
+
+def _importTimes(*arguments) -> dict:
+    """
+    Run a fresh interpreter with `-X importtime` and the given `arguments`, and
+    report the cumulative import time of each module in microseconds.
+    """
+    environment = dict(os.environ, PERPLEXITY_API_KEY = 'pplx-startup-benchmark')
+    process = subprocess.run([ sys.executable, '-X', 'importtime', *arguments, ], capture_output = True, text = True, env = environment)
+    times = dict()
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative, module = line.split('|')
+            times[module.strip()] = int(cumulative)
+
+    return times
+
+
+def _importReport(times: dict, top: int = 10) -> str:
+    slowest = sorted(times.items(), key = lambda item: item[1], reverse = True)[:top]
+
+    return '\n'.join('%10d us  %s' % (cumulative, module) for module, cumulative in slowest)
+
+
 # *** fixtures ***
 
 @pytest.fixture
@@ -44,6 +92,14 @@ def stdoutHide(monkeypatch):
     monkeypatch.setattr('sys.stdout', open('/dev/null', 'w'))
 
 
+@pytest.fixture
+def mockClient(monkeypatch):
+    with MockServer() as server:
+        client = PerplexityClient(key = 'pplx-codex-test', endpoint = server.url)
+        monkeypatch.setattr(perplexipy.codex, '_client', client)
+        yield client
+
+
 @pytest.fixture
 def codexInstance():
     if not _codex:
@@ -68,6 +124,24 @@ def test_dieExitCodeDefault():
         mockExit.assert_called_once_with(99)
 
 
+def test_codexColdStart():
+    # Installed packages have their bytecode compiled; time that, not the
+    # compiler.
+    compileall.compile_dir(os.path.dirname(perplexipy.codex.__file__), quiet = 1)
+    runs = [ _importTimes('-c', 'import perplexipy.codex') for _ in range(3) ]
+    times = min(runs, key = lambda times: times['perplexipy.codex'])
+    print('\ncodex import times:\n%s' % _importReport(times), file = sys.__stdout__)
+    assert not [ module for module in times if module.split('.')[0] in CODEX_LAZY_MODULES ]
+    assert not [ module for module in times if module in CODEX_LAZY_SUBMODULES ]
+    assert times['perplexipy.codex'] < CODEX_IMPORT_BUDGET
+
+
+def test_codexVersionColdStart():
+    times = _importTimes('-m', 'perplexipy.codex', '--version')
+    assert times
+    assert not [ module for module in times if module.split('.')[0] in CODEX_LAZY_MODULES ]
+
+
 # def test_CodexREPL():
 #     global _codex
 #
@@ -96,6 +170,155 @@ def test_codex(stdinMock):
     result = runner.invoke(codex, [ ])
 
 
+def test_codexStream(mockClient):
+    runner = CliRunner()
+    result = runner.invoke(codex, [ TEST_QUERY, ])
+    assert not result.exit_code
+    assert result.output == QUERY_CRISP+TEST_QUERY+'\n'
+    result = runner.invoke(codex, [ '--no-stream', TEST_QUERY, ])
+    assert not result.exit_code
+    assert result.output == QUERY_CRISP+TEST_QUERY+'\n'
+
+
+def test_codexStreamCancel(mockClient, monkeypatch):
+    class InterruptedStream:
+        def __init__(self):
+            self.chunks = iter([ SimpleNamespace(choices = [ SimpleNamespace(delta = SimpleNamespace(content = 'partial'), finish_reason = None) ]), ])
+            self.closed = False
+
+        def __next__(self):
+            for chunk in self.chunks:
+                return chunk
+            raise KeyboardInterrupt
+
+        def close(self):
+            self.closed = True
+
+    stream = InterruptedStream()
+    monkeypatch.setattr(mockClient, 'queryStreamable', lambda query: Responses(stream))
+    text, cancelled = perplexipy.codex._streamQuery(TEST_QUERY)
+    assert cancelled
+    assert text == 'partial'
+    assert stream.closed
+
+    monkeypatch.setattr(mockClient, 'queryStreamable', lambda query: Responses(InterruptedStream()))
+    result = CliRunner().invoke(codex, [ TEST_QUERY, ])
+    assert result.exit_code == 130
+    assert result.output.startswith('partial')
+
+    # Cancelled while the stream is still opening.
+    def interrupted(query):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(mockClient, 'queryStreamable', interrupted)
+    assert perplexipy.codex._streamQuery(TEST_QUERY) == ( '', True, )
+    result = CliRunner().invoke(codex, [ TEST_QUERY, ])
+    assert result.exit_code == 130
+    assert 'Cancelled' in result.output
+
+
+def test_codexFile(mockClient, monkeypatch):
+    with tempfile.TemporaryDirectory() as path:
+        fileName = os.path.join(path, 'input.txt')
+        with open(fileName, 'w') as outputFile:
+            outputFile.write('int x = 42;\n')
+        result = CliRunner().invoke(codex, [ '--no-stream', '-f', fileName, 'Explain', ])
+        assert not result.exit_code
+        assert result.output == QUERY_DETAILED+'Explain\n\nint x = 42;\n\n'
+
+        # Inputs over the context budget are chunked and map-reduced.
+        with open(fileName, 'w') as outputFile:
+            outputFile.writelines('line %d\n' % n for n in range(500))
+        # A small budget for codex's chunking, the real one for the reduce.
+        budgets = iter([ 1000, ])
+        monkeypatch.setattr(perplexipy.mapreduce, 'inputBudget', lambda client, instruction: next(budgets, 100000))
+        result = CliRunner().invoke(codex, [ '-f', fileName, 'Explain', ])
+        assert not result.exit_code
+        assert 'about 5 chunks' in result.output
+        assert result.output.rstrip().endswith('line 499')
+
+        result = CliRunner().invoke(codex, [ '-f', os.path.join(path, 'bogus.txt'), 'Explain', ])
+        assert result.exit_code == 2
+
+
+def test_codexStdin(mockClient, monkeypatch):
+    monkeypatch.setattr(perplexipy.codex, '_stdinHasData', lambda: True)
+    result = CliRunner().invoke(codex, [ '--no-stream', ], input = 'How do I\nreverse a string?\n')
+    assert not result.exit_code
+    assert result.output == QUERY_DETAILED+'How do I\nreverse a string?\n\n'
+
+    readInput = perplexipy.mapreduce.readInput
+    monkeypatch.setattr(perplexipy.mapreduce, 'readInput', lambda stream: readInput(stream, maxSize = 10))
+    result = CliRunner().invoke(codex, [ ], input = 'How do I\nreverse a string?\n')
+    assert result.exit_code == 3
+
+
+def test_codexCompact(mockClient, monkeypatch, tmp_path):
+    monkeypatch.setattr(perplexipy.codex, '_stdinHasData', lambda: True)
+    log = '\x1b[31mWhy does this fail?\x1b[0m   \n'+'retrying connection\n'*100
+    result = CliRunner().invoke(codex, [ '--no-stream', '--compact', ], input = log)
+    assert not result.exit_code
+    assert QUERY_DETAILED+'Why does this fail?\nretrying connection\n[previous line repeated 99 more times]\n' in result.output
+    assert 'Compacted input: 101 -> 3 lines' in result.output
+
+    fileName = str(tmp_path / 'input.md')
+    with open(fileName, 'w') as inputFile:
+        inputFile.write('```\nx = 1\nx = 1\n```\nok\nok\n')
+    result = CliRunner().invoke(codex, [ '--no-stream', '--compact-level', '3', '-f', fileName, 'Explain', ])
+    assert not result.exit_code
+    assert 'Explain\n\n```\nx = 1\nx = 1\n```\nok\n[previous line repeated 1 more times, numbers may differ]\n' in result.output
+    result = CliRunner().invoke(codex, [ '--no-stream', '--compact-code', '-f', fileName, 'Explain', ])
+    assert 'x = 1\n[previous line repeated 1 more times]\n' in result.output
+
+
+def test_codexServe(monkeypatch):
+    servers = [ ]
+
+    def serve(server):
+        servers.append(server)
+        server.stop()
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr('perplexipy.proxy.ProxyServer.serve', serve)
+    result = CliRunner().invoke(codex, [ 'serve', '--port', '0', '--cache', 'none', '-c', '4', ])
+    assert not result.exit_code
+    assert 'listening on http://127.0.0.1:' in result.output
+    server, = servers
+    assert server.client.cache is None
+    assert server._clientConcurrency == 4
+    assert perplexipy.codex._isServe([ 'serve', ])
+    assert not perplexipy.codex._isServe([ 'serve', 'static', 'files', ])
+
+    # The help shows the perplexipy.proxy defaults.
+    result = CliRunner().invoke(perplexipy.codex.codexServe, [ '--help', ])
+    for default in (PROXY_HOST, PROXY_DEFAULT_PORT, PROXY_CLIENT_CONCURRENCY):
+        assert '[default: %s]' % default in result.output
+
+
+def test_codexCassette(monkeypatch, tmp_path):
+    cassettePath = str(tmp_path / 'codex.jsonl')
+    with MockServer() as upstream, CassetteServer(Cassette(cassettePath), CASSETTE_RECORD, upstream = upstream.url) as server:
+        client = PerplexityClient(key = 'pplx-codex-test', endpoint = server.url)
+        client.model = DEFAULT_MODEL_NAME
+        client.query(QUERY_CRISP+TEST_QUERY)
+        ''.join(client.queryStreamable(QUERY_CRISP+TEST_QUERY))
+
+    # Replayed offline, without a real API key.
+    monkeypatch.setenv('PERPLEXITY_API_KEY', 'pplx-codex-replay')
+    monkeypatch.setenv('PERPLEXITY_CASSETTE', cassettePath)
+    monkeypatch.setenv('PERPLEXITY_CASSETTE_SPEED', '0')
+    monkeypatch.setattr(perplexipy.codex, '_client', None)
+    monkeypatch.setattr(perplexipy.codex, '_cassetteServer', None)
+    try:
+        for arguments in ([ TEST_QUERY, ], [ '--no-stream', TEST_QUERY, ]):
+            result = CliRunner().invoke(codex, arguments)
+            assert not result.exit_code
+            assert result.output == QUERY_CRISP+TEST_QUERY+'\n'
+        assert perplexipy.codex._cassetteServer.replayed == 2
+    finally:
+        perplexipy.codex._cassetteServer.stop()
+
+
 # def test_CodexRepl__loadConfigFrom(codexInstance, configFileName, configPath):
 #     print(configPath)
 #     bogusPath = tempfile.TemporaryDirectory().name
@@ -171,5 +394,3 @@ def test_codex(stdinMock):
 # test_CodexREPL_editingMode(_codex)
 # test_CodexREPL_queryStyle(_codex)
 # test_CodexREPL_makeQuery(_codex)
-
-
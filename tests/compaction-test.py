@@ -0,0 +1,69 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.compaction import COMPACTION_AGGRESSIVE
+from perplexipy.compaction import COMPACTION_LIGHT
+from perplexipy.compaction import COMPACTION_NORMAL
+from perplexipy.compaction import Compactor
+from perplexipy.compaction import compactText
+from perplexipy.errors import PerplexityClientError
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_BLOB = 'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk'*8
+TEST_CODE = '```python\nprint(1)   \nprint(1)   \n\n\n\n```\n'
+TEST_LOG = '\x1b[1;31mERROR\x1b[0m disk full   \n'*50+'\n\n\n\n'+'payload=%s\n' % TEST_BLOB+'downloading 10%\rdownloading 100%\n'
+
+
+# +++ tests +++
+
+def test_Compactor_light():
+    text, stats = compactText(TEST_LOG, COMPACTION_LIGHT)
+    assert text.startswith('ERROR disk full\n[previous line repeated 49 more times]\n\n\n\n\n')
+    assert TEST_BLOB in text
+    assert stats.linesIn == 56
+    assert stats.bytesOut < stats.bytesIn
+    assert stats.tokensOut < stats.tokensIn
+
+
+def test_Compactor_normal():
+    text, stats = compactText(TEST_LOG)
+    assert text == 'ERROR disk full\n[previous line repeated 49 more times]\n\npayload=[blob: %d characters elided]\ndownloading 100%%\n' % len(TEST_BLOB)
+    assert stats.bytesOut == len(text.encode('utf-8'))
+    assert stats.linesOut == 5
+
+
+def test_Compactor_aggressive():
+    log = ''.join('2024-05-01 10:00:%02d worker %d heartbeat\n' % (n, n%3) for n in range(60))+'done\n'
+    text, _ = compactText(log, COMPACTION_AGGRESSIVE)
+    assert text == '2024-05-01 10:00:00 worker 0 heartbeat\n[previous line repeated 59 more times, numbers may differ]\ndone\n'
+    assert compactText(log, COMPACTION_NORMAL)[0] == log
+
+    with pytest.raises(PerplexityClientError):
+        Compactor(4)
+
+
+def test_Compactor_fencedCode():
+    text, _ = compactText('x   \n'+TEST_CODE+'y   \n', COMPACTION_AGGRESSIVE)
+    assert text == 'x\n'+TEST_CODE+'y\n'
+    # An unclosed fence protects the rest of the input.
+    assert compactText('~~~\na   \na   \n')[0] == '~~~\na   \na   \n'
+    assert compactText(TEST_CODE, compactCode = True)[0] == '```python\nprint(1)\n[previous line repeated 1 more times]\n\n```\n'
+
+
+def test_Compactor_streaming():
+    compactor = Compactor()
+
+    def lines():
+        for n in range(100000):
+            yield 'same line\n'
+        yield 'last line\n'
+
+    output = compactor.compact(lines())
+    assert next(output) == 'same line\n'
+    assert list(output) == [ '[previous line repeated 99999 more times]\n', 'last line\n', ]
+    assert compactor.stats.linesIn == 100001
+    assert compactor.stats.tokensOut < 30
@@ -0,0 +1,91 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.config import ConfigFile
+
+import os
+import tempfile
+import time
+
+import pytest
+import yaml
+
+
+# +++ constants +++
+
+TEST_DEFAULTS = { 'activeModel': 'sonar', 'editingMode': 'vi', }
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def configFileName():
+    with tempfile.TemporaryDirectory() as path:
+        yield os.path.join(path, 'config', 'codex-repl.yaml')
+
+
+# +++ helpers +++
+
+def _read(fileName: str) -> dict:
+    with open(fileName, 'r') as inputFile:
+        return yaml.safe_load(inputFile)
+
+
+# +++ tests +++
+
+def test_ConfigFile(configFileName):
+    config = ConfigFile(configFileName, defaults = TEST_DEFAULTS, writeDelay = 0.05)
+    assert _read(configFileName) == TEST_DEFAULTS
+    assert config.writes == 1
+    assert config['editingMode'] == 'vi'
+    assert config.get('workArea') is None
+    assert 'activeModel' in config
+
+    # Debounced:  several changes, one write.
+    config['editingMode'] = 'emacs'
+    config['workArea'] = '/tmp'
+    config['editingMode'] = 'vi'
+    config['editingMode'] = 'emacs'
+    assert config.pending
+    assert _read(configFileName) == TEST_DEFAULTS
+    time.sleep(0.3)
+    assert not config.pending
+    assert config.writes == 2
+    assert _read(configFileName) == dict(TEST_DEFAULTS, editingMode = 'emacs', workArea = '/tmp')
+
+    # Unchanged values aren't written.
+    config['editingMode'] = 'emacs'
+    assert not config.pending
+
+    del config['workArea']
+    config.flush()
+    assert 'workArea' not in _read(configFileName)
+    assert config.writes == 3
+    assert not [ name for name in os.listdir(os.path.dirname(configFileName)) if name.startswith('.') ]
+
+    config = ConfigFile(configFileName, defaults = TEST_DEFAULTS)
+    assert config['editingMode'] == 'emacs'
+    assert config.writes == 0
+
+
+def test_ConfigFile_externalChanges(configFileName):
+    # Two REPLs sharing the file don't clobber each other's changes.
+    first = ConfigFile(configFileName, defaults = TEST_DEFAULTS, writeDelay = 0.0, checkInterval = 0.0)
+    second = ConfigFile(configFileName, defaults = TEST_DEFAULTS, writeDelay = 60.0, checkInterval = 0.0)
+    first['activeModel'] = 'sonar-pro'
+    assert second['activeModel'] == 'sonar-pro'
+
+    second['editingMode'] = 'emacs'
+    first['workArea'] = '/tmp'
+    second.flush()
+    assert _read(configFileName) == { 'activeModel': 'sonar-pro', 'editingMode': 'emacs', 'workArea': '/tmp', }
+    assert first['editingMode'] == 'emacs'
+
+
+def test_ConfigFile_corrupt(configFileName):
+    os.makedirs(os.path.dirname(configFileName))
+    with open(configFileName, 'w') as outputFile:
+        outputFile.write('activeModel: [unbalanced\n')
+    config = ConfigFile(configFileName, defaults = TEST_DEFAULTS)
+    assert config.asDict() == TEST_DEFAULTS
+    assert _read(configFileName) == TEST_DEFAULTS
@@ -0,0 +1,109 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from types import SimpleNamespace
+
+from perplexipy import PerplexityClient
+from perplexipy.conversation import Conversation
+from perplexipy.errors import PerplexityClientError
+from perplexipy.registry import ModelRegistry
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-conversation'
+
+
+# +++ helpers +++
+
+def _chunk(content):
+    return SimpleNamespace(choices = [ SimpleNamespace(delta = SimpleNamespace(content = content), finish_reason = None) ], usage = None)
+
+
+class _FakeCompletions:
+    """
+    Answers 'answer N' to the Nth request, streaming it word by word if asked
+    to; records the messages sent.
+    """
+    def __init__(self):
+        self.calls = [ ]
+
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs['messages'])
+        content = kwargs['messages'][-1]['content']
+        if 'bogus' in content:
+            raise ValueError(content)
+        answer = 'answer %d' % len(self.calls)
+        if kwargs.get('stream'):
+            return iter([ _chunk('answer '), _chunk(str(len(self.calls))), ])
+        return SimpleNamespace(choices = [ SimpleNamespace(message = SimpleNamespace(content = answer)) ], usage = None)
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def fakeClient():
+    client = PerplexityClient(key = TEST_KEY, registry = ModelRegistry())
+    client._client = SimpleNamespace(chat = SimpleNamespace(completions = _FakeCompletions()))
+
+    return client
+
+
+# +++ tests +++
+
+def test_Conversation(fakeClient):
+    conversation = Conversation(fakeClient, system = 'Be brief.')
+    assert conversation.budget == fakeClient.models[fakeClient.model].contextLength-4096
+    assert conversation.ask('first question') == 'answer 1'
+    assert conversation.ask('second question') == 'answer 2'
+    sent = fakeClient._client.chat.completions.calls[-1]
+    assert [ message['role'] for message in sent ] == [ 'system', 'user', 'assistant', 'user', ]
+    assert sent[0]['content'] == 'Be brief.'
+    assert len(conversation.history) == 4
+    assert conversation.promptTokens > 0
+
+    with pytest.raises(PerplexityClientError):
+        conversation.ask('')
+    with pytest.raises(ValueError):
+        conversation.ask('bogus')
+    assert len(conversation.history) == 4
+
+    conversation.reset()
+    assert not conversation.history
+
+
+def test_Conversation_budget(fakeClient):
+    conversation = Conversation(fakeClient, system = 'Be brief.', maxTokens = 60)
+    for n in range(50):
+        conversation.ask('question number %d with some padding words' % n)
+        assert conversation.promptTokens <= 60
+    sent = fakeClient._client.chat.completions.calls[-1]
+    assert sent[0] == { 'role': 'system', 'content': 'Be brief.', }
+    assert sent[1]['role'] == 'user'
+    assert sent[-1]['content'] == 'question number 49 with some padding words'
+    assert len(sent) < 10
+    assert len(conversation.history) == 100
+
+
+def test_Conversation_summarize(fakeClient):
+    conversation = Conversation(fakeClient, maxTokens = 60, summarize = True)
+    for n in range(10):
+        conversation.ask('question number %d with some padding words' % n)
+    assert conversation.summary
+    calls = fakeClient._client.chat.completions.calls
+    assert any('Summarize' in call[0]['content'] for call in calls)
+    assert calls[-1][0]['role'] == 'system'
+    assert calls[-1][0]['content'].startswith('Summary of the earlier conversation')
+
+
+def test_Conversation_askStreamable(fakeClient):
+    conversation = Conversation(fakeClient)
+    responses = conversation.askStreamable('streamed question')
+    assert next(responses) == 'answer '
+    # The rest of the stream is read before the next turn.
+    assert conversation.ask('next question') == 'answer 2'
+    assert conversation.history[1] == { 'role': 'assistant', 'content': 'answer 1', }
+    assert fakeClient._client.chat.completions.calls[-1][1]['content'] == 'answer 1'
@@ -0,0 +1,247 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+from perplexipy import AsyncPerplexityClient
+from perplexipy import PerplexityClient
+from perplexipy.deadline import CallCancelled
+from perplexipy.deadline import CancellationToken
+from perplexipy.deadline import Deadline
+from perplexipy.deadline import DeadlineExceeded
+from perplexipy.deadline import StreamStalled
+from perplexipy.deadline import deadlineFor
+from perplexipy.mapreduce import mapReduce
+from perplexipy.mockserver import MockServer
+from perplexipy.ratelimit import RetryPolicy
+from perplexipy.singleflight import AsyncSingleFlight
+from perplexipy.singleflight import SingleFlight
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-deadline'
+TEST_QUERY = 'Brief answer to the ultimate question about life, the Universe, and everything?'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def server():
+    with MockServer() as server:
+        yield server
+
+
+# +++ tests +++
+
+def test_deadlineFor():
+    assert deadlineFor() is None
+    token = CancellationToken()
+    deadline = deadlineFor(timeout = 10.0, cancelToken = token)
+    assert 9.0 < deadline.remaining() <= 10.0
+    assert deadlineFor(deadline = deadline) is deadline
+    # Inherited limits only get tighter.
+    inner = deadlineFor(timeout = 60.0, deadline = deadline, stallTimeout = 1.0)
+    assert inner.at == deadline.at
+    assert inner.cancelToken is token
+    assert inner.stallTimeout == 1.0
+    assert deadlineFor(deadline = time.monotonic()+5.0).remaining() <= 5.0
+    assert Deadline(cancelToken = token).remaining() is None
+
+    token.cancel()
+    with pytest.raises(CallCancelled):
+        deadline.check()
+    with pytest.raises(DeadlineExceeded):
+        Deadline(timeout = 0.0).check()
+
+
+def test_PerplexityClient_timeout(server):
+    server.latency = 1.0
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.query(TEST_QUERY, timeout = 0.2)
+    assert time.monotonic()-started < 0.8
+
+    # Already expired:  nothing is sent.
+    requests = server.requests
+    with pytest.raises(DeadlineExceeded):
+        client.queryBatch(TEST_QUERY, deadline = time.monotonic()-1.0)
+    assert server.requests == requests
+
+    server.latency = 0.0
+    assert client.query(TEST_QUERY, timeout = 5.0) == TEST_QUERY
+
+
+def test_PerplexityClient_retryWithinDeadline(server):
+    server.errorRate = 1.0
+    server.errorStatus = 503
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url, retryPolicy = RetryPolicy(maxRetries = 10, baseDelay = 1.0))
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.query(TEST_QUERY, timeout = 0.5)
+    # Backoff doesn't sleep past the deadline.
+    assert time.monotonic()-started < 1.0
+
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+    started = time.monotonic()
+    with pytest.raises((CallCancelled, DeadlineExceeded)):
+        client.query(TEST_QUERY, cancelToken = token, timeout = 30.0)
+    assert time.monotonic()-started < 2.0
+
+
+def test_PerplexityClient_streamDeadline(server):
+    server.tokenRate = 20.0
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+    chunks = [ ]
+    with pytest.raises(DeadlineExceeded):
+        for chunk in client.queryStreamable(TEST_QUERY, timeout = 0.2):
+            chunks.append(chunk)
+    assert 0 < len(chunks) < len(TEST_QUERY.split())
+
+
+def test_PerplexityClient_streamStall(server):
+    server.tokenRate = 2.0
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+    responses = client.queryStreamable(TEST_QUERY, stallTimeout = 0.1)
+    assert next(responses)
+    started = time.monotonic()
+    with pytest.raises(StreamStalled):
+        next(responses)
+    assert time.monotonic()-started < 0.4
+    assert responses.done
+
+
+def test_PerplexityClient_streamCancel(server):
+    server.tokenRate = 10.0
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+    token = CancellationToken()
+    responses = client.queryStreamable(TEST_QUERY, cancelToken = token)
+    assert next(responses)
+    token.cancel()
+    with pytest.raises(CallCancelled):
+        next(responses)
+    assert responses.done
+    with pytest.raises(CallCancelled):
+        client.queryStreamable(TEST_QUERY, cancelToken = token)
+
+
+def test_PerplexityClient_queryManyDeadline(server):
+    server.latency = 0.5
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+    started = time.monotonic()
+    outcomes = list(client.queryMany([ '%s %d' % (TEST_QUERY, n) for n in range(6) ], maxConcurrency = 2, timeout = 0.2))
+    assert time.monotonic()-started < 0.9
+    assert all(isinstance(outcome.error, DeadlineExceeded) for outcome in outcomes)
+
+    server.latency = 0.0
+    token = CancellationToken()
+    token.cancel()
+    with pytest.raises(CallCancelled):
+        mapReduce(client, 'Summarize', [ 'first part', 'second part', ], cancelToken = token)
+
+
+def test_SingleFlight_deadline(server):
+    server.latency = 0.5
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url, singleFlight = SingleFlight())
+    with ThreadPoolExecutor(max_workers = 2) as executor:
+        leader = executor.submit(client.query, TEST_QUERY, timeout = 0.1)
+        time.sleep(0.05)
+        # The follower outlives the leader's deadline and makes its own call.
+        follower = executor.submit(client.query, TEST_QUERY)
+        with pytest.raises(DeadlineExceeded):
+            leader.result()
+        assert follower.result() == TEST_QUERY
+
+        follower = executor.submit(client.query, TEST_QUERY)
+        time.sleep(0.05)
+        with pytest.raises(DeadlineExceeded):
+            client.query(TEST_QUERY, timeout = 0.1)
+        assert follower.result() == TEST_QUERY
+
+
+def test_AsyncPerplexityClient_timeout(server):
+    async def run():
+        client = AsyncPerplexityClient(key = TEST_KEY, endpoint = server.url)
+        server.latency = 1.0
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await client.query(TEST_QUERY, timeout = 0.2)
+        assert time.monotonic()-started < 0.8
+
+        # Already expired:  nothing is sent.
+        requests = server.requests
+        with pytest.raises(DeadlineExceeded):
+            await client.queryResult(TEST_QUERY, deadline = time.monotonic()-1.0)
+        assert server.requests == requests
+
+        # Cancelled from another thread while in flight.
+        token = CancellationToken()
+        threading.Timer(0.1, token.cancel).start()
+        started = time.monotonic()
+        with pytest.raises(CallCancelled):
+            await client.queryBatch(TEST_QUERY, cancelToken = token)
+        assert time.monotonic()-started < 0.8
+
+        server.latency = 0.0
+        assert await client.query(TEST_QUERY, timeout = 5.0) == TEST_QUERY
+
+    asyncio.run(run())
+
+
+def test_AsyncPerplexityClient_stream(server):
+    async def run():
+        client = AsyncPerplexityClient(key = TEST_KEY, endpoint = server.url)
+        server.tokenRate = 20.0
+        chunks = [ ]
+        with pytest.raises(DeadlineExceeded):
+            async for chunk in await client.queryStreamable(TEST_QUERY, timeout = 0.2):
+                chunks.append(chunk)
+        assert 0 < len(chunks) < len(TEST_QUERY.split())
+
+        server.tokenRate = 2.0
+        responses = await client.queryStreamable(TEST_QUERY, stallTimeout = 0.1)
+        assert await responses.__anext__()
+        with pytest.raises(StreamStalled):
+            await responses.__anext__()
+        assert responses.done
+
+        server.tokenRate = 10.0
+        token = CancellationToken()
+        responses = await client.queryStreamable(TEST_QUERY, cancelToken = token)
+        assert await responses.__anext__()
+        threading.Thread(target = token.cancel).start()
+        with pytest.raises(CallCancelled):
+            await responses.__anext__()
+        assert responses.done
+        with pytest.raises(CallCancelled):
+            await client.queryStreamable(TEST_QUERY, cancelToken = token)
+
+    asyncio.run(run())
+
+
+def test_AsyncPerplexityClient_queryManyDeadline(server):
+    async def run():
+        client = AsyncPerplexityClient(key = TEST_KEY, endpoint = server.url, singleFlight = AsyncSingleFlight())
+        server.latency = 0.5
+        started = time.monotonic()
+        outcomes = [ outcome async for outcome in client.queryMany([ '%s %d' % (TEST_QUERY, n) for n in range(6) ], maxConcurrency = 2, timeout = 0.2) ]
+        assert time.monotonic()-started < 0.9
+        assert all(isinstance(outcome.error, DeadlineExceeded) for outcome in outcomes)
+
+        # A coalesced follower outlives the leader's deadline.
+        leader = asyncio.ensure_future(client.query(TEST_QUERY, timeout = 0.1))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(client.query(TEST_QUERY))
+        with pytest.raises(DeadlineExceeded):
+            await leader
+        assert await follower == TEST_QUERY
+
+    asyncio.run(run())
@@ -0,0 +1,153 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from types import SimpleNamespace
+
+from perplexipy import PerplexityClient
+from perplexipy.hedging import HedgePolicy
+from perplexipy.hedging import HedgeStats
+from perplexipy.registry import ModelRegistry
+
+import itertools
+import threading
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-hedging'
+
+
+# +++ helpers +++
+
+class _StragglerCompletions:
+    """
+    Answers each request with its number; every `period`th request stalls for
+    `stall` seconds.
+    """
+    def __init__(self, period: int, stall: float):
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.period = period
+        self.stall = stall
+
+
+    def create(self, **kwargs):
+        with self._lock:
+            n = next(self._counter)
+        if not n%self.period:
+            time.sleep(self.stall)
+        return SimpleNamespace(choices = [ SimpleNamespace(message = SimpleNamespace(content = 'answer %d' % n)) ], usage = None)
+
+
+def _primed(**arguments) -> HedgePolicy:
+    policy = HedgePolicy(minSamples = 5, **arguments)
+    for _ in range(50):
+        policy.record(0.01)
+
+    return policy
+
+
+# +++ tests +++
+
+def test_HedgePolicy():
+    policy = HedgePolicy(minSamples = 5)
+    assert policy.delay is None
+    assert policy.run(lambda: 'fast') == 'fast'
+    assert policy.stats == HedgeStats(1, 0, 0, 0.0, None)
+    for latency in ( 0.01, 0.02, 0.03, 0.04, ):
+        policy.record(latency)
+    assert policy.delay == 0.04
+
+    # The stalled original request loses to its hedge.
+    policy = _primed(maxRatio = 1.0)
+    calls = itertools.count()
+
+    def straggler():
+        if not next(calls):
+            time.sleep(0.5)
+            return 'original'
+        return 'hedge'
+
+    started = time.perf_counter()
+    assert policy.run(straggler) == 'hedge'
+    assert time.perf_counter()-started < 0.3
+    stats = policy.stats
+    assert (stats.requests, stats.hedged, stats.wins, stats.hedgeRate) == (1, 1, 1, 1.0)
+
+
+def test_HedgePolicy_maxRatio():
+    policy = _primed(percentile = 0.5, maxRatio = 0.25)
+    slow = lambda: time.sleep(0.03) or 'slow'
+    for _ in range(8):
+        assert policy.run(slow) == 'slow'
+    stats = policy.stats
+    assert stats.requests == 8
+    assert stats.hedged == 2
+    assert stats.hedgeRate == 0.25
+
+
+def test_HedgePolicy_loser():
+    policy = _primed(maxRatio = 1.0)
+    calls = itertools.count()
+    closed = threading.Event()
+
+    class Response:
+        def __init__(self, name):
+            self.name = name
+
+
+        def close(self):
+            closed.set()
+
+    def straggler():
+        if not next(calls):
+            time.sleep(0.2)
+            return Response('original')
+        return Response('hedge')
+
+    # The losing response is closed once it arrives.
+    assert policy.run(straggler).name == 'hedge'
+    assert closed.wait(1.0)
+
+    discarded = [ ]
+    calls = itertools.count()
+    assert policy.run(straggler, discard = discarded.append).name == 'hedge'
+    time.sleep(0.3)
+    assert [ response.name for response in discarded ] == [ 'original', ]
+
+    # No hedge without spare capacity.
+    calls = itertools.count()
+    assert policy.run(straggler, hasCapacity = lambda: False).name == 'original'
+    assert policy.stats.hedged == 2
+
+
+def test_HedgePolicy_errors():
+    policy = _primed(maxRatio = 1.0)
+
+    def failing():
+        time.sleep(0.03)
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        policy.run(failing)
+    assert policy.stats.hedged == 1
+    assert policy.stats.wins == 0
+
+
+def test_PerplexityClient_hedgePolicy():
+    policy = HedgePolicy(percentile = 0.9, maxRatio = 0.2, minSamples = 10)
+    client = PerplexityClient(key = TEST_KEY, registry = ModelRegistry(), hedgePolicy = policy)
+    client._client = SimpleNamespace(chat = SimpleNamespace(completions = _StragglerCompletions(period = 15, stall = 0.5)))
+    started = time.perf_counter()
+    for _ in range(40):
+        assert client.query('Hedge this', cache = False).startswith('answer')
+    # Two stragglers hedged instead of waiting 0.5 seconds each.
+    assert time.perf_counter()-started < 0.8
+    stats = policy.stats
+    assert stats.requests == 40
+    assert stats.hedged >= 2
+    assert stats.wins >= 2
+    assert stats.hedgeRate <= 0.2
@@ -0,0 +1,116 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy import ModelInfo
+from perplexipy import PerplexityClient
+from perplexipy.conversation import CONVERSATION_RESERVE_TOKENS
+from perplexipy.errors import PerplexityClientError
+from perplexipy.mapreduce import chunkLines
+from perplexipy.mapreduce import inputBudget
+from perplexipy.mapreduce import mapReduce
+from perplexipy.mapreduce import openInput
+from perplexipy.mapreduce import readInput
+from perplexipy.mockserver import MockServer
+
+import io
+import os
+import tempfile
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_INSTRUCTION = 'List the errors.'
+TEST_KEY = 'pplx-mapreduce'
+TEST_LINES = [ 'line %04d: error %d\n' % (n, n%7) for n in range(400) ]
+
+
+# +++ helpers +++
+
+class _SmallContextClient(PerplexityClient):
+    # A model with room for about 1,000 characters of input.
+    @property
+    def models(self):
+        return { self.model: ModelInfo('8B', CONVERSATION_RESERVE_TOKENS+350, 'Sonar', 'Perplexity'), }
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def mockServer():
+    with MockServer(response = 'partial answer') as server:
+        yield server
+
+
+@pytest.fixture
+def inputFileName():
+    with tempfile.TemporaryDirectory() as path:
+        fileName = os.path.join(path, 'input.log')
+        with open(fileName, 'w') as outputFile:
+            outputFile.writelines(TEST_LINES)
+        yield fileName
+
+
+# +++ tests +++
+
+def test_readInput():
+    assert readInput(io.StringIO(''.join(TEST_LINES))) == TEST_LINES
+    with pytest.raises(PerplexityClientError):
+        readInput(io.StringIO(''.join(TEST_LINES)), maxSize = 100)
+
+
+def test_chunkLines():
+    chunks = list(chunkLines(TEST_LINES, 1000))
+    assert ''.join(chunks) == ''.join(TEST_LINES)
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert all(chunk.endswith('\n') for chunk in chunks)
+    assert list(chunkLines([ 'x'*25, 'y\n', ], 10)) == [ 'x'*10, 'x'*10, 'x'*5+'y\n', ]
+    assert list(chunkLines([ ], 10)) == [ ]
+
+
+def test_openInput(inputFileName):
+    with openInput(inputFileName) as source:
+        assert source.size == len(''.join(TEST_LINES))
+        assert list(source) == TEST_LINES
+        assert source.text() == ''.join(TEST_LINES)
+    with pytest.raises(PerplexityClientError):
+        openInput(inputFileName, maxSize = 100)
+
+    emptyFileName = inputFileName+'.empty'
+    open(emptyFileName, 'w').close()
+    with openInput(emptyFileName) as source:
+        assert source.size == 0
+        assert list(source) == [ ]
+        assert source.text() == ''
+
+
+def test_mapReduce(mockServer, inputFileName):
+    client = _SmallContextClient(key = TEST_KEY, endpoint = mockServer.url)
+    budget = inputBudget(client, TEST_INSTRUCTION)
+    assert 500 < budget < 1500
+    progress = [ ]
+    with openInput(inputFileName) as source:
+        total = -(-source.size//budget)
+        result = mapReduce(client, TEST_INSTRUCTION, chunkLines(source, budget), 4, lambda done, total: progress.append((done, total)), total)
+    assert result == 'partial answer'
+    chunks = len(list(chunkLines(TEST_LINES, budget)))
+    assert chunks > 1
+    assert mockServer.requests == chunks+1
+    assert progress[-1] == (chunks, chunks)
+
+    # Partial answers that don't fit a single reduce query are combined in
+    # groups first.
+    mockServer.response = 'x'*(budget//3)
+    requests = mockServer.requests
+    mapReduce(client, TEST_INSTRUCTION, [ 'one', 'two', 'three', 'four', ])
+    assert mockServer.requests-requests > 5
+
+    # A single chunk needs no reduce query.
+    requests = mockServer.requests
+    assert mapReduce(client, TEST_INSTRUCTION, [ 'one', ]) == mockServer.response
+    assert mockServer.requests == requests+1
+
+    with pytest.raises(PerplexityClientError):
+        mapReduce(client, TEST_INSTRUCTION, [ ])
+
@@ -0,0 +1,70 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from types import SimpleNamespace
+
+from perplexipy.metrics import CallRecord
+from perplexipy.metrics import Histogram
+from perplexipy.metrics import MetricsAggregator
+from perplexipy.metrics import ObservedResponses
+
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_RECORD = CallRecord('query', 'sonar', 0.0, 0.3, None, (), 12, 40, None)
+
+
+# +++ tests +++
+
+def test_Histogram():
+    histogram = Histogram(( 1.0, 2.0, 4.0, ))
+    assert histogram.quantile(0.5) is None
+    for value in ( 0.5, 1.5, 1.5, 3.0, 10.0, ):
+        histogram.observe(value)
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(16.5)
+    assert histogram.buckets == [ (1.0, 1), (2.0, 3), (4.0, 4), (float('inf'), 5), ]
+    assert 1.0 < histogram.quantile(0.5) <= 2.0
+    assert histogram.quantile(1.0) == 4.0
+
+
+def test_MetricsAggregator():
+    metrics = MetricsAggregator()
+    metrics.record(TEST_RECORD)
+    metrics.record(TEST_RECORD._replace(latency = 1.2, error = 'RateLimitError', promptTokens = None, completionTokens = None))
+    metrics.record(CallRecord('queryStreamable', 'sonar', 0.0, 2.0, 0.2, (0.01, 0.02), 12, 100, None))
+    assert metrics.requests('query', 'sonar') == 2
+    assert metrics.errors('query', 'sonar', 'RateLimitError') == 1
+    assert metrics.histogram('latency', 'query', 'sonar').count == 2
+    assert metrics.histogram('interTokenGap', 'queryStreamable', 'sonar').count == 2
+    assert metrics.histogram('timeToFirstToken', 'query', 'sonar') is None
+
+    text = metrics.prometheus()
+    assert '# TYPE perplexipy_request_latency_seconds histogram' in text
+    assert 'perplexipy_requests_total{method="query",model="sonar"} 2' in text
+    assert 'perplexipy_request_errors_total{method="query",model="sonar",error="RateLimitError"} 1' in text
+    assert 'perplexipy_request_latency_seconds_bucket{method="query",model="sonar",le="+Inf"} 2' in text
+    assert 'perplexipy_completion_tokens_count{method="queryStreamable",model="sonar"} 1' in text
+
+    metrics.reset()
+    assert not metrics.requests('query', 'sonar')
+
+
+def test_ObservedResponses():
+    metrics = MetricsAggregator()
+    usage = SimpleNamespace(prompt_tokens = 3, completion_tokens = 2)
+    chunks = iter([
+        SimpleNamespace(choices = [ SimpleNamespace(delta = SimpleNamespace(content = 'a'), finish_reason = None) ], usage = None),
+        SimpleNamespace(choices = [ SimpleNamespace(delta = SimpleNamespace(content = 'b'), finish_reason = 'stop') ], usage = usage),
+    ])
+    responses = ObservedResponses(chunks, metrics, 'queryStreamable', 'sonar', time.perf_counter())
+    assert responses.text() == 'ab'
+    responses.close()
+    assert metrics.requests('queryStreamable', 'sonar') == 1
+    assert metrics.histogram('timeToFirstToken', 'queryStreamable', 'sonar').count == 1
+    assert metrics.histogram('interTokenGap', 'queryStreamable', 'sonar').count == 1
+    assert metrics.histogram('promptTokens', 'queryStreamable', 'sonar').sum == 3
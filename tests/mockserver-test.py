@@ -0,0 +1,64 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy import PerplexityClient
+from perplexipy.mockserver import MOCKSERVER_CITATIONS
+from perplexipy.mockserver import MockServer
+from perplexipy.ratelimit import RetryPolicy
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-mockserver'
+TEST_QUERY = 'Brief answer to the ultimate question about life, the Universe, and everything?'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def mockServer():
+    with MockServer() as server:
+        yield server
+
+
+# +++ tests +++
+
+def test_MockServer(mockServer):
+    client = PerplexityClient(key = TEST_KEY, endpoint = mockServer.url)
+    assert client.query(TEST_QUERY) == TEST_QUERY
+    assert client.queryBatch(TEST_QUERY) == ( TEST_QUERY, )
+    assert mockServer.requests == 2
+
+
+def test_MockServer_stream(mockServer):
+    client = PerplexityClient(key = TEST_KEY, endpoint = mockServer.url)
+    with client.queryStreamable(TEST_QUERY) as responses:
+        chunks = responses.collect()
+    assert len(chunks) == len(TEST_QUERY.split())
+    assert ''.join(chunks) == TEST_QUERY
+    assert responses.finishReason == 'stop'
+    assert responses.usage.completion_tokens == len(chunks)
+    assert responses.citations == MOCKSERVER_CITATIONS
+
+
+def test_MockServer_errors():
+    with MockServer(errorRate = 1.0, errorStatus = 503, retryAfter = 0.01) as server:
+        client = PerplexityClient(key = TEST_KEY, endpoint = server.url, retryPolicy = RetryPolicy(maxRetries = 2))
+        with pytest.raises(Exception) as error:
+            client.query(TEST_QUERY)
+        assert error.value.status_code == 503
+        assert server.errors == 3
+
+    with MockServer(errorRate = 0.5, retryAfter = 0.0, seed = 1) as server:
+        client = PerplexityClient(key = TEST_KEY, endpoint = server.url, retryPolicy = RetryPolicy(maxRetries = 20))
+        assert [ client.query('query %d' % n) for n in range(10) ] == [ 'query %d' % n for n in range(10) ]
+        assert server.errors
+
+
+def test_MockServer_response():
+    with MockServer(response = 'forty two', tokenRate = 1000.0) as server:
+        client = PerplexityClient(key = TEST_KEY, endpoint = server.url)
+        assert client.query(TEST_QUERY) == 'forty two'
+        assert list(client.queryStreamable(TEST_QUERY)) == [ 'forty ', 'two', ]
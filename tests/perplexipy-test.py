@@ -1,11 +1,31 @@
 # See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
 
+from types import SimpleNamespace
+
+from perplexipy import AsyncPerplexityClient
 from perplexipy import PERPLEXITY_API_KEY
+from perplexipy import PERPLEXITY_API_URL
+from perplexipy import PERPLEXITY_DEFAULT_MODEL
 from perplexipy import PerplexityClient
+from perplexipy import QueryOutcome
 from perplexipy import _CLAUDE_MODEL
+from perplexipy.cache import MemoryCache
+from perplexipy.cassette import cassetteFromEnvironment
 from perplexipy.errors import PerplexityClientError
+from perplexipy.metrics import MetricsAggregator
+from perplexipy.ratelimit import AIMDController
+from perplexipy.ratelimit import RateLimiter
+from perplexipy.ratelimit import RetryPolicy
+from perplexipy.registry import ModelRegistry
+from perplexipy.responses import AsyncResponses
 from perplexipy.responses import Responses
 
+import asyncio
+import gc
+import random
+import threading
+import time
+
 import pytest
 
 
@@ -18,21 +38,122 @@ TEST_QUERY_LONG = 'Give me a comprehensive list of US presidents.'
 
 # +++ globals +++
 
+_cassetteServer = None
 _testClient = None
 
 
+# +++ helpers +++
+
+def _fakeCompletion(*contents):
+    return SimpleNamespace(choices = [ SimpleNamespace(message = SimpleNamespace(content = content)) for content in contents ])
+
+
+def _fakeChunk(content, finishReason = None):
+    return SimpleNamespace(choices = [ SimpleNamespace(delta = SimpleNamespace(content = content), finish_reason = finishReason) ], usage = None)
+
+
+class _FakeModelError(Exception):
+    status_code = 400
+
+
+class _FakeRateLimitError(Exception):
+    status_code = 429
+    response = SimpleNamespace(headers = { 'retry-after-ms': '1', })
+
+
+class _FakeCompletions:
+    """
+    Echoes the query back as the response; queries containing 'bogus' raise.
+    """
+    def __init__(self):
+        self.calls = [ ]
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._lock = threading.Lock()
+
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls.append(kwargs)
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            time.sleep(random.random()/100.0)
+            content = kwargs['messages'][-1]['content']
+            if 'bogus' in content:
+                raise ValueError(content)
+            if kwargs['model'] == _CLAUDE_MODEL:
+                raise _FakeModelError("Invalid model '%s'" % kwargs['model'])
+            if 'throttled' in content and len(self.calls) <= 2:
+                raise _FakeRateLimitError(content)
+            if kwargs.get('stream'):
+                chunks = [ _fakeChunk(word+' ') for word in content.split() ]
+                chunks[-1].usage = SimpleNamespace(prompt_tokens = 10, completion_tokens = len(chunks), total_tokens = 10+len(chunks))
+                return iter(chunks)
+            return _fakeCompletion(content)
+        finally:
+            with self._lock:
+                self.inFlight -= 1
+
+
+class _FakeAsyncStream:
+    def __init__(self, contents):
+        self._chunks = iter(_fakeChunk(content) for content in contents)
+
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _FakeAsyncCompletions:
+    def __init__(self, contents):
+        self.contents = contents
+        self.calls = [ ]
+
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        await asyncio.sleep(0)
+        if kwargs.get('stream'):
+            return _FakeAsyncStream(self.contents)
+        return _fakeCompletion(*self.contents)
+
+
 # +++ fixtures +++
 
 @pytest.fixture
 def testClient():
+    # Live API client, or a recording/replaying one if PERPLEXITY_CASSETTE is
+    # set; see perplexipy.cassette.cassetteFromEnvironment().
+    global _cassetteServer
     global _testClient
 
     if not _testClient:
-        _testClient = PerplexityClient(key = PERPLEXITY_API_KEY)
+        _cassetteServer = cassetteFromEnvironment()
+        _testClient = PerplexityClient(key = PERPLEXITY_API_KEY, endpoint = _cassetteServer.url if _cassetteServer else PERPLEXITY_API_URL)
 
     return _testClient
 
 
+@pytest.fixture
+def offlineTestClient():
+    client = PerplexityClient(key = PERPLEXITY_API_KEY, registry = ModelRegistry())
+    client._client = SimpleNamespace(chat = SimpleNamespace(completions = _FakeCompletions()))
+
+    return client
+
+
+@pytest.fixture
+def asyncTestClient():
+    client = AsyncPerplexityClient(key = PERPLEXITY_API_KEY)
+    client._client = SimpleNamespace(chat = SimpleNamespace(completions = _FakeAsyncCompletions([ '42', ' is', ' the answer', ])))
+
+    return client
+
+
 def test_PerplexityClient():
     with pytest.raises(PerplexityClientError):
         PerplexityClient(None)
@@ -63,10 +184,15 @@ def test_PerplexityClient_modelAccessors(testClient):
     originalModel = testClient.model
     unitTestState = testClient._unitTest
     testClient._unitTest = True
-    with pytest.raises(Exception):
-        testClient.model = _CLAUDE_MODEL
-    testClient._unitTest = unitTestState
-    testClient.model = originalModel
+    try:
+        testClient.model = _CLAUDE_MODEL # no probe, validated on first use
+        assert not testClient.checkModel().available
+        with pytest.raises(PerplexityClientError):
+            testClient.model = _CLAUDE_MODEL
+    finally:
+        testClient._unitTest = unitTestState
+        testClient.model = originalModel
+    assert testClient.checkModel().available
 
 
 def test_PerplexityClient_queryBatch(testClient):
@@ -97,5 +223,183 @@ def test_PerplexityClient_models(testClient):
     assert model in models.keys()
 
 
+def test_AsyncPerplexityClient():
+    with pytest.raises(PerplexityClientError):
+        AsyncPerplexityClient(None)
+    with pytest.raises(PerplexityClientError):
+        AsyncPerplexityClient('xxxx')
+    with pytest.raises(PerplexityClientError):
+        AsyncPerplexityClient(PERPLEXITY_API_KEY+'😊')
+
+
+def test_AsyncPerplexityClient_query(asyncTestClient):
+    result = asyncio.run(asyncTestClient.query(TEST_QUERY))
+    assert result == '42'
+    assert asyncTestClient._client.chat.completions.calls[0]['model'] == asyncTestClient.model
+
+    with pytest.raises(PerplexityClientError):
+        asyncio.run(asyncTestClient.query(''))
+
+
+def test_AsyncPerplexityClient_queryBatch(asyncTestClient):
+    result = asyncio.run(asyncTestClient.queryBatch(TEST_QUERY))
+    assert result == ('42', ' is', ' the answer')
+
+
+def test_AsyncPerplexityClient_queryStreamable(asyncTestClient):
+    async def collect():
+        results = await asyncTestClient.queryStreamable(TEST_QUERY_LONG)
+        assert isinstance(results, AsyncResponses)
+        return [ result async for result in results ]
+
+    assert ''.join(asyncio.run(collect())) == '42 is the answer'
+
+    with pytest.raises(PerplexityClientError):
+        asyncio.run(asyncTestClient.queryStreamable(None))
+
+
+def test_AsyncPerplexityClient_concurrency(asyncTestClient):
+    async def fanOut():
+        return await asyncio.gather(*(asyncTestClient.query('%s %d' % (TEST_QUERY, n)) for n in range(100)))
+
+    results = asyncio.run(fanOut())
+    assert len(results) == 100
+    assert len(asyncTestClient._client.chat.completions.calls) == 100
+
+
+def test_AsyncPerplexityClient_modelAccessors(asyncTestClient):
+    with pytest.raises(PerplexityClientError):
+        asyncTestClient.model = TEST_BOGUS_MODEL
+    with pytest.raises(PerplexityClientError):
+        asyncTestClient.model = None
+    model = tuple(asyncTestClient.models.keys())[0]
+    asyncTestClient.model = model
+    assert asyncTestClient.model == model
+
+
+def test_PerplexityClient_queryMany(offlineTestClient):
+    queries = [ 'query %d' % n for n in range(50) ]
+    queries[7] = 'bogus query'
+    outcomes = list(offlineTestClient.queryMany(queries, maxConcurrency = 4))
+    assert len(outcomes) == 50
+    assert [ outcome.index for outcome in outcomes ] == list(range(50))
+    assert all(isinstance(outcome, QueryOutcome) for outcome in outcomes)
+    assert isinstance(outcomes[7].error, ValueError)
+    assert outcomes[7].result is None
+    assert outcomes[8].result == 'query 8'
+    assert offlineTestClient._client.chat.completions.maxInFlight <= 4
+
+    outcomes = list(offlineTestClient.queryMany(iter(queries), maxConcurrency = 8, ordered = False))
+    assert sorted(outcome.index for outcome in outcomes) == list(range(50))
+    assert all(outcome.result == outcome.query for outcome in outcomes if not outcome.error)
+
+    assert not list(offlineTestClient.queryMany([ ]))
+    with pytest.raises(PerplexityClientError):
+        offlineTestClient.queryMany(queries, maxConcurrency = 0)
+
+
+def test_AsyncPerplexityClient_queryMany(asyncTestClient):
+    async def collect(ordered):
+        return [ outcome async for outcome in asyncTestClient.queryMany([ 'q1', '', 'q3', ], maxConcurrency = 2, ordered = ordered) ]
+
+    outcomes = asyncio.run(collect(True))
+    assert [ outcome.index for outcome in outcomes ] == [ 0, 1, 2, ]
+    assert outcomes[0].result == '42'
+    assert isinstance(outcomes[1].error, PerplexityClientError)
+    assert len(asyncio.run(collect(False))) == 3
+
+
+def test_PerplexityClient_cache(offlineTestClient):
+    assert offlineTestClient.cache is None
+    offlineTestClient._cache = MemoryCache()
+    calls = offlineTestClient._client.chat.completions.calls
+
+    assert offlineTestClient.query(TEST_QUERY) == TEST_QUERY
+    assert offlineTestClient.query(TEST_QUERY) == TEST_QUERY
+    assert offlineTestClient.queryBatch(TEST_QUERY) == (TEST_QUERY,)
+    assert len(calls) == 1
+    assert offlineTestClient.cache.stats.hits == 2
+
+    offlineTestClient.query(TEST_QUERY, cache = False)
+    assert len(calls) == 2
+    offlineTestClient.model = tuple(offlineTestClient.models.keys())[0]
+    offlineTestClient.query(TEST_QUERY)
+    assert offlineTestClient.cache.stats.misses == 2
+
+
+def test_PerplexityClient_modelRegistry(offlineTestClient):
+    calls = offlineTestClient._client.chat.completions.calls
+    offlineTestClient._unitTest = True
+    offlineTestClient.model = _CLAUDE_MODEL
+    assert not calls
+    with pytest.raises(_FakeModelError):
+        offlineTestClient.query(TEST_QUERY)
+    assert not offlineTestClient.registry.get(offlineTestClient._endpoint, _CLAUDE_MODEL).available
+    offlineTestClient.model = PERPLEXITY_DEFAULT_MODEL
+    with pytest.raises(PerplexityClientError):
+        offlineTestClient.model = _CLAUDE_MODEL
+
+    health = offlineTestClient.checkModel()
+    assert health.available
+    assert health.model == PERPLEXITY_DEFAULT_MODEL
+    assert not offlineTestClient.checkModel(_CLAUDE_MODEL).available
+
+
+def test_PerplexityClient_observer(offlineTestClient):
+    assert offlineTestClient.observer is None
+    metrics = MetricsAggregator()
+    offlineTestClient.observer = metrics
+    model = offlineTestClient.model
+
+    offlineTestClient.query(TEST_QUERY)
+    offlineTestClient.queryBatch(TEST_QUERY)
+    with pytest.raises(ValueError):
+        offlineTestClient.query('bogus')
+    list(offlineTestClient.queryMany([ TEST_QUERY, TEST_QUERY, ]))
+    assert metrics.requests('query', model) == 2
+    assert metrics.requests('queryBatch', model) == 1
+    assert metrics.errors('query', model, 'ValueError') == 1
+    assert metrics.histogram('queueWait', 'queryMany', model).count == 2
+    assert metrics.histogram('latency', 'query', model).sum > 0.0
+
+
+def test_PerplexityClient_rateLimiter(offlineTestClient):
+    limiter = RateLimiter(requestsPerMinute = 60000, concurrency = AIMDController())
+    offlineTestClient._rateLimiter = limiter
+    with pytest.raises(_FakeRateLimitError):
+        offlineTestClient.query('throttled query')
+    assert limiter.throttled == 1
+
+    offlineTestClient._retryPolicy = RetryPolicy(maxRetries = 3)
+    assert offlineTestClient.query('throttled query') == 'throttled query'
+    assert limiter.throttled == 2
+    assert len(offlineTestClient._client.chat.completions.calls) == 3
+    assert limiter.concurrency.inFlight == 0
+
+    # Streams hold their permit until they end or are closed.
+    responses = offlineTestClient.queryStreamable(TEST_QUERY)
+    assert limiter.concurrency.inFlight == 1
+    assert responses.text().split() == TEST_QUERY.split()
+    assert limiter.concurrency.inFlight == 0
+    with offlineTestClient.queryStreamable(TEST_QUERY) as responses:
+        next(responses)
+        assert limiter.concurrency.inFlight == 1
+    assert limiter.concurrency.inFlight == 0
+
+    # Dropped streams give their permit back when they're collected.
+    limiter = RateLimiter(concurrency = AIMDController(initialLimit = 1.0, maxLimit = 1.0))
+    offlineTestClient._rateLimiter = limiter
+    for _ in range(3):
+        responses = offlineTestClient.queryStreamable(TEST_QUERY)
+        next(responses)
+        del responses
+        gc.collect()
+        assert limiter.concurrency.inFlight == 0
+    assert limiter.acquire(timeout = 0.1) is not None
+
+    client = PerplexityClient(key = PERPLEXITY_API_KEY, retryPolicy = RetryPolicy())
+    assert not client._client.max_retries
+
+
 # _testClient = PerplexityClient(key = PERPLEXITY_API_KEY)
 # test_PerplexityClient_modelAccessors(_testClient)
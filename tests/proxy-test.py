@@ -0,0 +1,126 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+from perplexipy import PerplexityClient
+from perplexipy.cache import MemoryCache
+from perplexipy.metrics import MetricsAggregator
+from perplexipy.mockserver import MockServer
+from perplexipy.proxy import ProxyServer
+from perplexipy.singleflight import SingleFlight
+
+import json
+import urllib.error
+import urllib.request
+
+import openai
+import pytest
+
+
+# +++ constants +++
+
+TEST_QUERY = 'Brief answer to the ultimate question about life, the Universe, and everything?'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def upstream():
+    with MockServer() as server:
+        yield server
+
+
+@pytest.fixture
+def proxy(upstream):
+    client = PerplexityClient(key = 'pplx-proxy-upstream', endpoint = upstream.url, cache = MemoryCache(), singleFlight = SingleFlight(), observer = MetricsAggregator())
+    with ProxyServer(client, port = 0, clientConcurrency = 2) as server:
+        yield server
+
+
+# +++ helpers +++
+
+def _post(url: str, body: bytes, key: str = None):
+    headers = { 'Content-Type': 'application/json', }
+    if key:
+        headers['Authorization'] = 'Bearer %s' % key
+    request = urllib.request.Request(url+'/chat/completions', data = body, headers = headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+# +++ tests +++
+
+def test_ProxyServer_query(proxy, upstream):
+    client = PerplexityClient(key = 'pplx-team-member', endpoint = proxy.url)
+    assert client.query(TEST_QUERY) == TEST_QUERY
+    assert client.queryBatch(TEST_QUERY) == (TEST_QUERY,)
+    # The second request was a cache hit.
+    assert upstream.requests == 1
+    assert proxy.client.cache.stats.hits == 1
+    # The upstream body, with usage and citations, passes through.
+    result = client.queryResult(TEST_QUERY)
+    assert result.citations
+    assert result.usage.completion_tokens == len(TEST_QUERY.split())
+
+
+def test_ProxyServer_stream(proxy, upstream):
+    client = PerplexityClient(key = 'pplx-team-member', endpoint = proxy.url)
+    with client.queryStreamable(TEST_QUERY) as responses:
+        assert len(responses.collect()) == len(TEST_QUERY.split())
+    assert responses.text() == TEST_QUERY
+    assert responses.finishReason == 'stop'
+    assert responses.usage.completion_tokens == len(TEST_QUERY.split())
+    assert responses.citations
+
+
+def test_ProxyServer_coalescing(proxy, upstream):
+    upstream.latency = 0.2
+    clients = [ PerplexityClient(key = 'pplx-member-%d' % n, endpoint = proxy.url) for n in range(4) ]
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        results = list(executor.map(lambda client: client.query(TEST_QUERY, cache = False), clients))
+    assert results == [ TEST_QUERY, ]*4
+    assert upstream.requests == 1
+
+
+def test_ProxyServer_clientConcurrency(proxy, upstream):
+    upstream.latency = 0.3
+    body = json.dumps({ 'model': 'sonar', 'messages': [ { 'role': 'user', 'content': TEST_QUERY, }, ], }).encode('utf-8')
+    with ThreadPoolExecutor(max_workers = 3) as executor:
+        sameKey = list(executor.map(lambda n: _post(proxy.url, body.replace(b'ultimate', b'ultimate %d' % n), 'pplx-greedy')[0], range(3)))
+    assert sorted(sameKey) == [ 200, 200, 429, ]
+    with ThreadPoolExecutor(max_workers = 3) as executor:
+        otherKeys = list(executor.map(lambda n: _post(proxy.url, body.replace(b'ultimate', b'final %d' % n), 'pplx-member-%d' % n)[0], range(3)))
+    assert otherKeys == [ 200, ]*3
+    assert 'perplexipy_proxy_rejected_total 1' in proxy.metrics()
+
+
+def test_ProxyServer_errors(proxy, upstream):
+    assert _post(proxy.url, b'not JSON')[0] == 400
+    status, body = _post(proxy.url, json.dumps({ 'messages': [ ], }).encode('utf-8'))
+    assert status == 400
+    assert body['error']['type'] == 'invalid_request_error'
+
+    upstream.errorRate = 1.0
+    upstream.errorStatus = 503
+    proxy.client._client = proxy.client._client.with_options(max_retries = 0)
+    client = PerplexityClient(key = 'pplx-team-member', endpoint = proxy.url)
+    client._client = client._client.with_options(max_retries = 0)
+    with pytest.raises(openai.InternalServerError) as error:
+        client.query('Uncached query', cache = False)
+    assert error.value.status_code == 503
+    assert 'perplexipy_proxy_errors_total 1' in proxy.metrics()
+
+
+def test_ProxyServer_metrics(proxy):
+    client = PerplexityClient(key = 'pplx-team-member', endpoint = proxy.url)
+    client.query(TEST_QUERY)
+    with urllib.request.urlopen(proxy.url+'/metrics') as response:
+        assert response.headers['Content-Type'].startswith('text/plain')
+        metrics = response.read().decode('utf-8')
+    assert 'perplexipy_proxy_requests_total 1' in metrics
+    assert 'perplexipy_proxy_cache_misses_total 1' in metrics
+    assert 'perplexipy_requests_total{method="proxy",model="sonar"} 1' in metrics
@@ -0,0 +1,158 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from types import SimpleNamespace
+
+from perplexipy.ratelimit import AIMDController
+from perplexipy.ratelimit import RateLimiter
+from perplexipy.ratelimit import RetryPolicy
+from perplexipy.ratelimit import TokenBucket
+from perplexipy.ratelimit import retryAfter
+
+import threading
+import time
+
+import pytest
+
+
+# +++ helpers +++
+
+class _FakeStatusError(Exception):
+    def __init__(self, statusCode, headers = None):
+        super().__init__('status %d' % statusCode)
+        self.status_code = statusCode
+        self.response = SimpleNamespace(headers = headers or { })
+
+
+# +++ tests +++
+
+def test_retryAfter():
+    assert retryAfter(ValueError()) is None
+    assert retryAfter(_FakeStatusError(429)) is None
+    assert retryAfter(_FakeStatusError(429, { 'retry-after': '2', })) == 2.0
+    assert retryAfter(_FakeStatusError(429, { 'retry-after-ms': '250', })) == 0.25
+    assert retryAfter(_FakeStatusError(429, { 'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT', })) == 0.0
+    assert retryAfter(_FakeStatusError(429, { 'retry-after': 'bogus', })) is None
+
+
+def test_TokenBucket():
+    bucket = TokenBucket(rate = 100.0, capacity = 5.0)
+    start = time.monotonic()
+    for _ in range(10):
+        assert bucket.acquire()
+    assert time.monotonic()-start >= 0.04
+    assert not bucket.acquire(5.0, timeout = 0.001)
+
+    bucket.adjust(-100.0)
+    assert bucket.level < 0.0
+    bucket.adjust(1000.0)
+    assert bucket.level == 5.0
+
+
+def test_AIMDController():
+    controller = AIMDController(initialLimit = 4.0, minLimit = 1.0, maxLimit = 5.0)
+    starts = [ controller.acquire() for _ in range(4) ]
+    assert controller.inFlight == 4
+    assert controller.acquire(timeout = 0.01) is None
+
+    for startedAt in starts[:2]:
+        controller.release(startedAt, throttled = True)
+    assert controller.limit == 2.0 # one congestion event, one cut
+    controller.release(starts[2])
+    assert controller.limit == 2.5
+    controller.release(starts[3]) # grows by 1/2.5
+    assert controller.limit == pytest.approx(2.9)
+    controller.release(controller.acquire(), throttled = True)
+    assert controller.limit == pytest.approx(1.45)
+    for _ in range(20):
+        controller.release(controller.acquire())
+    assert controller.limit == 5.0
+
+    slow = AIMDController(initialLimit = 4.0, latencyTarget = 0.0)
+    slow.release(slow.acquire())
+    assert slow.limit == 2.0
+
+
+def test_AIMDController_threads():
+    controller = AIMDController(initialLimit = 3.0, maxLimit = 3.0)
+    peak = [ 0, ]
+    lock = threading.Lock()
+
+    def work():
+        startedAt = controller.acquire()
+        with lock:
+            peak[0] = max(peak[0], controller.inFlight)
+        time.sleep(0.005)
+        controller.release(startedAt)
+
+    threads = [ threading.Thread(target = work) for _ in range(20) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] <= 3
+    assert controller.inFlight == 0
+
+
+def test_RateLimiter():
+    limiter = RateLimiter(requestsPerMinute = 6000, tokensPerMinute = 6000, concurrency = AIMDController(), completionTokens = 100)
+    permit = limiter.acquire(50)
+    assert permit.tokens == 150
+    assert limiter.concurrency.inFlight == 1
+    limiter.release(permit, usage = SimpleNamespace(total_tokens = 30))
+    assert limiter.concurrency.inFlight == 0
+    # 150 tokens reserved, 30 used:  the 120 difference is returned.
+    assert limiter._tokens.level == pytest.approx(5970.0, abs = 1.0)
+
+    limiter.release(limiter.acquire(), error = _FakeStatusError(429))
+    assert limiter.throttled == 1
+    assert limiter.concurrency.limit < 8.0
+
+
+def test_RateLimiter_timeout():
+    limiter = RateLimiter(requestsPerMinute = 60, tokensPerMinute = 6000, concurrency = AIMDController(initialLimit = 2.0))
+    permit = limiter.acquire(10, timeout = 0.0)
+    assert permit
+    # One request per second, burst of one:  the budget is spent.
+    assert limiter.acquire(10, timeout = 0.0) is None
+    assert limiter.concurrency.inFlight == 1
+    limiter.release(permit)
+
+    limiter = RateLimiter(tokensPerMinute = 600, completionTokens = 0)
+    assert limiter.acquire(500, timeout = 0.0)
+    assert limiter.acquire(500, timeout = 0.0) is None
+    assert limiter._tokens.level == pytest.approx(100.0, abs = 1.0)
+
+
+def test_RateLimiter_hasCapacity():
+    limiter = RateLimiter(requestsPerMinute = 60, tokensPerMinute = 6000, concurrency = AIMDController(initialLimit = 1.0), completionTokens = 100)
+    assert limiter.hasCapacity(100)
+    permit = limiter.acquire(100)
+    # Nothing is taken by the check.
+    assert not limiter.hasCapacity()
+    limiter.release(permit)
+    assert limiter.concurrency.inFlight == 0
+    # The request bucket is empty for a second.
+    assert not limiter.hasCapacity()
+
+    limiter = RateLimiter(tokensPerMinute = 600, completionTokens = 100)
+    assert limiter.hasCapacity(400)
+    limiter.acquire(450)
+    assert not limiter.hasCapacity()
+
+
+def test_RetryPolicy():
+    from openai import APIConnectionError
+
+    policy = RetryPolicy(maxRetries = 2, baseDelay = 1.0, maxDelay = 3.0)
+    assert policy.shouldRetry(_FakeStatusError(429), 0)
+    assert policy.shouldRetry(_FakeStatusError(503), 1)
+    assert not policy.shouldRetry(_FakeStatusError(429), 2)
+    assert not policy.shouldRetry(_FakeStatusError(400), 0)
+    assert not policy.shouldRetry(ValueError(), 0)
+    assert policy.shouldRetry(APIConnectionError(request = None), 0)
+
+    assert 0.0 <= policy.delay(_FakeStatusError(429), 0) <= 1.0
+    assert 0.0 <= policy.delay(_FakeStatusError(429), 5) <= 3.0
+    assert 2.0 <= policy.delay(_FakeStatusError(429, { 'retry-after': '2', }), 0) <= 2.2
+    assert policy.delay(_FakeStatusError(429, { 'retry-after': '60', }), 0) == 3.0
@@ -0,0 +1,87 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from types import SimpleNamespace
+
+from perplexipy.registry import ModelHealth
+from perplexipy.registry import ModelRegistry
+
+import os
+import tempfile
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_ENDPOINT = 'https://api.perplexity.ai'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def registryFileName():
+    with tempfile.TemporaryDirectory() as path:
+        yield os.path.join(path, 'config', 'model-registry.json')
+
+
+# +++ tests +++
+
+def test_ModelRegistry(registryFileName):
+    registry = ModelRegistry(registryFileName)
+    assert registry.get(TEST_ENDPOINT, 'sonar') is None
+    health = registry.record(TEST_ENDPOINT, 'sonar', True)
+    assert isinstance(health, ModelHealth)
+    assert registry.get(TEST_ENDPOINT, 'sonar') == health
+    registry.record(TEST_ENDPOINT, 'bogus', False, 'Invalid model')
+    assert os.path.exists(registryFileName)
+
+    registry = ModelRegistry(registryFileName)
+    assert registry.get(TEST_ENDPOINT, 'sonar').available
+    assert registry.get(TEST_ENDPOINT, 'bogus').error == 'Invalid model'
+    assert registry.get('http://localhost', 'sonar') is None
+
+    registry = ModelRegistry(registryFileName, ttl = 0.01)
+    time.sleep(0.02)
+    assert registry.get(TEST_ENDPOINT, 'sonar') is None
+
+    registry.clear()
+    assert ModelRegistry(registryFileName).get(TEST_ENDPOINT, 'bogus') is None
+
+
+def test_ModelRegistry_corruptFile(registryFileName):
+    os.makedirs(os.path.dirname(registryFileName))
+    with open(registryFileName, 'w') as outputFile:
+        outputFile.write('{ not json')
+    registry = ModelRegistry(registryFileName)
+    assert registry.get(TEST_ENDPOINT, 'sonar') is None
+
+
+def test_ModelRegistry_refresh():
+    registry = ModelRegistry()
+    probed = [ ]
+
+    def checkModel(model):
+        probed.append(model)
+        if model == 'offline':
+            raise ConnectionError(model)
+        return registry.record(TEST_ENDPOINT, model, True)
+
+    client = SimpleNamespace(models = { 'sonar': None, 'sonar-pro': None, 'offline': None, }, checkModel = checkModel)
+    results = registry.refresh(client, background = False)
+    assert [ health.model for health in results ] == [ 'sonar', 'sonar-pro', ]
+
+    thread = registry.refresh(client, models = [ 'sonar', ])
+    thread.join()
+    assert probed[-1] == 'sonar'
+
+
+def test_ModelRegistry_unwritable():
+    with tempfile.TemporaryDirectory() as path:
+        blocker = os.path.join(path, 'blocker')
+        open(blocker, 'w').close()
+        registry = ModelRegistry(os.path.join(blocker, 'model-registry.json'))
+        health = registry.record(TEST_ENDPOINT, 'sonar', True)
+        assert registry.get(TEST_ENDPOINT, 'sonar') == health
+        assert os.listdir(path) == [ 'blocker', ]
@@ -1,12 +1,121 @@
 # See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
 
 
+from types import SimpleNamespace
+
+from perplexipy.responses import AsyncResponses
+from perplexipy.responses import Responses
+
+import asyncio
+
 import pytest
 
 
+# +++ constants +++
+
+TEST_CITATIONS = [ 'https://example.com/1', 'https://example.com/2', ]
+TEST_CONTENTS = ( 'The', None, ' answer', '', ' is', ' 42', )
+
+
+# +++ helpers +++
+
+def _chunks():
+    usage = SimpleNamespace(prompt_tokens = 5, completion_tokens = 4, total_tokens = 9)
+    for n, content in enumerate(TEST_CONTENTS):
+        last = n == len(TEST_CONTENTS)-1
+        yield SimpleNamespace(
+            choices = [ SimpleNamespace(delta = SimpleNamespace(content = content), finish_reason = 'stop' if last else None) ],
+            usage = usage if last else None,
+            citations = TEST_CITATIONS,
+        )
+    # Usage-only trailer, as sent by OpenAI-compatible services.
+    yield SimpleNamespace(choices = [ ], usage = usage)
+
+
+class _FakeStream:
+    def __init__(self):
+        self._chunks = _chunks()
+        self.closed = False
+
+
+    def __next__(self):
+        return next(self._chunks)
+
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeAsyncStream(_FakeStream):
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+    async def close(self):
+        self.closed = True
+
+
 # +++ tests +++
 
 @pytest.mark.skip('The classes and objects are tested in the main perplexipy module')
 def test_Responses():
     pass
 
+
+def test_Responses_iteration():
+    responses = Responses(_FakeStream())
+    assert list(responses) == [ 'The', ' answer', ' is', ' 42', ]
+    assert responses.done
+    assert responses.finishReason == 'stop'
+    assert responses.usage.total_tokens == 9
+    assert responses.citations == TEST_CITATIONS
+    assert not list(responses)
+
+
+def test_Responses_text():
+    responses = Responses(_FakeStream())
+    assert next(responses) == 'The'
+    assert responses.text() == 'The answer is 42'
+    assert responses.collect() == [ 'The', ' answer', ' is', ' 42', ]
+
+
+def test_Responses_close():
+    stream = _FakeStream()
+    with Responses(stream) as responses:
+        assert next(responses) == 'The'
+    assert stream.closed
+    assert responses.done
+    assert responses.finishReason is None
+    with pytest.raises(StopIteration):
+        next(responses)
+    responses.close()
+
+
+def test_AsyncResponses():
+    async def run():
+        responses = AsyncResponses(_FakeAsyncStream())
+        first = await responses.__anext__()
+        text = await responses.text()
+        return first, text, responses
+
+    first, text, responses = asyncio.run(run())
+    assert first == 'The'
+    assert text == 'The answer is 42'
+    assert responses.finishReason == 'stop'
+    assert responses.usage.completion_tokens == 4
+
+
+def test_AsyncResponses_close():
+    stream = _FakeAsyncStream()
+
+    async def run():
+        async with AsyncResponses(stream) as responses:
+            return [ await responses.__anext__() ], responses
+
+    chunks, responses = asyncio.run(run())
+    assert chunks == [ 'The', ]
+    assert stream.closed
+    assert responses.done
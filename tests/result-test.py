@@ -0,0 +1,131 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+from perplexipy import AsyncPerplexityClient
+from perplexipy import PerplexityClient
+from perplexipy.cache import MemoryCache
+from perplexipy.metrics import MetricsAggregator
+from perplexipy.mockserver import MOCKSERVER_CITATIONS
+from perplexipy.mockserver import MockServer
+from perplexipy.ratelimit import RateLimiter
+from perplexipy.result import QueryResult
+from perplexipy.result import ResultUsage
+from perplexipy.result import usageOf
+from perplexipy.singleflight import SingleFlight
+
+import asyncio
+import json
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-result'
+TEST_QUERY = 'Brief answer to the ultimate question about life, the Universe, and everything?'
+TEST_BODY = json.dumps({
+    'id': 'result-1',
+    'model': 'sonar',
+    'citations': [ 'https://example.com/a', 'https://example.com/b', ],
+    'search_results': [ { 'title': 'A', 'url': 'https://example.com/a', }, ],
+    'choices': [
+        { 'index': 0, 'message': { 'role': 'assistant', 'content': 'first', }, 'finish_reason': 'stop', },
+        { 'index': 1, 'message': { 'role': 'assistant', 'content': 'second', }, 'finish_reason': 'length', },
+    ],
+    'usage': { 'prompt_tokens': 3, 'completion_tokens': 1, 'total_tokens': 4, },
+}).encode('utf-8')
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def server():
+    with MockServer() as server:
+        yield server
+
+
+# +++ tests +++
+
+def test_QueryResult():
+    result = QueryResult(TEST_BODY)
+    assert not result.decoded
+    assert 'not decoded' in repr(result)
+    assert not hasattr(result, '__dict__')
+
+    assert result.text == 'first'
+    assert result.decoded
+    assert result.texts == ('first', 'second',)
+    assert result.finishReason == 'stop'
+    assert result.citations == ('https://example.com/a', 'https://example.com/b',)
+    assert result.searchResults[0]['title'] == 'A'
+    assert result.usage == ResultUsage(3, 1, 4)
+    assert result.model == 'sonar'
+    assert result.id == 'result-1'
+    assert str(result) == 'first'
+
+    empty = QueryResult('{"choices": []}')
+    assert empty.text == ''
+    assert empty.usage is None
+    assert empty.citations == ()
+    assert usageOf(TEST_BODY).total_tokens == 4
+    assert usageOf(object()) is None
+
+
+def test_usageOf():
+    assert usageOf(TEST_BODY) == ResultUsage(3, 1, 4)
+    assert usageOf(TEST_BODY.decode('utf-8')) == ResultUsage(3, 1, 4)
+    assert usageOf(b'{"choices": []}') is None
+    # Only the usage object is decoded.
+    assert usageOf(b'{"choices": [not JSON], "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3}}') == ResultUsage(1, 2, 3)
+    # Response text that mentions usage, and usage-like objects after the
+    # real one, fall back to decoding the whole body.
+    body = json.dumps({
+        'choices': [ { 'message': { 'content': '"usage": {"total_tokens": 99}', }, }, ],
+        'usage': { 'prompt_tokens': 3, 'completion_tokens': 1, 'total_tokens': 4, },
+        'search_results': [ { 'usage': 'CC-BY', }, ],
+    })
+    assert usageOf(body) == ResultUsage(3, 1, 4)
+
+
+def test_PerplexityClient_queryResult(server):
+    observer = MetricsAggregator()
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url, cache = MemoryCache(), observer = observer, rateLimiter = RateLimiter(tokensPerMinute = 100000))
+    result = client.queryResult(TEST_QUERY)
+    assert result.text == TEST_QUERY
+    assert result.citations == tuple(MOCKSERVER_CITATIONS)
+    assert result.searchResults[0]['url'] == MOCKSERVER_CITATIONS[0]
+    assert result.finishReason == 'stop'
+    assert result.usage.completion_tokens == len(TEST_QUERY.split())
+    assert observer.requests('queryResult', 'sonar') == 1
+    assert observer.histogram('completionTokens', 'queryResult', 'sonar').sum == len(TEST_QUERY.split())
+
+    # Cache hits keep the citations and usage, and don't mix with query().
+    cached = client.queryResult(TEST_QUERY)
+    assert cached.citations == result.citations
+    assert cached.usage == result.usage
+    assert server.requests == 1
+    assert client.query(TEST_QUERY) == TEST_QUERY
+    assert server.requests == 2
+
+
+def test_PerplexityClient_queryResultCoalesced(server):
+    server.latency = 0.2
+    client = PerplexityClient(key = TEST_KEY, endpoint = server.url, singleFlight = SingleFlight())
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        results = list(executor.map(lambda _: client.queryResult(TEST_QUERY), range(4)))
+    assert [ result.text for result in results ] == [ TEST_QUERY, ]*4
+    # Each caller gets its own result object.
+    assert len(set(map(id, results))) == 4
+    assert server.requests == 1
+
+
+def test_AsyncPerplexityClient_queryResult(server):
+    async def run():
+        client = AsyncPerplexityClient(key = TEST_KEY, endpoint = server.url)
+        return await client.queryResult(TEST_QUERY)
+
+    result = asyncio.run(run())
+    assert result.text == TEST_QUERY
+    assert result.citations == tuple(MOCKSERVER_CITATIONS)
@@ -0,0 +1,76 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.errors import PerplexityClientError
+from perplexipy.mockserver import MockServer
+from perplexipy.ratelimit import RateLimiter
+from perplexipy.routing import Backend
+from perplexipy.routing import RoutingClient
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-routing'
+TEST_QUERY = 'Route this query'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def servers():
+    with MockServer(latency = 0.05) as slow, MockServer() as fast:
+        yield slow, fast
+
+
+# +++ tests +++
+
+def test_RoutingClient(servers):
+    slow, fast = servers
+    client = RoutingClient([ Backend(TEST_KEY, slow.url), Backend(TEST_KEY, fast.url), ])
+    for _ in range(20):
+        assert client.query(TEST_QUERY, cache = False) == TEST_QUERY
+    # Both are measured, then the fast one gets the traffic.
+    assert slow.requests >= 1
+    assert fast.requests > 15
+    slowBackend, fastBackend = client.backends
+    assert slowBackend.latency > fastBackend.latency
+    assert slowBackend.errorRate == fastBackend.errorRate == 0.0
+    assert client.queryStreamable(TEST_QUERY).text() == TEST_QUERY
+
+    with pytest.raises(PerplexityClientError):
+        RoutingClient([ ])
+
+
+def test_RoutingClient_ejection(servers):
+    slow, fast = servers
+    fast.errorRate = 1.0
+    fast.errorStatus = 503
+    client = RoutingClient([ Backend(TEST_KEY, fast.url), Backend(TEST_KEY, slow.url), ], ejectAfter = 1, ejectSeconds = 60.0)
+    # Failures fail over to the healthy backend, and a backend that only
+    # failed isn't preferred anymore.
+    for _ in range(4):
+        assert client.query(TEST_QUERY, cache = False) == TEST_QUERY
+    failing, healthy = client.backends
+    assert failing.ejected
+    assert failing.errors == 1
+    assert failing.errorRate > healthy.errorRate
+    assert fast.errors == 1
+    assert slow.requests == 4
+
+    # All ejected:  fail open to the one that comes back first.
+    healthy.ejectedUntil = failing.ejectedUntil+1.0
+    fast.errorRate = 0.0
+    assert client.query(TEST_QUERY, cache = False) == TEST_QUERY
+    assert fast.requests == 1
+
+
+def test_RoutingClient_quota(servers):
+    slow, fast = servers
+    # One request per minute on the fast backend; the rest go to the slow one.
+    client = RoutingClient([ Backend(TEST_KEY, fast.url, rateLimiter = RateLimiter(requestsPerMinute = 1)), Backend(TEST_KEY, slow.url), ])
+    for _ in range(3):
+        client.query(TEST_QUERY, cache = False)
+    assert fast.requests == 1
+    assert slow.requests == 2
@@ -0,0 +1,110 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy import PerplexityClient
+from perplexipy.cache import CacheStats
+from perplexipy.cache import MemoryCache
+from perplexipy.mockserver import MockServer
+from perplexipy.similarity import SimilarityCache
+from perplexipy.similarity import shingles
+
+import os
+import random
+import tempfile
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-similarity'
+TEST_PREFIX = 'Give me a concise coding example and include URL references in reply this prompt: '
+TEST_SCOPE = 'scope'
+
+
+# +++ fixtures +++
+
+@pytest.fixture
+def indexFileName():
+    with tempfile.TemporaryDirectory() as path:
+        yield os.path.join(path, 'similarity.jsonl')
+
+
+# +++ tests +++
+
+def test_shingles():
+    assert shingles('How do I, reverse  a STRING?') == shingles('string reverse: how do i a')
+    assert shingles('') == frozenset()
+
+
+def test_SimilarityCache(indexFileName):
+    cache = SimilarityCache(indexFileName)
+    assert cache.get(TEST_SCOPE, 'How do I reverse a string in Java?') is None
+    cache.set(TEST_SCOPE, 'How do I reverse a string in Java?', 'StringBuilder')
+    assert cache.get(TEST_SCOPE, 'how do i reverse a string in java') == 'StringBuilder'
+    assert cache.get(TEST_SCOPE, 'In Java, how do I reverse a string!') == 'StringBuilder'
+    assert cache.get('other scope', 'How do I reverse a string in Java?') is None
+    # Per call threshold.
+    assert cache.get(TEST_SCOPE, 'How do I reverse a string in Kotlin?') is None
+    assert cache.get(TEST_SCOPE, 'How do I reverse a string in Kotlin?', threshold = 0.7) == 'StringBuilder'
+    assert cache.stats == CacheStats(3, 3, 1, 0)
+
+    # Persisted.
+    cache = SimilarityCache(indexFileName)
+    assert cache.get(TEST_SCOPE, 'in java: how do I reverse a string') == 'StringBuilder'
+
+    cache.clear()
+    assert cache.get(TEST_SCOPE, 'How do I reverse a string in Java?') is None
+    assert SimilarityCache(indexFileName).stats.entries == 0
+
+
+def test_SimilarityCache_boilerplate():
+    # A shared prefix doesn't make different questions similar.
+    cache = SimilarityCache()
+    for n in range(10):
+        cache.set(TEST_SCOPE, TEST_PREFIX+'question number %d about topic%d' % (n, n), n)
+    cache.set(TEST_SCOPE, TEST_PREFIX+'How do I reverse a string in Java?', 'java')
+    assert cache.get(TEST_SCOPE, TEST_PREFIX+'How do I reverse a string in Python?') is None
+    assert cache.get(TEST_SCOPE, TEST_PREFIX+'how do I reverse a string in Java') == 'java'
+
+
+def test_SimilarityCache_eviction(indexFileName):
+    cache = SimilarityCache(indexFileName, maxEntries = 4)
+    for n in range(12):
+        cache.set(TEST_SCOPE, 'prompt %d with words' % n, n)
+    assert cache.stats.entries == 4
+    assert cache.stats.evictions == 8
+    assert cache.get(TEST_SCOPE, 'prompt 0 with words') is None
+    assert cache.get(TEST_SCOPE, 'prompt 11 with words') == 11
+    # Compacted once the file held twice the entries.
+    with open(indexFileName) as inputFile:
+        assert len(inputFile.readlines()) <= 8
+    assert SimilarityCache(indexFileName, maxEntries = 4).stats.entries == 4
+
+
+def test_SimilarityCache_lookupTime():
+    words = [ 'word%d' % n for n in range(5000) ]
+    generator = random.Random(0)
+    cache = SimilarityCache()
+    prompts = [ ' '.join(generator.sample(words, 12)) for _ in range(20000) ]
+    for n, prompt in enumerate(prompts):
+        cache.set(TEST_SCOPE, prompt, n)
+    started = time.perf_counter()
+    for prompt in prompts[:1000]:
+        cache.get(TEST_SCOPE, prompt.upper())
+    assert (time.perf_counter()-started)/1000 < 0.001
+    assert cache.stats.hits == 1000
+
+
+def test_PerplexityClient_similarityCache():
+    with MockServer(response = 'cached answer') as server:
+        client = PerplexityClient(key = TEST_KEY, endpoint = server.url, cache = MemoryCache(), similarityCache = SimilarityCache())
+        assert client.query('How do I reverse a string in Java?') == 'cached answer'
+        assert client.query('how do I reverse a string in Java') == 'cached answer'
+        assert client.queryBatch('In Java: how do I reverse a string?') == ('cached answer',)
+        assert server.requests == 1
+        assert client.query('How do I reverse a string in Kotlin?', similarity = 0.99) == 'cached answer'
+        assert server.requests == 2
+        assert client.query('how do I reverse a string in Java', cache = False) == 'cached answer'
+        assert server.requests == 3
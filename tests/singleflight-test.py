@@ -0,0 +1,242 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from perplexipy import AsyncPerplexityClient
+from perplexipy import PerplexityClient
+from perplexipy.mockserver import MockServer
+from perplexipy.responses import Responses
+from perplexipy.singleflight import AsyncSingleFlight
+from perplexipy.singleflight import SingleFlight
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_KEY = 'pplx-singleflight'
+TEST_QUERY = 'Brief answer to the ultimate question about life, the Universe, and everything?'
+
+
+# +++ helpers +++
+
+def _chunk(content):
+    return SimpleNamespace(choices = [ SimpleNamespace(delta = SimpleNamespace(content = content), finish_reason = None) ], usage = None)
+
+
+class _FakeStream:
+    def __init__(self, contents, delay = 0.0):
+        self._chunks = iter([ _chunk(content) for content in contents ])
+        self._delay = delay
+        self.reads = 0
+        self.closed = False
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        time.sleep(self._delay)
+        self.reads += 1
+        return next(self._chunks)
+
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeAsyncStream(_FakeStream):
+    async def __anext__(self):
+        await asyncio.sleep(self._delay)
+        try:
+            return self.__next__()
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+    async def close(self):
+        self.closed = True
+
+
+# +++ tests +++
+
+def test_SingleFlight_do():
+    singleFlight = SingleFlight()
+    calls = [ ]
+    barrier = threading.Barrier(8)
+
+    def function():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    def call(_):
+        barrier.wait()
+        return singleFlight.do('key', function)
+
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        results = list(executor.map(call, range(8)))
+    assert results == [ 42, ]*8
+    assert len(calls) == 1
+    assert singleFlight.requests == 8
+    assert singleFlight.coalesced == 7
+
+    # Completed calls aren't cached.
+    assert singleFlight.do('key', function) == 42
+    assert len(calls) == 2
+
+
+def test_SingleFlight_doError():
+    singleFlight = SingleFlight()
+    barrier = threading.Barrier(4)
+
+    def function():
+        time.sleep(0.1)
+        raise ValueError('shared')
+
+    def call(_):
+        barrier.wait()
+        try:
+            singleFlight.do('key', function)
+        except ValueError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        assert list(executor.map(call, range(4))) == [ 'shared', ]*4
+    assert not singleFlight._calls
+
+
+def test_SingleFlight_stream():
+    singleFlight = SingleFlight()
+    upstream = _FakeStream([ 'a', 'b', 'c', ], delay = 0.01)
+    opened = [ ]
+    done = [ ]
+
+    def open():
+        opened.append(1)
+        return upstream, lambda usage, error: done.append(error)
+
+    first = Responses(singleFlight.stream('key', open))
+    assert next(first) == 'a'
+    late = Responses(singleFlight.stream('key', open))
+    assert first.collect() == [ 'a', 'b', 'c', ]
+    assert late.collect() == [ 'a', 'b', 'c', ]
+    assert len(opened) == 1
+    assert upstream.reads == 4
+    assert done == [ None, ]
+    assert not singleFlight._streams
+
+
+def test_SingleFlight_streamAbandoned():
+    singleFlight = SingleFlight()
+    upstream = _FakeStream([ 'a', 'b', 'c', ])
+    first = Responses(singleFlight.stream('key', lambda: (upstream, None)))
+    second = Responses(singleFlight.stream('key', lambda: (upstream, None)))
+    next(first)
+    first.close()
+    assert not upstream.closed
+    second.close()
+    assert upstream.closed
+    assert not singleFlight._streams
+
+
+def test_SingleFlight_streamOpenError():
+    singleFlight = SingleFlight()
+
+    def open():
+        raise ValueError('open')
+
+    with pytest.raises(ValueError):
+        singleFlight.stream('key', open)
+    assert not singleFlight._streams
+
+
+def test_AsyncSingleFlight():
+    async def run():
+        singleFlight = AsyncSingleFlight()
+        calls = [ ]
+
+        async def function():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 42
+
+        results = await asyncio.gather(*(singleFlight.do('key', function) for _ in range(8)))
+        assert results == [ 42, ]*8
+        assert len(calls) == 1
+        assert singleFlight.coalesced == 7
+
+        upstream = _FakeAsyncStream([ 'a', 'b', ], delay = 0.01)
+
+        async def open():
+            return upstream, None
+
+        async def read():
+            subscription = await singleFlight.stream('stream', open)
+            return [ chunk.choices[0].delta.content async for chunk in subscription ]
+
+        assert await asyncio.gather(read(), read(), read()) == [ [ 'a', 'b', ], ]*3
+        assert upstream.reads == 3
+
+    asyncio.run(run())
+
+
+def test_AsyncSingleFlight_leaderCancelled():
+    async def run():
+        singleFlight = AsyncSingleFlight()
+        calls = [ ]
+
+        async def function():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return len(calls)
+
+        leader = asyncio.ensure_future(singleFlight.do('key', function))
+        await asyncio.sleep(0.01)
+        followers = asyncio.gather(*(singleFlight.do('key', function) for _ in range(3)))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # One follower runs the call again for all of them.
+        assert await followers == [ 2, ]*3
+        assert len(calls) == 2
+        assert not singleFlight._calls
+
+    asyncio.run(run())
+
+
+def test_PerplexityClient_singleFlight():
+    with MockServer(latency = 0.2) as server:
+        client = PerplexityClient(key = TEST_KEY, endpoint = server.url, singleFlight = SingleFlight())
+        with ThreadPoolExecutor(max_workers = 8) as executor:
+            results = list(executor.map(lambda _: client.query(TEST_QUERY), range(8)))
+            assert results == [ TEST_QUERY, ]*8
+            assert server.requests == 1
+
+            streams = list(executor.map(lambda _: client.queryStreamable(TEST_QUERY).text(), range(8)))
+            assert streams == [ TEST_QUERY, ]*8
+            assert server.requests == 2
+
+
+def test_AsyncPerplexityClient_singleFlight():
+    async def run(url):
+        client = AsyncPerplexityClient(key = TEST_KEY, endpoint = url, singleFlight = AsyncSingleFlight())
+        results = await asyncio.gather(*(client.query(TEST_QUERY) for _ in range(8)))
+        assert results == [ TEST_QUERY, ]*8
+
+        async def read():
+            return await (await client.queryStreamable(TEST_QUERY)).text()
+
+        assert await asyncio.gather(*(read() for _ in range(4))) == [ TEST_QUERY, ]*4
+
+    with MockServer(latency = 0.2) as server:
+        asyncio.run(run(server.url))
+        assert server.requests == 2
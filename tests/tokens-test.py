@@ -0,0 +1,21 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy.tokens import estimateMessagesTokens
+from perplexipy.tokens import estimateTokens
+
+
+# +++ tests +++
+
+def test_estimateTokens():
+    assert not estimateTokens(None)
+    assert not estimateTokens('')
+    assert estimateTokens('a') == 1
+    assert estimateTokens('abcd') == 1
+    assert estimateTokens('abcde') == 2
+
+
+def test_estimateMessagesTokens():
+    messages = [ { 'role': 'system', 'content': 'Be precise.', }, { 'role': 'user', 'content': 'abcd'*10, }, ]
+    assert estimateMessagesTokens(messages) == 3+4+10+4
+    assert not estimateMessagesTokens([ ])
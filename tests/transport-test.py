@@ -0,0 +1,92 @@
+# See: https://github.com/CIME-Software/perplexipy/blob/master/LICENSE.txt
+
+
+from perplexipy import PERPLEXITY_API_KEY
+from perplexipy import PERPLEXITY_API_URL
+from perplexipy import PerplexityClient
+from perplexipy.errors import PerplexityClientError
+from perplexipy.mockserver import MockServer
+from perplexipy.transport import ConnectionPools
+from perplexipy.transport import PoolConfig
+from perplexipy.transport import connectionPools
+from perplexipy.transport import hasFreeConnection
+
+import importlib.util
+import threading
+import time
+
+import pytest
+
+
+# +++ constants +++
+
+TEST_ENDPOINT = 'http://localhost:8080'
+
+
+# +++ tests +++
+
+def test_PoolConfig():
+    config = PoolConfig()
+    assert config.maxConnections == 100
+    assert not config.http2
+    assert PoolConfig(maxConnections = 10).maxKeepaliveConnections == 20
+
+
+def test_ConnectionPools():
+    pools = ConnectionPools()
+    httpClient = pools.httpClient(PERPLEXITY_API_URL)
+    assert pools.httpClient(PERPLEXITY_API_URL) is httpClient
+    assert pools.httpClient(TEST_ENDPOINT) is not httpClient
+
+    pools.close()
+    assert httpClient.is_closed
+    assert pools.httpClient(PERPLEXITY_API_URL) is not httpClient
+    pools.close()
+
+
+def test_ConnectionPools_configure():
+    pools = ConnectionPools()
+    httpClient = pools.httpClient(TEST_ENDPOINT)
+    pools.configure(TEST_ENDPOINT, PoolConfig(maxConnections = 4, maxKeepaliveConnections = 2))
+    configured = pools.httpClient(TEST_ENDPOINT)
+    assert configured is not httpClient
+    client = PerplexityClient(key = PERPLEXITY_API_KEY, endpoint = TEST_ENDPOINT, httpClient = configured)
+    assert client._client._client is configured
+    pools.close()
+
+    if importlib.util.find_spec('h2') is None:
+        with pytest.raises(PerplexityClientError):
+            pools.configure(TEST_ENDPOINT, PoolConfig(http2 = True))
+    else:
+        pools.configure(TEST_ENDPOINT, PoolConfig(http2 = True))
+        assert pools.httpClient(TEST_ENDPOINT)
+        pools.close()
+
+
+def test_PerplexityClient_sharedPool():
+    client0 = PerplexityClient(key = PERPLEXITY_API_KEY)
+    client1 = PerplexityClient(key = PERPLEXITY_API_KEY)
+    assert client0._client._client is client1._client._client
+    assert client0._client._client is connectionPools.httpClient(PERPLEXITY_API_URL)
+
+    privatePools = ConnectionPools()
+    client2 = PerplexityClient(key = PERPLEXITY_API_KEY, httpClient = privatePools.httpClient(PERPLEXITY_API_URL))
+    assert client2._client._client is not client0._client._client
+    privatePools.close()
+
+
+def test_hasFreeConnection():
+    assert hasFreeConnection(None)
+    with MockServer(latency = 0.5) as server:
+        pools = ConnectionPools()
+        pools.configure(server.url, PoolConfig(maxConnections = 1))
+        httpClient = pools.httpClient(server.url)
+        assert hasFreeConnection(httpClient)
+        client = PerplexityClient(key = PERPLEXITY_API_KEY, endpoint = server.url, httpClient = httpClient)
+        query = threading.Thread(target = client.query, args = ( 'Hold the only connection', ))
+        query.start()
+        time.sleep(0.2)
+        assert not hasFreeConnection(httpClient)
+        query.join()
+        assert hasFreeConnection(httpClient)
+        pools.close()